@@ -0,0 +1,152 @@
+"""
+Контроль допуска запросов к инференсу.
+
+Перед постановкой в очередь модели оценивается, сколько запрос будет ждать:
+по скользящему среднему (EWMA) длительности и размера недавних батчей и
+текущей глубине очереди. Если очередь модели заполнена - 503, если оценка
+ожидания превышает дедлайн клиента (заголовок X-Request-Timeout-Ms) - 429.
+В обоих случаях клиент получает Retry-After и не тратит CPU на ответ,
+который он уже не дождется.
+"""
+import math
+import os
+import time
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from inference import InferenceQueueFull
+
+# Настройки допуска
+ADMISSION_EWMA_ALPHA = float(os.getenv("ADMISSION_EWMA_ALPHA", "0.2"))
+# Дедлайн по умолчанию, если клиент не прислал свой (0 - без дедлайна)
+ADMISSION_DEFAULT_TIMEOUT_MS = float(os.getenv("ADMISSION_DEFAULT_TIMEOUT_MS", "0"))
+# Время, которое нужно оставить после инференса на Gemini и Edamam
+ADMISSION_RESERVE_MS = float(os.getenv("ADMISSION_RESERVE_MS", "0"))
+
+WAIT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+ADMITTED_TOTAL = Counter("admission_admitted_total", "Запросы, допущенные к инференсу", ["model"])
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Запросы, отклоненные контролем допуска",
+    ["model", "reason"],
+)
+ESTIMATED_WAIT = Histogram(
+    "admission_estimated_wait_seconds",
+    "Оценка ожидания результата инференса в момент допуска",
+    ["model"],
+    buckets=WAIT_BUCKETS,
+)
+BATCH_TIME_EWMA = Gauge("admission_batch_seconds_ewma", "EWMA длительности батча", ["model"])
+
+# Причины отказа
+REASON_QUEUE_FULL = "queue_full"
+REASON_DEADLINE = "deadline"
+
+
+def deadline_from_timeout(timeout_ms: Optional[float], started_at: float) -> Optional[float]:
+    """
+    Абсолютный дедлайн (time.time()) по таймауту клиента.
+
+    Args:
+        timeout_ms: Значение X-Request-Timeout-Ms (None - взять значение по умолчанию)
+        started_at: Время начала обработки запроса
+    """
+    if timeout_ms is None or timeout_ms <= 0:
+        timeout_ms = ADMISSION_DEFAULT_TIMEOUT_MS
+    if timeout_ms <= 0:
+        return None
+    return started_at + timeout_ms / 1000.0
+
+
+class AdmissionController:
+    """
+    Решает, ставить ли изображения в очередь модели.
+
+    Args:
+        executor: InferenceExecutor (тип пула и текущий лимит параллельных проходов)
+        max_queue: Сколько изображений может ждать в очереди одной модели (0 - без ограничения)
+        alpha: Вес нового наблюдения в EWMA
+        reserve_ms: Время после инференса, которое нужно оставить в бюджете клиента
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_queue: int = None,
+        alpha: float = ADMISSION_EWMA_ALPHA,
+        reserve_ms: float = ADMISSION_RESERVE_MS,
+    ):
+        self.executor = executor
+        self.max_queue = executor.max_queue if max_queue is None else max_queue
+        self.alpha = min(max(alpha, 0.01), 1.0)
+        self.reserve = reserve_ms / 1000.0
+        self._batch_time: Dict[str, float] = {}
+        self._batch_size: Dict[str, float] = {}
+
+    def _ewma(self, values: Dict[str, float], model_name: str, value: float) -> float:
+        previous = values.get(model_name)
+        values[model_name] = value if previous is None else previous + self.alpha * (value - previous)
+        return values[model_name]
+
+    def observe(self, model_name: str, batch_size: int, duration: float):
+        """Учитывает завершенный батч модели."""
+        BATCH_TIME_EWMA.labels(model=model_name).set(self._ewma(self._batch_time, model_name, duration))
+        self._ewma(self._batch_size, model_name, batch_size)
+
+    def estimated_wait(self, model_name: str, pending: int, images: int = 1) -> float:
+        """
+        Оценка времени до результата для новых изображений в секундах.
+
+        Очередь разбирается со скоростью parallel * batch_size / batch_time
+        изображений в секунду, но не быстрее одного батча. Батчи одной модели
+        в пуле потоков идут по очереди (parallel = 1), параллельно выполняются
+        только батчи разных моделей; в пуле процессов у каждого процесса своя
+        копия модели (parallel = concurrency).
+        """
+        batch_time = self._batch_time.get(model_name)
+        if batch_time is None:
+            # Наблюдений еще нет - не отклоняем
+            return 0.0
+        batch_size = max(1.0, self._batch_size.get(model_name, 1.0))
+        parallel = self.executor.concurrency if self.executor.uses_processes else 1
+        throughput = parallel * batch_size / max(batch_time, 1e-6)
+        return max(batch_time, (pending + images) / throughput)
+
+    def admit(self, model_name: str, pending: int, images: int, deadline: Optional[float] = None):
+        """
+        Допускает изображения в очередь или выбрасывает InferenceQueueFull.
+
+        Args:
+            pending: Сколько изображений модели уже в очереди и в работе
+            images: Сколько изображений добавляет запрос
+            deadline: Абсолютный дедлайн клиента (time.time()) или None
+        """
+        wait = self.estimated_wait(model_name, pending, images)
+        ESTIMATED_WAIT.labels(model=model_name).observe(wait)
+        # Повторить имеет смысл, когда очередь успеет разобраться
+        retry_after = max(1, math.ceil(wait))
+
+        if self.max_queue and pending + images > self.max_queue:
+            ADMISSION_REJECTED.labels(model=model_name, reason=REASON_QUEUE_FULL).inc()
+            raise InferenceQueueFull(
+                f"Очередь модели {model_name} переполнена ({self.max_queue}), повторите запрос позже",
+                status_code=503,
+                retry_after=retry_after,
+                reason=REASON_QUEUE_FULL,
+            )
+
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if wait + self.reserve > remaining:
+                ADMISSION_REJECTED.labels(model=model_name, reason=REASON_DEADLINE).inc()
+                raise InferenceQueueFull(
+                    f"Ожидаемое время ответа {wait + self.reserve:.2f} с превышает дедлайн клиента "
+                    f"({max(remaining, 0):.2f} с), повторите запрос позже",
+                    status_code=429,
+                    retry_after=retry_after,
+                    reason=REASON_DEADLINE,
+                )
+
+        ADMITTED_TOTAL.labels(model=model_name).inc()
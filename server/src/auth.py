@@ -6,7 +6,9 @@ from typing import Optional
 import requests
 import os
 from dotenv import load_dotenv
-from database import get_db
+from database import get_db, get_async_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from models import User
 from schemas import GoogleToken, GoogleUserInfo, TokenData
@@ -38,25 +40,38 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Получает текущего пользователя по JWT токену"""
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_user_token(token: str) -> TokenData:
+    """Проверяет JWT токен и возвращает ID пользователя"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
-            raise credentials_exception
-        token_data = TokenData(user_id=user_id)
+            raise credentials_exception()
+        return TokenData(user_id=user_id)
     except JWTError:
-        raise credentials_exception
-    
+        raise credentials_exception()
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """Получает текущего пользователя по JWT токену"""
+    token_data = decode_user_token(token)
     user = db.query(User).filter(User.id == token_data.user_id).first()
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
+    return user
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """Получает текущего пользователя по JWT токену (асинхронная сессия)"""
+    token_data = decode_user_token(token)
+    user = await db.scalar(select(User).where(User.id == token_data.user_id))
+    if user is None:
+        raise credentials_exception()
     return user
 
 async def verify_google_token(token: str) -> GoogleUserInfo:
@@ -95,6 +110,23 @@ def get_or_create_user(db: Session, google_user: GoogleUserInfo) -> User:
     
     return user
 
+async def get_or_create_user_async(db: AsyncSession, google_user: GoogleUserInfo) -> User:
+    """Получает существующего пользователя или создает нового (асинхронная сессия)"""
+    user = await db.scalar(select(User).where(User.google_id == google_user.id))
+    
+    if not user:
+        user = User(
+            email=google_user.email,
+            google_id=google_user.id,
+            name=google_user.name,
+            picture=google_user.picture
+        )
+        db.add(user)
+        await db.commit()
+        await db.refresh(user)
+    
+    return user
+
 def create_user_token(user: User) -> dict:
     """Создает JWT токен для пользователя"""
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -0,0 +1,229 @@
+"""
+Экспортированные бэкенды инференса для CPU: ONNX Runtime и TorchScript.
+
+Модели экспортируются командой export_model.py и выбираются через
+MODEL_TYPES ("ONNX" или "TorchScript"). Оба бэкенда получают "сырой" выход
+детекционной головы YOLOv5/YOLOv8, поэтому letterbox, декодирование и NMS
+выполняются здесь на numpy.
+"""
+import ast
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Типы моделей, которые обслуживаются экспортированными бэкендами
+EXPORTED_MODEL_TYPES = ("ONNX", "TorchScript")
+
+# Настройки бэкендов
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 - по умолчанию ONNX Runtime
+EXPORT_IOU_THRESHOLD = float(os.getenv("EXPORT_IOU_THRESHOLD", "0.45"))
+EXPORT_MAX_DETECTIONS = int(os.getenv("EXPORT_MAX_DETECTIONS", "300"))
+
+
+def letterbox(image, size: int) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """
+    Вписывает изображение в квадрат size x size с сохранением пропорций.
+
+    Returns:
+        Tuple[array, ratio, (pad_w, pad_h)]: HWC uint8 массив, масштаб и отступы
+    """
+    if isinstance(image, np.ndarray):
+        # Уже подготовлено preprocessing.py под этот размер входа
+        if image.shape == (size, size, 3):
+            return image, 1.0, (0, 0)
+        image = Image.fromarray(image)
+    image = image.convert("RGB")
+    width, height = image.size
+    ratio = min(size / width, size / height)
+    new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+    if (new_w, new_h) != (width, height):
+        image = image.resize((new_w, new_h), Image.BILINEAR)
+    pad_w, pad_h = (size - new_w) / 2, (size - new_h) / 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    left, top = int(round(pad_w - 0.1)), int(round(pad_h - 0.1))
+    canvas[top:top + new_h, left:left + new_w] = np.asarray(image)
+    return canvas, ratio, (left, top)
+
+
+def xywh_to_xyxy(boxes: np.ndarray) -> np.ndarray:
+    out = np.empty_like(boxes)
+    out[:, 0] = boxes[:, 0] - boxes[:, 2] / 2
+    out[:, 1] = boxes[:, 1] - boxes[:, 3] / 2
+    out[:, 2] = boxes[:, 0] + boxes[:, 2] / 2
+    out[:, 3] = boxes[:, 1] + boxes[:, 3] / 2
+    return out
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """IoU одного бокса (4,) со всеми боксами (N, 4) в формате xyxy."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, max_det: int) -> np.ndarray:
+    """Жадный NMS, возвращает индексы оставленных боксов."""
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size and len(keep) < max_det:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        ious = box_iou(boxes[i], boxes[order[1:]])
+        order = order[1:][ious <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decode_predictions(
+    raw: np.ndarray,
+    head: str,
+    conf_threshold: float,
+    iou_threshold: float = EXPORT_IOU_THRESHOLD,
+    max_det: int = EXPORT_MAX_DETECTIONS,
+) -> np.ndarray:
+    """
+    Декодирует выход головы для одного изображения.
+
+    Args:
+        raw: (N, 5+nc) для YOLOv5 или (4+nc, N) для YOLOv8
+        head: "yolov5" или "yolov8"
+
+    Returns:
+        Массив (K, 6): x1, y1, x2, y2, conf, cls в координатах входа сети
+    """
+    if head == "yolov8":
+        raw = raw.T
+        boxes, class_scores = raw[:, :4], raw[:, 4:]
+        cls = class_scores.argmax(axis=1)
+        conf = class_scores[np.arange(len(cls)), cls]
+    else:
+        boxes, objectness, class_scores = raw[:, :4], raw[:, 4], raw[:, 5:]
+        cls = class_scores.argmax(axis=1)
+        conf = objectness * class_scores[np.arange(len(cls)), cls]
+
+    mask = conf >= conf_threshold
+    if not mask.any():
+        return np.zeros((0, 6), dtype=np.float32)
+    boxes, conf, cls = xywh_to_xyxy(boxes[mask]), conf[mask], cls[mask]
+
+    # NMS по классам: разносим боксы разных классов смещением
+    offsets = cls[:, None].astype(np.float32) * 7680.0
+    keep = nms(boxes + offsets, conf, iou_threshold, max_det)
+    return np.concatenate(
+        [boxes[keep], conf[keep, None], cls[keep, None].astype(np.float32)], axis=1
+    ).astype(np.float32)
+
+
+def scale_boxes(pred: np.ndarray, ratio: float, pad: Tuple[float, float], shape: Tuple[int, int]) -> np.ndarray:
+    """Переводит боксы из координат входа сети в координаты исходного изображения."""
+    if not len(pred):
+        return pred
+    pred[:, [0, 2]] = (pred[:, [0, 2]] - pad[0]) / ratio
+    pred[:, [1, 3]] = (pred[:, [1, 3]] - pad[1]) / ratio
+    height, width = shape
+    pred[:, [0, 2]] = pred[:, [0, 2]].clip(0, width)
+    pred[:, [1, 3]] = pred[:, [1, 3]].clip(0, height)
+    return pred
+
+
+def parse_metadata(metadata: Dict[str, str]) -> Dict[str, Any]:
+    """Разбирает метаданные экспорта (names может быть JSON или repr словаря)."""
+    names = metadata.get("names", "{}")
+    try:
+        names = json.loads(names)
+    except ValueError:
+        names = ast.literal_eval(names)
+    return {
+        "names": {int(k): v for k, v in names.items()},
+        "imgsz": int(metadata.get("imgsz", 640)),
+        "head": metadata.get("head", "yolov5"),
+    }
+
+
+class ExportedBackend:
+    """Общая часть ONNX и TorchScript бэкендов: препроцессинг, NMS, масштаб боксов."""
+
+    def __init__(self, names: Dict[int, str], imgsz: int, head: str):
+        self.names = names
+        self.imgsz = imgsz
+        self.head = head
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        """Прямой проход по батчу (B, 3, H, W) float32, возвращает сырой выход головы."""
+        raise NotImplementedError
+
+    def predict(self, images: List[Any], conf_threshold: float) -> List[np.ndarray]:
+        """Детекции (K, 6) для каждого изображения в координатах исходного изображения."""
+        prepared = []
+        for image in images:
+            shape = image.shape[:2] if isinstance(image, np.ndarray) else (image.size[1], image.size[0])
+            array, ratio, pad = letterbox(image, self.imgsz)
+            prepared.append((array, ratio, pad, shape))
+
+        batch = np.stack([p[0] for p in prepared]).transpose(0, 3, 1, 2)
+        batch = np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+        raw = self.forward(batch)
+
+        return [
+            scale_boxes(decode_predictions(raw[i], self.head, conf_threshold), ratio, pad, shape)
+            for i, (_, ratio, pad, shape) in enumerate(prepared)
+        ]
+
+
+class OnnxBackend(ExportedBackend):
+    """Граф ONNX, исполняемый ONNX Runtime на CPU."""
+
+    def __init__(self, model_path: str):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = parse_metadata(self.session.get_modelmeta().custom_metadata_map)
+        super().__init__(**metadata)
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class TorchScriptBackend(ExportedBackend):
+    """Трассированный граф TorchScript (опционально с динамическим int8)."""
+
+    def __init__(self, model_path: str):
+        import torch
+
+        extra_files = {"config.txt": ""}
+        self.module = torch.jit.load(model_path, map_location="cpu", _extra_files=extra_files)
+        self.module.eval()
+        metadata = parse_metadata(json.loads(extra_files["config.txt"] or "{}"))
+        super().__init__(**metadata)
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        import torch
+
+        with torch.inference_mode():
+            output = self.module(torch.from_numpy(batch))
+        if isinstance(output, (list, tuple)):
+            output = output[0]
+        return output.numpy()
+
+
+def load_exported_backend(model_type: str, model_path: str) -> ExportedBackend:
+    """Создает бэкенд по типу модели из MODEL_TYPES."""
+    if model_type == "ONNX":
+        return OnnxBackend(model_path)
+    if model_type == "TorchScript":
+        return TorchScriptBackend(model_path)
+    raise ValueError(f"Неизвестный тип экспортированной модели: {model_type}")
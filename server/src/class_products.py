@@ -0,0 +1,129 @@
+"""
+Быстрый путь без Gemini: класс YOLO -> каноническое название продукта.
+
+Если все детекции класса уверенные (не ниже порога класса из таблицы),
+название продукта берется из таблицы. Один такой класс на фото - запрос к
+Gemini не выполняется. Детекции всегда делятся на продукты по классам:
+классы из таблицы называются по ней, остальные группы детекций называет
+Gemini. Таблица - JSON вида
+    {"apple": {"product": "apple", "threshold": 0.6}, ...}
+(путь CLASS_PRODUCT_MAP_PATH). CLASS_PRODUCT_FAST_PATH=false - таблица не
+используется и Gemini называет каждую группу.
+
+Метрика class_product_detections_total{class_name, result} показывает
+долю детекций каждого класса, прошедших без Gemini, - по ней подбираются
+пороги.
+"""
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from prometheus_client import Counter
+
+# Настройки
+CLASS_PRODUCT_FAST_PATH = os.getenv("CLASS_PRODUCT_FAST_PATH", "true").lower() == "true"
+CLASS_PRODUCT_MAP_PATH = os.getenv(
+    "CLASS_PRODUCT_MAP_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "class_products.json")
+)
+CLASS_PRODUCT_DEFAULT_THRESHOLD = float(os.getenv("CLASS_PRODUCT_DEFAULT_THRESHOLD", "0.7"))
+
+# result: bypass - продукт взят из таблицы, low_confidence - ниже порога, unmapped - класса нет в таблице
+CLASS_DETECTIONS = Counter(
+    "class_product_detections_total", "Детекции по классам и решению быстрого пути", ["class_name", "result"]
+)
+# result: bypass - все продукты из таблицы, partial - часть групп назвал Gemini, gemini - все назвал Gemini
+GEMINI_BYPASS = Counter("gemini_bypass_total", "Изображения, названные без Gemini или с ним", ["result"])
+
+
+class ClassProduct(NamedTuple):
+    product: str
+    threshold: float
+
+
+class PlateProducts(NamedTuple):
+    products: Dict[str, int]  # продукт из таблицы -> число детекций
+    unresolved: List[List[Dict[str, Any]]]  # группы детекций (по классам), которые называет Gemini
+
+
+def load_class_products(
+    path: str = CLASS_PRODUCT_MAP_PATH, default_threshold: float = CLASS_PRODUCT_DEFAULT_THRESHOLD
+) -> Dict[str, ClassProduct]:
+    if not path or not os.path.exists(path):
+        print(f"Таблица классов не найдена: {path}, быстрый путь без Gemini отключен")
+        return {}
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    mapping = {}
+    for class_name, entry in data.items():
+        if class_name.startswith("_"):
+            continue
+        if isinstance(entry, str):
+            entry = {"product": entry}
+        mapping[class_name] = ClassProduct(entry["product"], float(entry.get("threshold", default_threshold)))
+    return mapping
+
+
+class ClassProductResolver:
+    """
+    Решает, можно ли назвать продукт по классам детекций.
+
+    Args:
+        mapping: Класс -> ClassProduct
+        enabled: False - все группы детекций называет Gemini
+    """
+
+    def __init__(self, mapping: Dict[str, ClassProduct], enabled: bool = CLASS_PRODUCT_FAST_PATH):
+        self.mapping = mapping
+        self.enabled = enabled and bool(mapping)
+
+    def _class_product(self, class_name: str, detections: List[Dict[str, Any]]) -> Optional[str]:
+        """Продукт класса из таблицы, если все его детекции не ниже порога."""
+        entry = self.mapping.get(class_name) if self.enabled else None
+        if entry is None:
+            results = ["unmapped"] * len(detections)
+        else:
+            results = ["bypass" if d["confidence"] >= entry.threshold else "low_confidence" for d in detections]
+        for result in set(results):
+            CLASS_DETECTIONS.labels(class_name=class_name, result=result).inc(results.count(result))
+        if entry is not None and all(result == "bypass" for result in results):
+            return entry.product
+        return None
+
+    def resolve(self, detections: List[Dict[str, Any]]) -> Optional[PlateProducts]:
+        """
+        Продукты на фото по классам детекций или None, если детекций нет
+        (тогда Gemini называет все фото).
+
+        Классы с уверенными детекциями получают продукт из таблицы, детекции
+        остальных классов (при выключенном быстром пути - всех) возвращаются
+        группами в unresolved - каждую группу называет Gemini. Так 1 курица и
+        2 порции картофеля остаются двумя продуктами и без таблицы.
+        """
+        if not detections:
+            GEMINI_BYPASS.labels(result="gemini").inc()
+            return None
+
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for detection in detections:
+            groups.setdefault(detection["class_name"], []).append(detection)
+
+        products: Dict[str, int] = {}
+        unresolved = []
+        for class_name, items in groups.items():
+            product = self._class_product(class_name, items)
+            if product is None:
+                unresolved.append(items)
+            else:
+                products[product] = products.get(product, 0) + len(items)
+
+        GEMINI_BYPASS.labels(result="gemini" if not products else "partial" if unresolved else "bypass").inc()
+        return PlateProducts(dict(sorted(products.items(), key=lambda item: -item[1])), unresolved)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "classes": {name: entry._asdict() for name, entry in self.mapping.items()},
+        }
+
+
+class_product_resolver = ClassProductResolver(load_class_products())
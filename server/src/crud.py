@@ -1,7 +1,10 @@
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from models import User, UserProfile, WeightHistory, WaterHistory
+from models import User, UserProfile, WeightHistory, WaterHistory, WaterDaily
 from schemas import UserCreate, UserProfileCreate, UserProfileUpdate
-from datetime import datetime
+from datetime import date, datetime
 import uuid
 
 # CRUD операции для пользователей
@@ -81,6 +84,20 @@ def get_weight_history(db: Session, profile_id: str, limit: int = 30):
         .all()
 
 # CRUD операции для истории воды
+def water_daily_upsert(dialect_name: str, profile_id: str, day: date, amount: float):
+    """Прибавляет запись к сумме за день в water_daily (одним запросом, без гонки между воркерами)"""
+    dialect = {"postgresql": postgresql, "sqlite": sqlite}.get(dialect_name)
+    if dialect is None:
+        raise RuntimeError(f"Неподдерживаемая БД: {dialect_name}")
+    stmt = dialect.insert(WaterDaily).values(profile_id=profile_id, day=day, total_ml=amount, count=1)
+    return stmt.on_conflict_do_update(
+        index_elements=[WaterDaily.profile_id, WaterDaily.day],
+        set_={
+            "total_ml": WaterDaily.total_ml + stmt.excluded.total_ml,
+            "count": WaterDaily.count + stmt.excluded.count,
+        },
+    )
+
 def add_water_record(db: Session, profile_id: str, amount: float):
     db_record = WaterHistory(
         id=str(uuid.uuid4()),
@@ -89,6 +106,8 @@ def add_water_record(db: Session, profile_id: str, amount: float):
         date=datetime.utcnow()
     )
     db.add(db_record)
+    # Запись и сумма за день фиксируются одной транзакцией
+    db.execute(water_daily_upsert(db.get_bind().dialect.name, profile_id, db_record.date.date(), amount))
     db.commit()
     db.refresh(db_record)
     return db_record
@@ -102,9 +121,136 @@ def get_water_history(db: Session, profile_id: str, limit: int = 30):
 
 def get_today_water_amount(db: Session, profile_id: str):
     today = datetime.utcnow().date()
-    records = db.query(WaterHistory)\
+    amount = db.scalar(
+        select(WaterDaily.total_ml).where(WaterDaily.profile_id == profile_id, WaterDaily.day == today)
+    )
+    return amount or 0.0
+
+def get_water_daily(db: Session, profile_id: str, start: date, end: date):
+    """Суммы воды по дням с start по end включительно (дни без записей пропускаются)"""
+    return db.query(WaterDaily)\
         .filter(
-            WaterHistory.profile_id == profile_id,
-            WaterHistory.date >= today
-        ).all()
-    return sum(record.amount for record in records) 
\ No newline at end of file
+            WaterDaily.profile_id == profile_id,
+            WaterDaily.day >= start,
+            WaterDaily.day <= end
+        )\
+        .order_by(WaterDaily.day)\
+        .all()
+
+# Асинхронные варианты (AsyncSession, для обработчиков запросов)
+async def get_user_async(db: AsyncSession, user_id: str):
+    return await db.scalar(select(User).where(User.id == user_id))
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    return await db.scalar(select(User).where(User.email == email))
+
+async def get_user_by_google_id_async(db: AsyncSession, google_id: str):
+    return await db.scalar(select(User).where(User.google_id == google_id))
+
+async def create_user_async(db: AsyncSession, user: UserCreate):
+    db_user = User(
+        id=str(uuid.uuid4()),
+        email=user.email,
+        google_id=user.google_id,
+        name=user.name,
+        picture=user.picture
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def update_user_async(db: AsyncSession, user_id: str, user_data: dict):
+    db_user = await get_user_async(db, user_id)
+    if db_user:
+        for key, value in user_data.items():
+            setattr(db_user, key, value)
+        await db.commit()
+        await db.refresh(db_user)
+    return db_user
+
+async def get_user_profile_async(db: AsyncSession, user_id: str):
+    return await db.scalar(select(UserProfile).where(UserProfile.user_id == user_id))
+
+async def create_user_profile_async(db: AsyncSession, user_id: str, profile: UserProfileCreate):
+    db_profile = UserProfile(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        **profile.dict(exclude_unset=True)
+    )
+    db.add(db_profile)
+    await db.commit()
+    await db.refresh(db_profile)
+    return db_profile
+
+async def update_user_profile_async(db: AsyncSession, user_id: str, profile: UserProfileUpdate):
+    db_profile = await get_user_profile_async(db, user_id)
+    if db_profile:
+        for key, value in profile.dict(exclude_unset=True).items():
+            setattr(db_profile, key, value)
+        await db.commit()
+        await db.refresh(db_profile)
+    return db_profile
+
+async def add_weight_record_async(db: AsyncSession, profile_id: str, weight: float):
+    db_record = WeightHistory(
+        id=str(uuid.uuid4()),
+        profile_id=profile_id,
+        weight=weight,
+        date=datetime.utcnow()
+    )
+    db.add(db_record)
+    await db.commit()
+    await db.refresh(db_record)
+    return db_record
+
+async def get_weight_history_async(db: AsyncSession, profile_id: str, limit: int = 30):
+    result = await db.scalars(
+        select(WeightHistory)
+        .where(WeightHistory.profile_id == profile_id)
+        .order_by(WeightHistory.date.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+async def add_water_record_async(db: AsyncSession, profile_id: str, amount: float):
+    db_record = WaterHistory(
+        id=str(uuid.uuid4()),
+        profile_id=profile_id,
+        amount=amount,
+        date=datetime.utcnow()
+    )
+    db.add(db_record)
+    # Запись и сумма за день фиксируются одной транзакцией
+    await db.execute(water_daily_upsert(db.bind.dialect.name, profile_id, db_record.date.date(), amount))
+    await db.commit()
+    await db.refresh(db_record)
+    return db_record
+
+async def get_water_history_async(db: AsyncSession, profile_id: str, limit: int = 30):
+    result = await db.scalars(
+        select(WaterHistory)
+        .where(WaterHistory.profile_id == profile_id)
+        .order_by(WaterHistory.date.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+async def get_today_water_amount_async(db: AsyncSession, profile_id: str):
+    today = datetime.utcnow().date()
+    amount = await db.scalar(
+        select(WaterDaily.total_ml).where(WaterDaily.profile_id == profile_id, WaterDaily.day == today)
+    )
+    return amount or 0.0
+
+async def get_water_daily_async(db: AsyncSession, profile_id: str, start: date, end: date):
+    result = await db.scalars(
+        select(WaterDaily)
+        .where(
+            WaterDaily.profile_id == profile_id,
+            WaterDaily.day >= start,
+            WaterDaily.day <= end
+        )
+        .order_by(WaterDaily.day)
+    )
+    return result.all()
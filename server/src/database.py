@@ -1,7 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from prometheus_client import Counter, Gauge, Histogram
 import os
+import time
+import uuid
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env файла
@@ -17,12 +22,112 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "cleem_db")
 # Формируем URL для подключения к PostgreSQL
 SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-# Создаем движок SQLAlchemy
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Асинхронный драйвер asyncpg для обработчиков запросов
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+
+# Настройки пула соединений (у каждого движка в каждом воркере свой пул:
+# DB_POOL_SIZE + DB_MAX_OVERFLOW соединений на движок)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT_SEC = float(os.getenv("DB_POOL_TIMEOUT_SEC", "10"))
+DB_POOL_RECYCLE_SEC = int(os.getenv("DB_POOL_RECYCLE_SEC", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# PgBouncer в режиме transaction pooling: соединения сервера меняются между
+# транзакциями, поэтому кэш подготовленных выражений asyncpg отключается
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Время получения соединения из пула (ожидание, подключение, pre-ping)",
+    ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Соединение не получено за DB_POOL_TIMEOUT_SEC", ["engine"])
+POOL_OVERFLOW_CONNECTIONS = Counter(
+    "db_pool_overflow_connections_total", "Соединения, открытые сверх DB_POOL_SIZE", ["engine"]
+)
+POOL_CONNECTIONS = Gauge("db_pool_connections", "Соединения пула", ["engine", "state"])
+
+
+class PoolMetricsMixin:
+    """Пул с метриками: время получения соединения, таймауты, overflow."""
+
+    metrics_name = "sync"
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.labels(engine=self.metrics_name).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.labels(engine=self.metrics_name).observe(time.perf_counter() - started_at)
+
+    def _create_connection(self):
+        # Счетчик overflow в QueuePool начинается с -pool_size и растет с каждым новым соединением
+        if self._overflow > 0:
+            POOL_OVERFLOW_CONNECTIONS.labels(engine=self.metrics_name).inc()
+        return super()._create_connection()
+
+
+class InstrumentedQueuePool(PoolMetricsMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class InstrumentedAsyncQueuePool(PoolMetricsMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def register_pool_metrics(name, get_pool):
+    """Gauge по текущему пулу движка (после dispose() пул пересоздается)."""
+    POOL_CONNECTIONS.labels(engine=name, state="in_use").set_function(lambda: get_pool().checkedout())
+    POOL_CONNECTIONS.labels(engine=name, state="idle").set_function(lambda: get_pool().checkedin())
+    POOL_CONNECTIONS.labels(engine=name, state="overflow").set_function(lambda: max(0, get_pool().overflow()))
+
+
+def pool_options(poolclass):
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SEC,
+        "pool_recycle": DB_POOL_RECYCLE_SEC,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def async_connect_args():
+    if not DB_PGBOUNCER:
+        return {}
+    return {
+        # Без кэшей подготовленных выражений asyncpg и SQLAlchemy
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        # Уникальные имена, чтобы выражения разных клиентов не конфликтовали на одном соединении сервера
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+    }
+
+
+# Создаем движок SQLAlchemy (синхронный - для Alembic, create_all и скриптов)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(InstrumentedQueuePool))
 
 # Создаем фабрику сессий
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок: ожидание БД не блокирует event loop воркера
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    connect_args=async_connect_args(),
+    **pool_options(InstrumentedAsyncQueuePool),
+)
+
+register_pool_metrics("sync", lambda: engine.pool)
+register_pool_metrics("async", lambda: async_engine.sync_engine.pool)
+
+# Объекты остаются доступны после commit (ленивая загрузка в async-сессии недоступна)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Создаем базовый класс для моделей
 Base = declarative_base()
 
@@ -32,4 +137,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
+        db.close()
+
+# Асинхронная сессия для обработчиков запросов
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
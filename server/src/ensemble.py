@@ -0,0 +1,128 @@
+"""
+Ансамбль моделей для /analyze (model_name=all).
+
+Изображение препроцессируется один раз, все зарегистрированные модели
+получают один и тот же буфер и выполняются параллельно. Их детекции
+объединяются взвешенным слиянием боксов (Weighted Box Fusion): пересекающиеся
+боксы одного класса не отбрасываются, как в NMS, а усредняются с весами
+по уверенности.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backends import box_iou
+from inference import filter_predictions
+
+# Имя "модели" для ансамбля в параметре model_name
+ENSEMBLE_MODEL_NAME = "all"
+
+# Настройки слияния
+ENSEMBLE_IOU_THRESHOLD = float(os.getenv("ENSEMBLE_IOU_THRESHOLD", "0.55"))
+# Веса моделей в формате "model1=1.0,model2=1.0" (по умолчанию все равны 1)
+ENSEMBLE_WEIGHTS = os.getenv("ENSEMBLE_WEIGHTS", "")
+
+
+def parse_weights(spec: str = ENSEMBLE_WEIGHTS) -> Dict[str, float]:
+    weights = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            weights[name.strip()] = float(value)
+    return weights
+
+
+def unify_classes(results: List[Tuple[np.ndarray, Dict[int, str]]]) -> Tuple[List[np.ndarray], Dict[int, str]]:
+    """
+    Приводит номера классов разных моделей к общему словарю по имени класса.
+
+    Returns:
+        Tuple[predictions, names]: предсказания с общими номерами классов и общий словарь
+    """
+    name_to_id: Dict[str, int] = {}
+    unified = []
+    for pred, names in results:
+        pred = pred.copy()
+        if len(pred):
+            lookup = {}
+            for cls in np.unique(pred[:, 5]).astype(int):
+                name = names.get(cls, str(cls))
+                lookup[cls] = name_to_id.setdefault(name, len(name_to_id))
+            pred[:, 5] = [lookup[int(cls)] for cls in pred[:, 5]]
+        unified.append(pred)
+    return unified, {class_id: name for name, class_id in name_to_id.items()}
+
+
+def weighted_box_fusion(
+    predictions: List[np.ndarray],
+    weights: Optional[List[float]] = None,
+    iou_threshold: float = ENSEMBLE_IOU_THRESHOLD,
+) -> np.ndarray:
+    """
+    Сливает детекции нескольких моделей одного изображения.
+
+    Args:
+        predictions: Массивы (N, 6) x1, y1, x2, y2, conf, cls с общими номерами классов
+        weights: Вес каждой модели
+        iou_threshold: Минимальный IoU бокса со слитым боксом того же класса
+
+    Returns:
+        Массив (K, 6), отсортированный по убыванию уверенности
+    """
+    if weights is None:
+        weights = [1.0] * len(predictions)
+    total_weight = float(sum(weights))
+    parts = [(pred, weight) for pred, weight in zip(predictions, weights) if len(pred)]
+    if not parts:
+        return np.zeros((0, 6), dtype=np.float32)
+
+    data = np.concatenate([pred[:, :6] for pred, _ in parts]).astype(np.float64)
+    model_weights = np.concatenate([np.full(len(pred), weight) for pred, weight in parts])
+    boxes, scores, classes = data[:, :4], data[:, 4] * model_weights, data[:, 5]
+
+    # Кластеры: индексы исходных боксов, слитый бокс и класс каждого кластера
+    clusters: List[List[int]] = []
+    fused_boxes = np.zeros((len(data), 4))
+    fused_classes = np.full(len(data), -1.0)
+    for i in np.argsort(-scores):
+        candidates = np.flatnonzero(fused_classes[:len(clusters)] == classes[i])
+        if candidates.size:
+            ious = box_iou(boxes[i], fused_boxes[candidates])
+            best = int(ious.argmax())
+            if ious[best] > iou_threshold:
+                cluster = candidates[best]
+                clusters[cluster].append(i)
+                members = clusters[cluster]
+                fused_boxes[cluster] = np.average(boxes[members], axis=0, weights=scores[members])
+                continue
+        fused_boxes[len(clusters)] = boxes[i]
+        fused_classes[len(clusters)] = classes[i]
+        clusters.append([i])
+
+    fused = np.zeros((len(clusters), 6), dtype=np.float32)
+    for index, members in enumerate(clusters):
+        member_weight = model_weights[members].sum()
+        # Средняя уверенность, пониженная, если бокс нашли не все модели
+        confidence = scores[members].sum() / member_weight * min(member_weight, total_weight) / total_weight
+        fused[index, :4] = fused_boxes[index]
+        fused[index, 4] = confidence
+        fused[index, 5] = fused_classes[index]
+    return fused[np.argsort(-fused[:, 4])]
+
+
+def fuse_predictions(
+    results: List[Tuple[np.ndarray, Dict[int, str]]],
+    weights: Optional[List[float]] = None,
+    iou_threshold: float = ENSEMBLE_IOU_THRESHOLD,
+    conf_threshold: float = 0.0,
+) -> Tuple[np.ndarray, Dict[int, str]]:
+    """
+    Результаты моделей (pred, names) для одного изображения -> слитые (pred, names).
+
+    Слияние понижает уверенность боксов, найденных не всеми моделями, поэтому
+    порог запроса применяется еще раз уже к слитым боксам.
+    """
+    predictions, names = unify_classes(results)
+    fused = weighted_box_fusion(predictions, weights, iou_threshold)
+    return filter_predictions(fused, conf_threshold), names
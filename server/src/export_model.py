@@ -0,0 +1,254 @@
+"""
+Экспорт моделей YOLO в ONNX / TorchScript и сравнение с PyTorch.
+
+Экспортированный файл подключается через MODEL1_TYPE/MODEL2_TYPE
+("ONNX" или "TorchScript") и MODEL1_PATH/MODEL2_PATH.
+
+Примеры:
+    python export_model.py --weights best.pt --type YOLOv5 --format onnx --int8
+    python export_model.py --weights best.pt --type YOLOv5 --format onnx \\
+        --compare-images ./samples --report export_report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from backends import box_iou
+from inference import YOLOV5_PATH, build_detections, load_weights, run_batch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_torch_module(weights: str, model_type: str) -> Tuple[Any, Dict[int, str], str]:
+    """
+    Загружает PyTorch-модель и возвращает "сырой" модуль без NMS.
+
+    Returns:
+        Tuple[module, names, head]: nn.Module, имена классов и тип головы
+    """
+    if model_type == "YOLOv5":
+        sys.path.append(YOLOV5_PATH)
+        hub_model = load_weights("YOLOv5", weights)
+        # AutoShape -> DetectMultiBackend -> DetectionModel
+        module = hub_model.model.model
+        names, head = hub_model.names, "yolov5"
+    else:
+        from ultralytics import YOLO
+        yolo = YOLO(weights)
+        module = yolo.model
+        names, head = yolo.names, "yolov8"
+
+    # В режиме export голова Detect возвращает один тензор предсказаний
+    for layer in module.modules():
+        if type(layer).__name__ == "Detect":
+            layer.export = True
+    module = module.float().eval()
+
+    if isinstance(names, (list, tuple)):
+        names = dict(enumerate(names))
+    return module, {int(k): v for k, v in names.items()}, head
+
+
+def export_metadata(names: Dict[int, str], imgsz: int, head: str) -> Dict[str, str]:
+    return {"names": json.dumps(names), "imgsz": str(imgsz), "head": head}
+
+
+def export_onnx(module, metadata: Dict[str, str], imgsz: int, output: str, int8: bool) -> str:
+    """Экспортирует модуль в ONNX с динамическим батчем (и опционально int8)."""
+    import onnx
+    import torch
+
+    dummy = torch.zeros(1, 3, imgsz, imgsz)
+    torch.onnx.export(
+        module,
+        dummy,
+        output,
+        opset_version=12,
+        input_names=["images"],
+        output_names=["output"],
+        dynamic_axes={"images": {0: "batch"}, "output": {0: "batch"}},
+    )
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        base, ext = os.path.splitext(output)
+        fp32_output = f"{base}.fp32{ext or '.onnx'}"
+        os.replace(output, fp32_output)
+        quantize_dynamic(fp32_output, output, weight_type=QuantType.QUInt8)
+
+    # Метаданные (классы, размер входа, тип головы) читает OnnxBackend
+    graph = onnx.load(output)
+    for key, value in metadata.items():
+        prop = graph.metadata_props.add()
+        prop.key, prop.value = key, value
+    onnx.save(graph, output)
+    return output
+
+
+def export_torchscript(module, metadata: Dict[str, str], imgsz: int, output: str) -> str:
+    """Трассирует модуль в TorchScript (без квантизации)."""
+    import torch
+
+    dummy = torch.zeros(1, 3, imgsz, imgsz)
+    with torch.inference_mode():
+        traced = torch.jit.trace(module, dummy, strict=False)
+    traced.save(output, _extra_files={"config.txt": json.dumps(metadata)})
+    return output
+
+
+def list_images(path: str) -> List[str]:
+    if os.path.isfile(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def match_detections(reference: List[Dict[str, Any]], candidate: List[Dict[str, Any]], iou_threshold: float = 0.5):
+    """Жадно сопоставляет детекции одного класса по IoU, возвращает пары (ref, cand, iou)."""
+    matches = []
+    used = set()
+    for ref in sorted(reference, key=lambda d: -d["confidence"]):
+        free = [i for i, c in enumerate(candidate) if i not in used and c["class_id"] == ref["class_id"]]
+        if not free:
+            continue
+        ious = box_iou(np.array(ref["bbox"]), np.array([candidate[i]["bbox"] for i in free]))
+        best = int(ious.argmax())
+        if ious[best] >= iou_threshold:
+            used.add(free[best])
+            matches.append((ref, candidate[free[best]], float(ious[best])))
+    return matches
+
+
+def _timed(model, model_type: str, image, conf: float, runs: int) -> Tuple[List[Dict[str, Any]], List[float]]:
+    timings = []
+    detections = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        preds, names = run_batch(model, model_type, [image], [conf])
+        detections = build_detections(preds[0], names)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return detections, timings
+
+
+def _latency_summary(timings: List[float]) -> Dict[str, float]:
+    array = np.array(timings)
+    return {
+        "mean_ms": round(float(array.mean()), 2),
+        "p50_ms": round(float(np.percentile(array, 50)), 2),
+        "p95_ms": round(float(np.percentile(array, 95)), 2),
+    }
+
+
+def compare(
+    weights: str,
+    model_type: str,
+    exported_path: str,
+    exported_type: str,
+    images: List[str],
+    conf: float,
+    runs: int,
+) -> Dict[str, Any]:
+    """Сравнивает точность и задержку экспортированной модели с PyTorch-базой."""
+    baseline = load_weights(model_type, weights)
+    exported = load_weights(exported_type, exported_path)
+
+    baseline_times, exported_times = [], []
+    total_ref = total_cand = total_matched = 0
+    conf_deltas, ious = [], []
+
+    for path in images:
+        image = Image.open(path).convert("RGB")
+        # Первый проход не учитываем: в нем инициализация
+        run_batch(baseline, model_type, [image], [conf])
+        run_batch(exported, exported_type, [image], [conf])
+
+        ref, times = _timed(baseline, model_type, image, conf, runs)
+        baseline_times.extend(times)
+        cand, times = _timed(exported, exported_type, image, conf, runs)
+        exported_times.extend(times)
+
+        matches = match_detections(ref, cand)
+        total_ref += len(ref)
+        total_cand += len(cand)
+        total_matched += len(matches)
+        conf_deltas.extend(abs(r["confidence"] - c["confidence"]) for r, c, _ in matches)
+        ious.extend(iou for _, _, iou in matches)
+
+    baseline_latency = _latency_summary(baseline_times)
+    exported_latency = _latency_summary(exported_times)
+    return {
+        "baseline": {"type": model_type, "path": weights, "latency": baseline_latency},
+        "exported": {
+            "type": exported_type,
+            "path": exported_path,
+            "size_mb": round(os.path.getsize(exported_path) / 1024 / 1024, 2),
+            "latency": exported_latency,
+        },
+        "speedup": round(baseline_latency["mean_ms"] / max(exported_latency["mean_ms"], 1e-6), 2),
+        "accuracy": {
+            "images": len(images),
+            "baseline_detections": total_ref,
+            "exported_detections": total_cand,
+            # Доля детекций базы, найденных экспортом, и наоборот (IoU >= 0.5, тот же класс)
+            "recall_vs_baseline": round(total_matched / total_ref, 4) if total_ref else 1.0,
+            "precision_vs_baseline": round(total_matched / total_cand, 4) if total_cand else 1.0,
+            "mean_iou": round(float(np.mean(ious)), 4) if ious else None,
+            "mean_abs_conf_delta": round(float(np.mean(conf_deltas)), 4) if conf_deltas else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт модели YOLO в ONNX / TorchScript")
+    parser.add_argument("--weights", required=True, help="Путь к весам PyTorch (.pt)")
+    parser.add_argument("--type", default="YOLOv5", choices=["YOLOv5", "YOLOv8"], help="Тип исходной модели")
+    parser.add_argument("--format", default="onnx", choices=["onnx", "torchscript"], help="Формат экспорта")
+    parser.add_argument("--imgsz", type=int, default=640, help="Размер входа сети")
+    parser.add_argument("--int8", action="store_true", help="Динамическая int8 квантизация (только ONNX)")
+    parser.add_argument("--output", help="Путь к экспортированному файлу")
+    parser.add_argument("--compare-images", help="Файл или папка с изображениями для сравнения с PyTorch")
+    parser.add_argument("--conf", type=float, default=0.25, help="Порог уверенности для сравнения")
+    parser.add_argument("--runs", type=int, default=5, help="Сколько раз прогонять каждое изображение")
+    parser.add_argument("--report", help="Куда сохранить JSON-отчет сравнения")
+    args = parser.parse_args()
+    if args.int8 and args.format != "onnx":
+        # Динамическая квантизация torch затрагивает только Linear, а у YOLO свертки:
+        # модель осталась бы fp32 под именем .int8
+        parser.error("--int8 поддерживается только для --format onnx")
+
+    suffix = (".int8" if args.int8 else "") + (".onnx" if args.format == "onnx" else ".torchscript")
+    output = args.output or os.path.splitext(args.weights)[0] + suffix
+
+    module, names, head = load_torch_module(args.weights, args.type)
+    metadata = export_metadata(names, args.imgsz, head)
+    if args.format == "onnx":
+        export_onnx(module, metadata, args.imgsz, output, args.int8)
+        exported_type = "ONNX"
+    else:
+        export_torchscript(module, metadata, args.imgsz, output)
+        exported_type = "TorchScript"
+    print(f"Модель экспортирована: {output} ({exported_type}, {len(names)} классов)")
+
+    if args.compare_images:
+        images = list_images(args.compare_images)
+        if not images:
+            parser.error(f"Не найдено изображений в {args.compare_images}")
+        report = compare(args.weights, args.type, output, exported_type, images, args.conf, args.runs)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"Отчет сохранен: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,12 @@ from fastapi import APIRouter, UploadFile, File as FastAPIFile, Form, Depends, H
 from fastapi.responses import JSONResponse
 from typing import List, Optional
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import User, File
 from s3_utils import upload_fileobj_to_s3, delete_file_from_s3, get_file_url
-from auth import get_current_user
+from auth import get_current_user_async
 import uuid
 import json
 import os
@@ -37,8 +38,8 @@ class FileListResponse(BaseModel):
 async def upload_file(
     file: UploadFile = FastAPIFile(...),
     folder: str = Form("uploads"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Загружает файл в S3 хранилище.
@@ -68,12 +69,12 @@ async def upload_file(
         )
         
         db.add(db_file)
-        db.commit()
-        db.refresh(db_file)
+        await db.commit()
+        await db.refresh(db_file)
         
         return db_file
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка при загрузке файла: {str(e)}"
@@ -83,8 +84,8 @@ async def upload_file(
 async def upload_multiple_files(
     files: List[UploadFile] = FastAPIFile(...),
     folder: str = Form("uploads"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Загружает несколько файлов в S3 хранилище.
@@ -118,15 +119,15 @@ async def upload_multiple_files(
             db.add(db_file)
             db_files.append(db_file)
         
-        db.commit()
+        await db.commit()
         
         # Обновляем объекты из БД
         for db_file in db_files:
-            db.refresh(db_file)
+            await db.refresh(db_file)
         
         return {"files": db_files}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка при загрузке файлов: {str(e)}"
@@ -134,8 +135,8 @@ async def upload_multiple_files(
 
 @router.get("/user", response_model=FileListResponse)
 async def get_user_files(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получает список файлов текущего пользователя.
@@ -147,14 +148,14 @@ async def get_user_files(
     Returns:
         Список файлов пользователя
     """
-    files = db.query(File).filter(File.user_id == current_user.id).all()
+    files = (await db.scalars(select(File).where(File.user_id == current_user.id))).all()
     return {"files": files}
 
 @router.get("/{file_id}", response_model=FileResponse)
 async def get_file(
     file_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получает информацию о файле по ID.
@@ -167,7 +168,7 @@ async def get_file(
     Returns:
         Информация о файле
     """
-    db_file = db.query(File).filter(File.id == file_id).first()
+    db_file = await db.scalar(select(File).where(File.id == file_id))
     
     if not db_file:
         raise HTTPException(
@@ -187,8 +188,8 @@ async def get_file(
 @router.delete("/{file_id}")
 async def delete_file(
     file_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Удаляет файл из S3 хранилища и из БД.
@@ -203,7 +204,7 @@ async def delete_file(
     """
     try:
         # Получаем файл из БД
-        db_file = db.query(File).filter(File.id == file_id).first()
+        db_file = await db.scalar(select(File).where(File.id == file_id))
         
         if not db_file:
             raise HTTPException(
@@ -228,15 +229,15 @@ async def delete_file(
             )
         
         # Удаляем запись из БД
-        db.delete(db_file)
-        db.commit()
+        await db.delete(db_file)
+        await db.commit()
         
         return {"message": "Файл успешно удален"}
     except HTTPException:
         # Пробрасываем HTTP исключения дальше
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка при удалении файла: {str(e)}"
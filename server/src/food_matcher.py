@@ -0,0 +1,208 @@
+"""
+Поиск продукта в словаре по названию от Gemini (фолбэк пищевой ценности).
+
+Словарь (data/food_vocabulary.csv и, при необходимости, дополнительный
+файл FOOD_VOCABULARY_EXTRA_PATH) индексируется один раз при старте:
+    - автомат Ахо-Корасик по словам находит за один проход все названия
+      из словаря, входящие в запрос; побеждает самое длинное
+      ("fried chicken" важнее "chicken");
+    - индекс символьных триграмм ранжирует похожие названия, когда точного
+      вхождения нет (опечатки, другие формы слов).
+Слова приводятся к единственному числу (nutrition_store.singularize, как и
+при поиске в локальной базе), поэтому "apples" совпадает с "apple".
+"""
+import csv
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from prometheus_client import Counter, Histogram
+
+from nutrition_store import NUTRIENT_FIELDS, normalize_record, singular_food_name
+
+# Настройки
+FOOD_VOCABULARY_PATH = os.getenv(
+    "FOOD_VOCABULARY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "food_vocabulary.csv")
+)
+FOOD_VOCABULARY_EXTRA_PATH = os.getenv("FOOD_VOCABULARY_EXTRA_PATH", "")  # например, экспорт USDA в CSV
+FOOD_MATCH_MIN_SIMILARITY = float(os.getenv("FOOD_MATCH_MIN_SIMILARITY", "0.5"))
+
+MATCHER_LOOKUPS = Counter("food_matcher_lookups_total", "Поиск продукта в словаре фолбэка", ["result"])
+MATCHER_SECONDS = Histogram(
+    "food_matcher_seconds",
+    "Время поиска продукта в словаре фолбэка",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+
+def tokenize(name: str) -> List[str]:
+    return singular_food_name(name).split()
+
+
+def trigrams(text: str) -> List[str]:
+    padded = f" {text} "
+    return list({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+class FoodMatch(NamedTuple):
+    name: str
+    nutrition: Dict[str, float]
+    score: float  # доля запроса, покрытая точным вхождением, или сходство триграмм
+    exact: bool
+
+
+class FoodMatcher:
+    """
+    Индекс словаря продуктов.
+
+    Args:
+        entries: Строки словаря (name и поля NUTRIENT_FIELDS)
+        min_similarity: Минимальное сходство триграмм для неточного совпадения
+    """
+
+    def __init__(self, entries: Iterable[Dict[str, Any]], min_similarity: float = FOOD_MATCH_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.names: List[str] = []
+        self.keys: List[str] = []
+        self.nutrition: List[Dict[str, float]] = []
+
+        # Автомат Ахо-Корасик по словам: переходы, суффиксные ссылки, словарные ссылки
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._terminal: List[int] = [-1]  # номер названия, заканчивающегося в узле
+        self._output: List[int] = [-1]  # ближайший по суффиксным ссылкам узел с названием
+
+        seen = {}
+        for entry in entries:
+            tokens = tokenize(entry["name"])
+            key = " ".join(tokens)
+            if not key:
+                continue
+            nutrition = {field: float(entry[field]) for field in NUTRIENT_FIELDS}
+            if key in seen:
+                # Повтор названия - последняя запись важнее
+                self.nutrition[seen[key]] = nutrition
+                continue
+            seen[key] = len(self.names)
+            self.names.append(entry["name"])
+            self.keys.append(key)
+            self.nutrition.append(nutrition)
+            self._insert(tokens, seen[key])
+        self._build_links()
+        self._build_trigrams()
+
+    def _insert(self, tokens: List[str], index: int):
+        node = 0
+        for token in tokens:
+            next_node = self._goto[node].get(token)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][token] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(-1)
+                self._output.append(-1)
+            node = next_node
+        self._terminal[node] = index
+
+    def _build_links(self):
+        # Узлы первого уровня ссылаются на корень, дальше - обход в ширину
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for token, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token, 0)
+                suffix = self._fail[child]
+                self._output[child] = suffix if self._terminal[suffix] >= 0 else self._output[suffix]
+                queue.append(child)
+
+    def _build_trigrams(self):
+        postings = defaultdict(list)
+        for index, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                postings[gram].append(index)
+        self._postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._gram_counts = np.asarray([len(trigrams(key)) for key in self.keys], dtype=np.float32)
+
+    def exact_matches(self, tokens: List[str]) -> List[int]:
+        """Номера всех названий словаря, входящих в запрос целыми словами."""
+        found = []
+        node = 0
+        for token in tokens:
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            match = node if self._terminal[node] >= 0 else self._output[node]
+            while match > 0:
+                found.append(self._terminal[match])
+                match = self._output[match]
+        return found
+
+    def similar(self, key: str) -> Tuple[Optional[int], float]:
+        """Название с наибольшим сходством триграмм (коэффициент Дайса) и его сходство."""
+        grams = trigrams(key)
+        lists = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not lists:
+            return None, 0.0
+        common = np.bincount(np.concatenate(lists), minlength=len(self.keys))
+        similarity = 2.0 * common / (len(grams) + self._gram_counts)
+        best = int(similarity.argmax())
+        return best, float(similarity[best])
+
+    def match(self, name: str) -> Optional[FoodMatch]:
+        """Лучшее совпадение для названия продукта или None."""
+        started_at = time.perf_counter()
+        tokens = tokenize(name)
+        key = " ".join(tokens)
+        result = None
+        if key and self.keys:
+            exact = self.exact_matches(tokens)
+            if exact:
+                # Самое длинное вхождение; при равной длине - последнее (главное слово в английском в конце)
+                best = max(reversed(exact), key=lambda index: len(self.keys[index]))
+                result = FoodMatch(self.names[best], self.nutrition[best], len(self.keys[best]) / len(key), True)
+            if result is None or result.score < 1.0:
+                best, similarity = self.similar(key)
+                if best is not None and similarity >= self.min_similarity and (result is None or similarity > result.score):
+                    exact_name = result is not None and self.names[best] == result.name
+                    result = FoodMatch(self.names[best], self.nutrition[best], similarity, exact_name)
+
+        MATCHER_SECONDS.observe(time.perf_counter() - started_at)
+        MATCHER_LOOKUPS.labels(result="none" if result is None else "exact" if result.exact else "fuzzy").inc()
+        return result
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def load_vocabulary(*paths: str) -> List[Dict[str, Any]]:
+    """Строки словаря из CSV (колонки как у `nutrition_store.py import`)."""
+    entries = []
+    for path in paths:
+        if not path:
+            continue
+        if not os.path.exists(path):
+            print(f"Словарь продуктов не найден: {path}")
+            continue
+        with open(path, newline="", encoding="utf-8") as f:
+            for record in csv.DictReader(f):
+                row = normalize_record(record)
+                if row is not None:
+                    entries.append(row)
+    return entries
+
+
+def build_food_matcher() -> FoodMatcher:
+    started_at = time.perf_counter()
+    matcher = FoodMatcher(load_vocabulary(FOOD_VOCABULARY_PATH, FOOD_VOCABULARY_EXTRA_PATH))
+    print(f"Словарь продуктов: {len(matcher)} названий, индекс построен за {time.perf_counter() - started_at:.2f} с")
+    return matcher
+
+
+food_matcher = build_food_matcher()
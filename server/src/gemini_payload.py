@@ -0,0 +1,138 @@
+"""
+Подготовка изображения для Gemini.
+
+Вместо исходного фото (часто несколько МБ) в запрос уходит JPEG, обрезанный
+по объединению боксов YOLO с полями, уменьшенный до GEMINI_IMAGE_MAX_EDGE
+по большей стороне и перекодированный с качеством GEMINI_JPEG_QUALITY.
+JPEG сразу декодируется в уменьшенном разрешении (draft mode).
+"""
+import io
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+from prometheus_client import Histogram
+
+from preprocessing import _oriented_size
+
+# Настройки оптимизации
+GEMINI_PAYLOAD_OPTIMIZE = os.getenv("GEMINI_PAYLOAD_OPTIMIZE", "true").lower() == "true"
+GEMINI_CROP_MARGIN = float(os.getenv("GEMINI_CROP_MARGIN", "0.15"))  # доля размера области боксов
+GEMINI_IMAGE_MAX_EDGE = int(os.getenv("GEMINI_IMAGE_MAX_EDGE", "768"))
+GEMINI_JPEG_QUALITY = int(os.getenv("GEMINI_JPEG_QUALITY", "85"))
+
+PAYLOAD_BUCKETS = (16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6)
+
+# Суммарные байты до и после оптимизации - в gemini_image_bytes_sum
+PAYLOAD_BYTES = Histogram(
+    "gemini_image_bytes",
+    "Размер изображения для Gemini до и после оптимизации",
+    ["stage"],
+    buckets=PAYLOAD_BUCKETS,
+)
+PAYLOAD_SECONDS = Histogram(
+    "gemini_image_optimize_seconds",
+    "Время обрезки и перекодирования изображения для Gemini",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5),
+)
+
+# Преобразование координат: (смещение x, смещение y, масштаб)
+Transform = Tuple[float, float, float]
+IDENTITY: Transform = (0.0, 0.0, 1.0)
+
+
+def crop_region(
+    detections: Optional[List[Dict[str, Any]]],
+    size: Tuple[int, int],
+    margin: float = GEMINI_CROP_MARGIN,
+) -> Tuple[int, int, int, int]:
+    """Объединение боксов с полями в координатах исходного изображения (или все изображение)."""
+    width, height = size
+    if not detections:
+        return 0, 0, width, height
+    x1 = min(d["bbox"][0] for d in detections)
+    y1 = min(d["bbox"][1] for d in detections)
+    x2 = max(d["bbox"][2] for d in detections)
+    y2 = max(d["bbox"][3] for d in detections)
+    pad_x, pad_y = (x2 - x1) * margin, (y2 - y1) * margin
+    left, top = max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y))
+    right, bottom = min(width, int(x2 + pad_x + 1)), min(height, int(y2 + pad_y + 1))
+    if right - left < 2 or bottom - top < 2:
+        return 0, 0, width, height
+    return left, top, right, bottom
+
+
+def transform_boxes(detections: List[Dict[str, Any]], transform: Transform) -> List[List[int]]:
+    """Переводит боксы детекций в координаты изображения, отправленного в Gemini."""
+    offset_x, offset_y, scale = transform
+    return [
+        [
+            int(round((d["bbox"][0] - offset_x) * scale)),
+            int(round((d["bbox"][1] - offset_y) * scale)),
+            int(round((d["bbox"][2] - offset_x) * scale)),
+            int(round((d["bbox"][3] - offset_y) * scale)),
+        ]
+        for d in detections
+    ]
+
+
+def prepare_gemini_image(
+    image_bytes: bytes,
+    detections: Optional[List[Dict[str, Any]]] = None,
+    max_edge: int = GEMINI_IMAGE_MAX_EDGE,
+    quality: int = GEMINI_JPEG_QUALITY,
+) -> Tuple[bytes, Transform]:
+    """
+    Обрезает, уменьшает и перекодирует изображение для Gemini.
+
+    Args:
+        image_bytes: Исходный файл
+        detections: Детекции в координатах исходного изображения (None - без обрезки)
+
+    Returns:
+        Tuple[jpeg, transform]: JPEG и преобразование координат исходного изображения в координаты JPEG
+    """
+    PAYLOAD_BYTES.labels(stage="original").observe(len(image_bytes))
+    if not GEMINI_PAYLOAD_OPTIMIZE:
+        return image_bytes, IDENTITY
+
+    started_at = time.perf_counter()
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        original_size = _oriented_size(image)
+        left, top, right, bottom = crop_region(detections, original_size)
+        scale = min(1.0, max_edge / max(right - left, bottom - top))
+
+        # Декодер JPEG сразу уменьшает все изображение так, чтобы область осталась не меньше max_edge
+        if image.format == "JPEG" and scale < 1.0:
+            image.draft("RGB", (int(original_size[0] * scale) + 1, int(original_size[1] * scale) + 1))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        decoded_scale = image.size[0] / original_size[0]
+        image = image.crop((
+            int(left * decoded_scale),
+            int(top * decoded_scale),
+            int(right * decoded_scale),
+            int(bottom * decoded_scale),
+        ))
+        if max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.BILINEAR)
+        output_scale = image.size[0] / max(1, right - left)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        optimized = buffer.getvalue()
+    except Exception as e:
+        print(f"Не удалось оптимизировать изображение для Gemini: {str(e)}")
+        optimized, left, top, output_scale = image_bytes, 0, 0, 1.0
+
+    # Маленькое исходное фото может оказаться меньше перекодированного
+    if len(optimized) >= len(image_bytes):
+        optimized, left, top, output_scale = image_bytes, 0, 0, 1.0
+
+    PAYLOAD_SECONDS.observe(time.perf_counter() - started_at)
+    PAYLOAD_BYTES.labels(stage="optimized").observe(len(optimized))
+    return optimized, (float(left), float(top), output_scale)
@@ -0,0 +1,71 @@
+"""
+Конфигурация gunicorn для продакшн-запуска.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Приложение импортируется в мастере (preload_app), модели загружаются до fork,
+и воркеры разделяют веса copy-on-write. Сравнить память воркеров:
+
+    python worker_runtime.py <pid мастера>
+
+Метрики Prometheus у каждого воркера свои (реестр в памяти процесса), а /metrics
+за общим портом попадает в случайный воркер: один сбор показывает один воркер, и
+счетчики между сборами скачут. Для полной картины запускайте по одному воркеру на
+контейнер (WEB_CONCURRENCY=1) и собирайте каждый контейнер как отдельную цель.
+Режим multiprocess prometheus_client не используется: в нем теряются gauge,
+вычисляемые функциями (пулы БД, память воркера, размеры кэшей).
+"""
+import os
+
+# Должно быть выставлено до импорта main.py в мастере
+os.environ.setdefault("MODEL_PRELOAD_IN_MASTER", "true")
+os.environ.setdefault("WEB_CONCURRENCY", "4")
+
+from worker_runtime import freeze_before_fork, pin_worker, worker_cores
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.environ["WEB_CONCURRENCY"])
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+forwarded_allow_ips = "*"
+accesslog = "-"
+errorlog = "-"
+
+# Занятые номера слотов ядер (INFERENCE_CPU_AFFINITY=auto); хранятся в мастере
+_busy_slots = set()
+
+
+def when_ready(server):
+    # Вызывается после загрузки приложения в мастере и до создания воркеров
+    freeze_before_fork()
+    server.log.info(f"Модели загружены в мастере, ядер на воркер: {worker_cores(workers)}")
+
+
+def pre_fork(server, worker):
+    # Вызывается в мастере: новый воркер (в том числе взамен упавшего) занимает
+    # наименьший свободный слот и, значит, ядра, освободившиеся после предыдущего
+    worker.cpu_slot = min(set(range(len(_busy_slots) + 1)) - _busy_slots)
+    _busy_slots.add(worker.cpu_slot)
+
+
+def child_exit(server, worker):
+    # Вызывается в мастере после выхода воркера (worker_exit выполняется в самом
+    # воркере и не видит состояние мастера): слот снова свободен
+    _busy_slots.discard(getattr(worker, "cpu_slot", None))
+
+
+def post_fork(server, worker):
+    # Соединения пулов БД, открытые в мастере (create_all при импорте main.py), достались
+    # воркеру вместе с сокетами. Забываем их без закрытия: закрытие оборвало бы соединение
+    # и у мастера и других воркеров. Воркер откроет свои соединения при первом запросе
+    from database import async_engine, engine
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+    cpus = pin_worker(worker.cpu_slot, workers)
+    if cpus:
+        server.log.info(f"Воркер {worker.pid} привязан к ядрам {cpus}")
+    # Потоки torch задаются один раз на воркер, когда его набор ядер уже известен
+    from main import inference_scheduler
+    inference_scheduler.configure()
@@ -0,0 +1,105 @@
+"""
+Общие асинхронные HTTP-клиенты для внешних API (Gemini, Edamam).
+
+Для каждого внешнего сервиса создается свой httpx.AsyncClient: пул
+keep-alive соединений (TLS-рукопожатие не повторяется на каждый скан),
+HTTP/2, если установлен пакет h2, и свои таймауты подключения и чтения.
+Клиенты открываются при старте приложения и закрываются при остановке.
+"""
+import os
+from typing import Dict
+
+import httpx
+
+# Общие настройки пулов соединений
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY_SEC = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SEC", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# Таймауты по сервисам
+GEMINI_CONNECT_TIMEOUT_SEC = float(os.getenv("GEMINI_CONNECT_TIMEOUT_SEC", "3"))
+GEMINI_READ_TIMEOUT_SEC = float(os.getenv("GEMINI_READ_TIMEOUT_SEC", "15"))
+EDAMAM_CONNECT_TIMEOUT_SEC = float(os.getenv("EDAMAM_CONNECT_TIMEOUT_SEC", "3"))
+EDAMAM_READ_TIMEOUT_SEC = float(os.getenv("EDAMAM_READ_TIMEOUT_SEC", "5"))
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+EDAMAM_BASE_URL = "https://api.edamam.com"
+
+
+def http2_available() -> bool:
+    """HTTP/2 в httpx требует пакет h2."""
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class Upstream:
+    """
+    Настройки одного внешнего сервиса.
+
+    Args:
+        base_url: Базовый URL сервиса
+        connect_timeout: Таймаут установки соединения
+        read_timeout: Таймаут чтения ответа (и записи запроса)
+    """
+
+    __slots__ = ("base_url", "connect_timeout", "read_timeout")
+
+    def __init__(self, base_url: str, connect_timeout: float, read_timeout: float):
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+
+class HttpClients:
+    """Пул httpx.AsyncClient: по одному клиенту на внешний сервис."""
+
+    def __init__(self, upstreams: Dict[str, Upstream]):
+        self.upstreams = upstreams
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _create(self, upstream: Upstream) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=upstream.base_url,
+            http2=http2_available(),
+            timeout=httpx.Timeout(
+                connect=upstream.connect_timeout,
+                read=upstream.read_timeout,
+                write=upstream.read_timeout,
+                pool=upstream.connect_timeout,
+            ),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SEC,
+            ),
+        )
+
+    async def start(self):
+        for name, upstream in self.upstreams.items():
+            if name not in self._clients:
+                self._clients[name] = self._create(upstream)
+        print(f"HTTP-клиенты запущены: {', '.join(self._clients)} (HTTP/2: {http2_available()})")
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Клиент сервиса; создается при первом обращении, если start() еще не вызывался."""
+        client = self._clients.get(name)
+        if client is None:
+            client = self._clients[name] = self._create(self.upstreams[name])
+        return client
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+http_clients = HttpClients({
+    "gemini": Upstream(GEMINI_BASE_URL, GEMINI_CONNECT_TIMEOUT_SEC, GEMINI_READ_TIMEOUT_SEC),
+    "edamam": Upstream(EDAMAM_BASE_URL, EDAMAM_CONNECT_TIMEOUT_SEC, EDAMAM_READ_TIMEOUT_SEC),
+})
@@ -0,0 +1,436 @@
+"""
+Движок инференса с динамическим микро-батчингом для /analyze.
+
+Запросы не вызывают модель напрямую: изображение кладется в очередь модели,
+фоновый воркер собирает батч (до INFERENCE_BATCH_MAX_SIZE изображений или
+пока не истечет окно INFERENCE_BATCH_MAX_WAIT_MS), делает один прямой проход
+и раздает результаты ожидающим запросам.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
+
+from backends import EXPORTED_MODEL_TYPES, load_exported_backend
+
+# Путь к локальной копии YOLOv5 для torch.hub
+YOLOV5_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yolov5')
+
+# Настройки батчинга
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "8"))
+INFERENCE_BATCH_MAX_WAIT_MS = float(os.getenv("INFERENCE_BATCH_MAX_WAIT_MS", "5"))
+
+# Метрики для подбора компромисса между пропускной способностью и задержкой
+BATCH_SIZE = Histogram(
+    "inference_batch_size",
+    "Количество изображений в одном прямом проходе",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+BATCH_DURATION = Histogram(
+    "inference_batch_duration_seconds",
+    "Длительность прямого прохода по батчу",
+    ["model"],
+)
+QUEUE_WAIT = Histogram(
+    "inference_queue_wait_seconds",
+    "Время ожидания изображения в очереди до начала прямого прохода",
+    ["model"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+REQUEST_LATENCY = Histogram(
+    "inference_request_latency_seconds",
+    "Полное время инференса одного изображения (очередь + прямой проход)",
+    ["model"],
+)
+IMAGES_TOTAL = Counter(
+    "inference_images_total",
+    "Количество изображений, прошедших через инференс",
+    ["model"],
+)
+QUEUE_DEPTH = Gauge(
+    "inference_queue_depth",
+    "Количество изображений, ожидающих или проходящих инференс",
+    ["model"],
+)
+REJECTED_TOTAL = Counter(
+    "inference_rejected_total",
+    "Количество запросов, отклоненных из-за очереди или дедлайна клиента",
+    ["model"],
+)
+
+
+class InferenceQueueFull(Exception):
+    """
+    Очередь инференса переполнена или результат не успеет к дедлайну клиента.
+
+    Attributes:
+        status_code: 503 (очередь заполнена) или 429 (не успеваем к дедлайну)
+        retry_after: Через сколько секунд имеет смысл повторить запрос
+        reason: queue_full или deadline
+    """
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: int = 1, reason: str = "queue_full"):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def load_weights(model_type: str, model_path: str):
+    """
+    Загружает веса модели с диска.
+
+    YOLOv5 - через torch.hub, ONNX/TorchScript - экспортированные бэкенды
+    (см. backends.py), остальное - через Ultralytics (YOLOv8).
+    """
+    if model_type in EXPORTED_MODEL_TYPES:
+        return load_exported_backend(model_type, model_path)
+
+    if model_type == "YOLOv5":
+        import torch
+        # Используем локальную версию, а не загрузку с GitHub
+        return torch.hub.load(YOLOV5_PATH, 'custom', path=model_path, source='local')
+
+    # Если это YOLOv8 модель, используем Ultralytics
+    from ultralytics import YOLO
+    return YOLO(model_path)
+
+
+# Блокировки моделей: AutoShape и модели Ultralytics не потокобезопасны,
+# поэтому прямые проходы одной модели в процессе выполняются по очереди
+_model_locks: "weakref.WeakKeyDictionary[Any, threading.Lock]" = weakref.WeakKeyDictionary()
+_model_locks_guard = threading.Lock()
+
+
+def model_lock(model) -> threading.Lock:
+    with _model_locks_guard:
+        lock = _model_locks.get(model)
+        if lock is None:
+            lock = _model_locks[model] = threading.Lock()
+        return lock
+
+
+# Пустой результат: (0, 6) - x1, y1, x2, y2, conf, cls
+EMPTY_PREDICTIONS = np.zeros((0, 6), dtype=np.float32)
+
+
+def filter_predictions(pred: np.ndarray, conf_threshold: float) -> np.ndarray:
+    """Оставляет строки (N, 6) с уверенностью не ниже порога (одной маской)."""
+    if not len(pred):
+        return pred
+    return pred[pred[:, 4] >= conf_threshold]
+
+
+def build_detections(pred: np.ndarray, names) -> List[Dict[str, Any]]:
+    """Строит список детекций для ответа из массива (N, 6) без поэлементных вызовов тензоров."""
+    if not len(pred):
+        return []
+    boxes = pred[:, :4].tolist()
+    confidences = pred[:, 4].tolist()
+    class_ids = pred[:, 5].astype(np.int64).tolist()
+    return [
+        {
+            "bbox": box,
+            "confidence": confidence,
+            "class_id": class_id,
+            "class_name": names[class_id]
+        }
+        for box, confidence, class_id in zip(boxes, confidences, class_ids)
+    ]
+
+
+def _split_predictions(tensors) -> List[np.ndarray]:
+    """Переводит список тензоров (N_i, 6) в numpy одним копированием на весь батч."""
+    import torch
+
+    sizes = [len(t) for t in tensors]
+    if not sum(sizes):
+        return [EMPTY_PREDICTIONS] * len(tensors)
+    merged = torch.cat(list(tensors)).float().cpu().numpy()
+    return np.split(merged, np.cumsum(sizes)[:-1])
+
+
+def run_batch(model, model_type: str, images: List[Any], conf_thresholds: List[float]) -> Tuple[List[np.ndarray], Dict[int, str]]:
+    """
+    Делает один прямой проход по батчу изображений.
+
+    Минимальный порог батча передается в NMS модели, поэтому лишние боксы
+    отсекаются до постобработки; порог каждого запроса применяется маской.
+
+    Args:
+        model: Загруженная модель
+        model_type: Тип модели из MODEL_TYPES
+        images: Список изображений (PIL или HWC numpy)
+        conf_thresholds: Порог уверенности для каждого изображения
+
+    Returns:
+        Tuple[preds, names]: массив (N, 6) для каждого изображения в том же
+        порядке и словарь имен классов модели
+    """
+    batch_conf = min(conf_thresholds)
+
+    if model_type in EXPORTED_MODEL_TYPES:
+        with model_lock(model):
+            preds = model.predict(images, batch_conf)
+        names = model.names
+    elif model_type == "YOLOv5":
+        with model_lock(model):
+            # AutoShape не принимает порог в вызове, только атрибутом модели;
+            # под блокировкой модели его не перезапишет параллельный батч
+            model.conf = batch_conf
+            results = model(images)
+        preds = _split_predictions(results.pred)
+        names = results.names
+    else:
+        # Ultralytics считает numpy-массивы BGR (как из cv2), у нас RGB
+        images = [image[..., ::-1] if isinstance(image, np.ndarray) else image for image in images]
+        with model_lock(model):
+            results = model(images, conf=batch_conf, verbose=False)
+        preds = _split_predictions([result.boxes.data for result in results])
+        names = results[0].names if results else {}
+
+    preds = [filter_predictions(pred, conf) for pred, conf in zip(preds, conf_thresholds)]
+    return preds, names
+
+
+class _PendingImage:
+    """Изображение в очереди, ожидающее своего батча."""
+
+    __slots__ = ("image", "conf_threshold", "future", "enqueued_at")
+
+    def __init__(self, image, conf_threshold: float, future: asyncio.Future):
+        self.image = image
+        self.conf_threshold = conf_threshold
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchInferenceEngine:
+    """
+    Очередь и батч-воркер для каждой модели.
+
+    Прямой проход выполняется в пуле InferenceExecutor, поэтому event loop
+    остается свободным для остальных запросов.
+
+    Args:
+        load_model: Функция, возвращающая загруженную модель по имени
+        model_types: Словарь типов моделей (MODEL_TYPES)
+        model_paths: Словарь путей к весам (MODEL_PATHS), нужен пулу процессов
+        executor: Пул, в котором выполняется прямой проход
+        max_batch_size: Максимальный размер батча
+        max_wait_ms: Сколько ждать добора батча после первого изображения
+        admission: AdmissionController, решающий, принимать ли изображения в очередь (опционально)
+    """
+
+    def __init__(
+        self,
+        load_model: Callable[[str], Any],
+        model_types: Dict[str, str],
+        model_paths: Dict[str, str],
+        executor,
+        max_batch_size: int = INFERENCE_BATCH_MAX_SIZE,
+        max_wait_ms: float = INFERENCE_BATCH_MAX_WAIT_MS,
+        admission=None,
+    ):
+        self.load_model = load_model
+        self.model_types = model_types
+        self.model_paths = model_paths
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._pending: Dict[str, int] = {}
+        self._batches: Set[asyncio.Task] = set()
+        self.admission = admission
+
+    def pending(self, model_name: str) -> int:
+        """Количество изображений модели в очереди и в текущем батче."""
+        return self._pending.get(model_name, 0)
+
+    async def infer(self, model_name: str, image, conf_threshold: float) -> Tuple[np.ndarray, Dict[int, str]]:
+        """
+        Ставит изображение в очередь модели и ждет результата его батча.
+
+        Returns:
+            Tuple[pred, names]: массив (N, 6) в координатах входа модели и имена классов
+        """
+        return (await self.infer_many(model_name, [image], [conf_threshold]))[0]
+
+    async def infer_many(
+        self,
+        model_name: str,
+        images: List[Any],
+        conf_thresholds: List[float],
+        deadline: Optional[float] = None,
+    ) -> List[Tuple[np.ndarray, Dict[int, str]]]:
+        """
+        Ставит в очередь сразу несколько изображений одного запроса.
+
+        Изображения попадают в очередь одновременно, поэтому воркер забирает
+        их одним батчем (с учетом max_batch_size).
+
+        Args:
+            deadline: Абсолютный дедлайн клиента (time.time()), учитывается контролем допуска
+        """
+        try:
+            if self.admission:
+                self.admission.admit(model_name, self.pending(model_name), len(images), deadline)
+            else:
+                max_queue = self.executor.max_queue
+                if max_queue and self.pending(model_name) + len(images) > max_queue:
+                    raise InferenceQueueFull(
+                        f"Очередь модели {model_name} переполнена ({max_queue}), повторите запрос позже"
+                    )
+        except InferenceQueueFull:
+            REJECTED_TOTAL.labels(model=model_name).inc()
+            raise
+
+        queue = self._get_queue(model_name)
+        loop = asyncio.get_running_loop()
+        items = [
+            _PendingImage(image, conf_threshold, loop.create_future())
+            for image, conf_threshold in zip(images, conf_thresholds)
+        ]
+        self._pending[model_name] = self.pending(model_name) + len(items)
+        QUEUE_DEPTH.labels(model=model_name).inc(len(items))
+        for item in items:
+            queue.put_nowait(item)
+        try:
+            return await asyncio.gather(*(item.future for item in items))
+        finally:
+            self._pending[model_name] -= len(items)
+            QUEUE_DEPTH.labels(model=model_name).dec(len(items))
+            finished_at = time.perf_counter()
+            for item in items:
+                REQUEST_LATENCY.labels(model=model_name).observe(finished_at - item.enqueued_at)
+
+    def _run_local(self, model_name: str, images: List[Any], conf_thresholds: List[float]):
+        # Выполняется в потоке пула: здесь же происходит и ленивая загрузка модели
+        model = self.load_model(model_name)
+        return run_batch(model, self.model_types[model_name], images, conf_thresholds)
+
+    async def _run(self, model_name: str, images: List[Any], conf_thresholds: List[float]):
+        if self.executor.uses_processes:
+            from inference_executor import run_batch_in_process
+            return await self.executor.run(
+                run_batch_in_process,
+                model_name,
+                self.model_types[model_name],
+                self.model_paths[model_name],
+                images,
+                conf_thresholds,
+            )
+        return await self.executor.run(self._run_local, model_name, images, conf_thresholds)
+
+    def _get_queue(self, model_name: str) -> asyncio.Queue:
+        # Очередь и воркер создаются лениво внутри работающего event loop
+        if model_name not in self._queues:
+            self._queues[model_name] = asyncio.Queue()
+            self._workers[model_name] = asyncio.create_task(self._worker(model_name))
+        return self._queues[model_name]
+
+    async def _collect_batch(self, queue: asyncio.Queue) -> List[_PendingImage]:
+        batch = [await queue.get()]
+        # При нескольких параллельных проходах модели (пул процессов) делим
+        # очередь между ними, а не отдаем ее целиком первому батчу
+        concurrency = self.executor.concurrency if self.executor.uses_processes else 1
+        max_size = self.max_batch_size
+        if concurrency > 1:
+            max_size = min(max_size, max(1, math.ceil((1 + queue.qsize()) / concurrency)))
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < max_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Окно истекло, но забираем то, что уже лежит в очереди
+                while len(batch) < max_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self, model_name: str):
+        queue = self._queues[model_name]
+        while True:
+            # Следующий батч собираем, только когда для него есть свободный слот
+            await self.executor.wait_for_slot()
+            batch = await self._collect_batch(queue)
+            # Запросы, которые уже отменены клиентом, не считаем
+            batch = [item for item in batch if not item.future.done()]
+            if not batch:
+                continue
+
+            task = asyncio.create_task(self._process_batch(model_name, batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+            if self.executor.uses_processes:
+                # У каждого процесса пула своя копия модели: батчи идут параллельно.
+                # Дадим батчу занять слот исполнителя до сбора следующего
+                await asyncio.sleep(0)
+            else:
+                # В пуле потоков модель одна: следующий батч собираем после
+                # завершения текущего (параллельно идут только разные модели)
+                await asyncio.wait([task])
+
+    async def _process_batch(self, model_name: str, batch: List[_PendingImage]):
+        started_at = time.perf_counter()
+        for item in batch:
+            QUEUE_WAIT.labels(model=model_name).observe(started_at - item.enqueued_at)
+
+        try:
+            preds, names = await self._run(
+                model_name,
+                [item.image for item in batch],
+                [item.conf_threshold for item in batch],
+            )
+        except asyncio.CancelledError:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("Движок инференса остановлен"))
+            raise
+        except Exception as e:
+            print(f"Ошибка батч-инференса модели {model_name}: {str(e)}")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        duration = time.perf_counter() - started_at
+        BATCH_SIZE.labels(model=model_name).observe(len(batch))
+        BATCH_DURATION.labels(model=model_name).observe(duration)
+        if self.admission:
+            self.admission.observe(model_name, len(batch), duration)
+        IMAGES_TOTAL.labels(model=model_name).inc(len(batch))
+
+        for item, pred in zip(batch, preds):
+            if not item.future.done():
+                item.future.set_result((pred, names))
+
+    async def stop(self):
+        """Останавливает воркеры и завершает ожидающие запросы ошибкой."""
+        tasks = list(self._workers.values()) + list(self._batches)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for queue in self._queues.values():
+            while not queue.empty():
+                item = queue.get_nowait()
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("Движок инференса остановлен"))
+        self._workers.clear()
+        self._queues.clear()
+        self.executor.shutdown()
@@ -0,0 +1,158 @@
+"""
+Пул исполнителей для тяжелого инференса.
+
+Прямой проход модели и декодирование изображений выполняются вне event loop,
+чтобы /health, /auth и CRUD-эндпоинты отвечали, пока идет детекция.
+Поддерживаются пул потоков (по умолчанию) и пул процессов.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from prometheus_client import Gauge
+
+from inference import load_weights, run_batch
+from worker_runtime import worker_cores
+
+# Настройки исполнителя
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")  # thread или process
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", "1"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "32"))
+
+ACTIVE_INFERENCES = Gauge(
+    "inference_executor_active",
+    "Количество прямых проходов, выполняющихся прямо сейчас",
+)
+
+
+# Модели, загруженные внутри процесса пула (только для режима process)
+_process_models: Dict[str, Any] = {}
+
+
+def _init_process_worker(num_threads: int):
+    """Инициализатор процесса пула: ограничиваем потоки torch."""
+    import torch
+    torch.set_num_threads(num_threads)
+
+
+def run_batch_in_process(
+    model_name: str,
+    model_type: str,
+    model_path: str,
+    images: List[Any],
+    conf_thresholds: List[float],
+) -> Tuple[List[np.ndarray], Dict[int, str]]:
+    """Выполняет батч в процессе пула, загружая модель при первом обращении."""
+    if model_name not in _process_models:
+        _process_models[model_name] = load_weights(model_type, model_path)
+    return run_batch(_process_models[model_name], model_type, images, conf_thresholds)
+
+
+def warm_up_in_process(model_name: str, model_type: str, model_path: str, passes: int, size: int) -> float:
+    """Загружает модель в процессе пула и прогоняет пустые изображения; возвращает время прогрева."""
+    if model_name not in _process_models:
+        _process_models[model_name] = load_weights(model_type, model_path)
+    dummy = np.zeros((size, size, 3), dtype=np.uint8)
+    started_at = time.perf_counter()
+    for _ in range(passes):
+        run_batch(_process_models[model_name], model_type, [dummy], [1.0])
+    return time.perf_counter() - started_at
+
+
+class InferenceExecutor:
+    """
+    Обертка над пулом потоков или процессов с ограничением параллелизма.
+
+    Args:
+        kind: "thread" или "process"
+        max_concurrency: Размер пула: сколько прямых проходов может идти одновременно
+        max_queue: Сколько изображений может ждать в очереди на воркер
+
+    Текущий лимит параллелизма (concurrency) не больше размера пула
+    и задается планировщиком (scheduler.py).
+    """
+
+    def __init__(
+        self,
+        kind: str = INFERENCE_EXECUTOR,
+        max_concurrency: int = INFERENCE_MAX_CONCURRENCY,
+        max_queue: int = INFERENCE_MAX_QUEUE,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Неизвестный тип исполнителя: {kind}. Доступные: thread, process")
+        self.kind = kind
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self.max_queue = max_queue
+        self._executor: Executor = None
+        self._active = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+
+    @property
+    def uses_processes(self) -> bool:
+        return self.kind == "process"
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.uses_processes:
+                # spawn, а не fork: в родителе уже работают потоки asyncio и torch
+                # Ядра воркера делятся между процессами пула, потоки задаются при их запуске
+                threads = max(1, worker_cores() // self.max_concurrency)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_process_worker,
+                    initargs=(threads,),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix="inference",
+                )
+        return self._executor
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def set_concurrency(self, concurrency: int):
+        """Меняет лимит параллельных проходов (в пределах размера пула)."""
+        self.concurrency = max(1, min(concurrency, self.max_concurrency))
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        # Будим всех: каждый ожидающий сам перепроверит, есть ли свободный слот
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_for_slot(self):
+        """Ждет, пока число выполняющихся проходов станет меньше лимита."""
+        while self._active >= self.concurrency:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Выполняет fn(*args) в пуле, соблюдая лимит параллелизма."""
+        await self.wait_for_slot()
+        self._active += 1
+        ACTIVE_INFERENCES.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._active -= 1
+            ACTIVE_INFERENCES.dec()
+            self._wake_waiters()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -1,37 +1,57 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, status
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
+import asyncio
 import numpy as np
 import json
 import os
 import time
 import sys
-import torch
-import requests
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import base64
-from sqlalchemy.orm import Session
-from database import get_db, engine, Base
+import hashlib
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, async_engine, engine, Base
 from models import User, UserProfile
 from schemas import (
     UserResponse, UserProfileResponse, UserProfileCreate, UserProfileUpdate,
-    GoogleToken, Token, WeightHistoryResponse, WaterHistoryResponse
+    GoogleToken, Token, WeightHistoryResponse, WaterHistoryResponse, WaterDailyResponse
 )
 from auth import (
-    verify_google_token, get_current_user, create_user_token,
-    get_or_create_user
+    verify_google_token, get_current_user_async, create_user_token,
+    get_or_create_user_async
 )
 from crud import (
-    get_user_profile, create_user_profile, update_user_profile,
-    add_weight_record, get_weight_history,
-    add_water_record, get_water_history, get_today_water_amount
+    get_user_profile_async, create_user_profile_async, update_user_profile_async,
+    add_weight_record_async, get_weight_history_async,
+    add_water_record_async, get_water_history_async, get_today_water_amount_async,
+    get_water_daily_async
 )
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import boto3  # Добавлено для работы с S3
 from file_router import router as file_router  # Импортируем роутер для файлов
+from fastapi.concurrency import run_in_threadpool
+from inference import BatchInferenceEngine, InferenceQueueFull, YOLOV5_PATH, build_detections
+from inference_executor import InferenceExecutor, INFERENCE_EXECUTOR, INFERENCE_MAX_CONCURRENCY, warm_up_in_process
+from scheduler import InferenceScheduler
+from admission import AdmissionController, deadline_from_timeout
+from ensemble import ENSEMBLE_MODEL_NAME, fuse_predictions, parse_weights
+from http_clients import http_clients
+from gemini_payload import prepare_gemini_image, transform_boxes
+from resilience import ResilientUpstream, UpstreamError
+from singleflight import SingleFlight
+from nutrition_store import NUTRIENT_FIELDS, nutrition_store, singular_food_name
+from nutrition_cache import nutrition_cache
+from food_matcher import food_matcher
+from class_products import class_product_resolver
+from preprocessing import preprocess_image
+from result_cache import AnalyzeResultCache, perceptual_hash, RESULT_CACHE_ENABLED
+from model_registry import (
+    ModelRegistry, MODEL_PRELOAD, MODEL_IDLE_TTL_SEC, MODEL_MEMORY_BUDGET_MB, MODEL_WARMUP_PASSES, MODEL_WARMUP_SIZE
+)
+from worker_runtime import MODEL_PRELOAD_IN_MASTER, configure_torch_threads, read_memory, register_memory_metrics
 
 # Создаем таблицы в базе данных
 Base.metadata.create_all(bind=engine)
@@ -51,25 +71,19 @@ app.add_middleware(
 app.include_router(file_router)
 
 # Добавляем путь к YOLOv5 в Python path
-yolov5_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yolov5')
+yolov5_path = YOLOV5_PATH
 sys.path.append(yolov5_path)
 
-# Загружаем модели при старте сервера
-models = {
-    "model1": None,  # YOLOv5 модель
-    "model2": None   # YOLOv5 модель (или YOLOv8 если применимо)
-}
-
 # Пути к моделям
 MODEL_PATHS = {
-    "model1": "/Users/faig/Downloads/best.pt",
-    "model2": "/Users/faig/Downloads/best-2.pt"
+    "model1": os.getenv("MODEL1_PATH", "/Users/faig/Downloads/best.pt"),
+    "model2": os.getenv("MODEL2_PATH", "/Users/faig/Downloads/best-2.pt")
 }
 
-# Типы моделей
+# Типы моделей: YOLOv5, YOLOv8 или экспортированные ONNX / TorchScript (см. export_model.py)
 MODEL_TYPES = {
-    "model1": "YOLOv5",
-    "model2": "YOLOv5"
+    "model1": os.getenv("MODEL1_TYPE", "YOLOv5"),
+    "model2": os.getenv("MODEL2_TYPE", "YOLOv5")
 }
 
 # API ключи (реальные ключи из проекта)
@@ -100,46 +114,125 @@ class NutritionDetectionResponse(BaseModel):
     detections: List[DetectedObject]
     processing_time_sec: float
 
-# Функция для ленивой загрузки моделей (только когда они нужны)
+# Реестр моделей: предзагрузка при старте, прогрев и LRU-вытеснение
+model_registry = ModelRegistry(MODEL_PATHS, MODEL_TYPES)
+
 def get_model(model_name):
-    if models[model_name] is None:
-        if not os.path.exists(MODEL_PATHS[model_name]):
-            raise HTTPException(status_code=404, detail=f"Модель {model_name} не найдена")
-        
-        # Загружаем модель
-        try:
-            print(f"Загружаем модель {model_name}...")
-            
-            if MODEL_TYPES[model_name] == "YOLOv5":
-                # Загрузка YOLOv5 модели используя torch.hub
-                models[model_name] = torch.hub.load(
-                    yolov5_path, 
-                    'custom', 
-                    path=MODEL_PATHS[model_name],
-                    source='local'  # Используем локальную версию, а не загрузку с GitHub
-                )
-            else:
-                # Если это YOLOv8 модель, используем Ultralytics
-                from ultralytics import YOLO
-                models[model_name] = YOLO(MODEL_PATHS[model_name])
-                
-            print(f"Модель {model_name} успешно загружена!")
-        except Exception as e:
-            print(f"Ошибка при загрузке модели: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Ошибка загрузки модели: {str(e)}")
-    
-    return models[model_name]
+    """Возвращает модель из реестра (загружает, если она еще не в памяти)."""
+    try:
+        return model_registry.get(model_name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Модель {model_name} не найдена")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка загрузки модели: {str(e)}")
+
+# Продакшн-запуск через gunicorn (gunicorn.conf.py): модели загружаются один раз
+# в мастере, воркеры получают веса через fork. Torch в мастере ограничен одним
+# потоком, чтобы пул OpenMP не создавался до fork; воркеры настраивают свои потоки в post_fork.
+if MODEL_PRELOAD_IN_MASTER and INFERENCE_EXECUTOR != "process":
+    configure_torch_threads(1)
+    model_registry.preload_before_fork()
+
+register_memory_metrics()
+
+@app.on_event("startup")
+async def preload_models():
+    """Предзагружает модели в фоне: /health отвечает сразу, /ready - после прогрева."""
+    loop = asyncio.get_running_loop()
+    if MODEL_PRELOAD and inference_executor.uses_processes:
+        # В режиме пула процессов модели загружаются и прогреваются в самих процессах пула
+        model_registry.preload_started = True
+        asyncio.create_task(model_registry.preload_in_processes(
+            lambda name: inference_executor.run(
+                warm_up_in_process, name, MODEL_TYPES[name], MODEL_PATHS[name], MODEL_WARMUP_PASSES, MODEL_WARMUP_SIZE
+            )
+        ))
+    elif MODEL_PRELOAD:
+        model_registry.preload_started = True
+        loop.run_in_executor(None, model_registry.preload)
+    if MODEL_IDLE_TTL_SEC > 0:
+        asyncio.create_task(evict_idle_models())
+
+async def evict_idle_models():
+    while True:
+        await asyncio.sleep(min(MODEL_IDLE_TTL_SEC, 60))
+        await run_in_threadpool(model_registry.evict_idle)
+
+# Движок батч-инференса: группирует изображения из параллельных запросов
+# и выполняет прямой проход в отдельном пуле, не блокируя event loop
+# Планировщик один раз делит ядра воркера между параллельными проходами.
+# Батчи одной модели в пуле потоков идут по очереди, поэтому пул не меньше числа
+# моделей: модели ансамбля (model_name=all) выполняются одновременно. В пуле
+# процессов у каждого процесса свои копии моделей - там размер задается только лимитом
+if INFERENCE_EXECUTOR == "process":
+    inference_executor = InferenceExecutor()
+else:
+    inference_executor = InferenceExecutor(max_concurrency=max(INFERENCE_MAX_CONCURRENCY, len(MODEL_PATHS)))
+inference_scheduler = InferenceScheduler(inference_executor)
+# Контроль допуска: 503 при заполненной очереди, 429 если не успеваем к дедлайну клиента
+inference_admission = AdmissionController(inference_executor)
+inference_engine = BatchInferenceEngine(
+    get_model, MODEL_TYPES, MODEL_PATHS, inference_executor, admission=inference_admission
+)
+
+@app.on_event("shutdown")
+async def shutdown_inference():
+    await inference_engine.stop()
+
+# HTTP-клиенты внешних API: пулы keep-alive соединений живут вместе с приложением
+@app.on_event("startup")
+async def start_http_clients():
+    await http_clients.start()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await nutrition_cache.close()
+    await http_clients.close()
 
-def get_product_name_from_gemini(image_bytes, detections):
+# Пул соединений асинхронного движка БД закрывается вместе с приложением
+@app.on_event("shutdown")
+async def close_database():
+    await async_engine.dispose()
+
+# Бюджеты времени внешних API: после них отдаем фолбэк, а не ждем таймаут клиента.
+# Медленный ответ дублируется (hedging), при серии ошибок вызовы пропускаются (circuit breaker)
+GEMINI_BUDGET_MS = float(os.getenv("GEMINI_BUDGET_MS", "8000"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "true").lower() == "true"
+EDAMAM_BUDGET_MS = float(os.getenv("EDAMAM_BUDGET_MS", "3000"))
+EDAMAM_HEDGE = os.getenv("EDAMAM_HEDGE", "true").lower() == "true"
+gemini_upstream = ResilientUpstream("gemini", GEMINI_BUDGET_MS / 1000, hedge=GEMINI_HEDGE)
+edamam_upstream = ResilientUpstream("edamam", EDAMAM_BUDGET_MS / 1000, hedge=EDAMAM_HEDGE)
+# Одновременные одинаковые запросы (то же фото, тот же продукт) ждут один вызов сервиса
+gemini_flight = SingleFlight("gemini")
+edamam_flight = SingleFlight("edamam")
+
+async def get_product_name_from_gemini(image_bytes, detections, deadline=None):
     """
     Получает название продукта с помощью Gemini API.
+
+    Одновременные запросы с тем же изображением и теми же детекциями
+    получают результат одного вызова.
     """
+    key = (
+        hashlib.blake2b(image_bytes, digest_size=16).digest(),
+        tuple((d["class_name"], tuple(d["bbox"])) for d in detections or ()),
+    )
+    return await gemini_flight.do(key, lambda: request_product_name_from_gemini(image_bytes, detections, deadline))
+
+async def request_product_name_from_gemini(image_bytes, detections, deadline=None):
+    def fallback():
+        # Фолбэк: используем класс из первой детекции
+        if detections:
+            return detections[0]["class_name"]
+        return "unknown_food"
+
     try:
-        # Конвертируем изображение в Base64
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        # Обрезаем по боксам, уменьшаем и перекодируем (вне event loop), затем Base64
+        payload_image, transform = await run_in_threadpool(prepare_gemini_image, image_bytes, detections)
+        base64_image = base64.b64encode(payload_image).decode('utf-8')
         
-        # URL для Gemini API
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.0-pro:generateContent?key={GEMINI_API_KEY}"
+        # URL для Gemini API (базовый адрес задан в клиенте)
+        url = f"/v1beta/models/gemini-1.0-pro:generateContent?key={GEMINI_API_KEY}"
         
         # Подготовка текстового промпта
         prompt = """
@@ -150,8 +243,9 @@ def get_product_name_from_gemini(image_bytes, detections):
         # Если есть детекции, добавляем информацию о них в промпт
         if detections:
             prompt += "\nНа изображении обнаружены объекты со следующими координатами:\n"
-            for i, detection in enumerate(detections):
-                prompt += f"Объект {i+1}: {detection['bbox']}, уверенность: {detection['confidence']:.2f}\n"
+            # Координаты - в системе отправленного (обрезанного) изображения
+            for i, (detection, bbox) in enumerate(zip(detections, transform_boxes(detections, transform))):
+                prompt += f"Объект {i+1}: {bbox}, уверенность: {detection['confidence']:.2f}\n"
         
         # Формирование запроса для Gemini
         payload = {
@@ -180,15 +274,16 @@ def get_product_name_from_gemini(image_bytes, detections):
         headers = {
             "Content-Type": "application/json"
         }
-        
-        response = requests.post(url, json=payload, headers=headers)
+    except Exception as e:
+        print(f"Ошибка при подготовке запроса к Gemini: {str(e)}")
+        return fallback()
+
+    async def request():
+        response = await http_clients.get("gemini").post(url, json=payload, headers=headers)
         
         # Проверка ответа
         if response.status_code != 200:
-            print(f"Ошибка Gemini API: {response.status_code}, {response.text}")
-            if detections:
-                return detections[0]["class_name"]
-            return "unknown_food"
+            raise UpstreamError(f"Ошибка Gemini API: {response.status_code}, {response.text}")
         
         # Парсинг ответа
         result = response.json()
@@ -205,33 +300,57 @@ def get_product_name_from_gemini(image_bytes, detections):
                         return food_name
         
         # Если не удалось извлечь текст, используем класс из детекции
-        if detections:
-            return detections[0]["class_name"]
-        return "unknown_food"
-    
-    except Exception as e:
-        print(f"Ошибка при определении продукта через Gemini: {str(e)}")
-        # Фолбэк: используем класс из первой детекции
-        if detections:
-            return detections[0]["class_name"]
-        return "unknown_food"
+        return fallback()
+
+    return await gemini_upstream.call(request, fallback, deadline)
 
-def get_nutrition_from_edamam(product_name, count=1):
+async def get_nutrition_per_item(product_name, deadline=None):
     """
-    Получает информацию о питательной ценности из Edamam API.
+    Питательная ценность одной порции продукта.
+
+    Порядок поиска: кэш (память воркера, затем общий SQLite), локальная база,
+    Edamam, встроенный словарь. Одновременные запросы одного продукта
+    получают результат одного вызова.
     """
-    try:
-        # URL для Edamam API
-        url = f"https://api.edamam.com/api/nutrition-data?app_id={EDAMAM_APP_ID}&app_key={EDAMAM_APP_KEY}&ingr={product_name}"
-        
-        # Отправка запроса
-        response = requests.get(url)
+    # Один ключ для "Apples" и "apple", как в локальной базе
+    key = singular_food_name(product_name)
+    nutrition = await nutrition_cache.get(
+        key,
+        lambda: edamam_flight.do(key, lambda: lookup_nutrition(product_name, deadline)),
+        # Фоновое обновление устаревшей записи не ограничено дедлайном запроса
+        refresh_loader=lambda: edamam_flight.do(key, lambda: lookup_nutrition(product_name)),
+    )
+    if nutrition is None:
+        # Фолбэк: используем заглушки
+        nutrition_per_item, _ = use_nutrition_fallback(product_name)
+        return nutrition_per_item
+    return NutritionInfo(**nutrition)
+
+async def lookup_nutrition(product_name, deadline=None):
+    """Питательная ценность одного продукта: локальная база, затем Edamam с записью ответа в базу."""
+    stored = await run_in_threadpool(nutrition_store.lookup, product_name)
+    if stored is not None:
+        return stored
+    
+    nutrition_per_item = await request_nutrition_from_edamam(product_name, deadline)
+    if nutrition_per_item is None:
+        return None
+    nutrition = {field: getattr(nutrition_per_item, field) for field in NUTRIENT_FIELDS}
+    await run_in_threadpool(nutrition_store.save, product_name, nutrition)
+    return nutrition
+
+async def request_nutrition_from_edamam(product_name, deadline=None):
+    """Питательная ценность одного продукта из Edamam API (None - нет данных или сервис недоступен)."""
+    async def request():
+        # Отправка запроса (базовый адрес Edamam API задан в клиенте)
+        response = await http_clients.get("edamam").get(
+            "/api/nutrition-data",
+            params={"app_id": EDAMAM_APP_ID, "app_key": EDAMAM_APP_KEY, "ingr": product_name}
+        )
         
         # Проверка ответа
         if response.status_code != 200:
-            print(f"Ошибка Edamam API: {response.status_code}, {response.text}")
-            # Используем заглушку
-            return use_nutrition_fallback(product_name, count)
+            raise UpstreamError(f"Ошибка Edamam API: {response.status_code}, {response.text}")
         
         # Парсинг ответа
         result = response.json()
@@ -239,7 +358,7 @@ def get_nutrition_from_edamam(product_name, count=1):
         # Проверка, что есть данные о калориях
         if "calories" not in result or result["calories"] == 0:
             print(f"Edamam не вернул данные о калориях для {product_name}")
-            return use_nutrition_fallback(product_name, count)
+            return None
         
         # Извлечение данных о питательной ценности
         calories = result.get("calories", 0)
@@ -254,247 +373,405 @@ def get_nutrition_from_edamam(product_name, count=1):
         carbs = nutrients.get("CHOCDF", {}).get("quantity", 0.0) if "CHOCDF" in nutrients else 0.0
         
         # Создание объекта с информацией о питательной ценности для одного продукта
-        nutrition_per_item = NutritionInfo(
+        return NutritionInfo(
             calories=calories,
             protein=protein,
             fat=fat,
             carbs=carbs,
             serving_weight_grams=weight
         )
-        
-        # Расчет общей питательной ценности для всех продуктов
-        total_nutrition = NutritionInfo(
-            calories=calories * count,
-            protein=protein * count,
-            fat=fat * count,
-            carbs=carbs * count,
-            serving_weight_grams=weight * count
-        )
-        
-        return nutrition_per_item, total_nutrition
-    
-    except Exception as e:
-        print(f"Ошибка при получении питательной ценности через Edamam: {str(e)}")
-        # Фолбэк: используем заглушки
-        return use_nutrition_fallback(product_name, count)
+
+    return await edamam_upstream.call(request, lambda: None, deadline)
+
+# Общая заглушка, если продукта нет в словаре
+DEFAULT_NUTRITION = {
+    "calories": 100.0,
+    "protein": 5.0,
+    "fat": 3.0,
+    "carbs": 10.0,
+    "serving_weight_grams": 100.0,
+}
 
 def use_nutrition_fallback(product_name, count=1):
     """
-    Возвращает заглушки для питательной ценности, если API не работает.
+    Возвращает пищевую ценность из встроенного словаря продуктов, если API не работает.
     """
-    # Заглушки для демонстрации
-    sample_nutritions = {
-        "fried_chicken": NutritionInfo(
-            calories=250.0,
-            protein=15.0,
-            fat=16.0,
-            carbs=12.0,
-            serving_weight_grams=100.0
-        ),
-        "chicken": NutritionInfo(
-            calories=250.0,
-            protein=15.0,
-            fat=16.0,
-            carbs=12.0,
-            serving_weight_grams=100.0
-        ),
-        "shrimp": NutritionInfo(
-            calories=120.0,
-            protein=20.0,
-            fat=5.0,
-            carbs=3.0,
-            serving_weight_grams=30.0
-        ),
-        "shrimp tempura": NutritionInfo(
-            calories=200.0,
-            protein=12.0,
-            fat=12.0,
-            carbs=15.0,
-            serving_weight_grams=45.0
-        ),
-        "fruit": NutritionInfo(
-            calories=80.0,
-            protein=1.0,
-            fat=0.5,
-            carbs=20.0,
-            serving_weight_grams=120.0
-        ),
-        "apple": NutritionInfo(
-            calories=52.0,
-            protein=0.3,
-            fat=0.2,
-            carbs=14.0,
-            serving_weight_grams=100.0
-        ),
-        "nuggets": NutritionInfo(
-            calories=290.0,
-            protein=13.0,
-            fat=18.0,
-            carbs=18.0,
-            serving_weight_grams=85.0
-        ),
+    # Ищем продукт в словаре (точное вхождение названия или похожее название)
+    match = food_matcher.match(product_name)
+    nutrition = match.nutrition if match is not None else DEFAULT_NUTRITION
+    nutrition_per_item = NutritionInfo(**nutrition)
+    
+    # Рассчитываем общую питательную ценность
+    total_nutrition = NutritionInfo(
+        calories=nutrition_per_item.calories * count,
+        protein=nutrition_per_item.protein * count,
+        fat=nutrition_per_item.fat * count,
+        carbs=nutrition_per_item.carbs * count,
+        serving_weight_grams=nutrition_per_item.serving_weight_grams * count
+    )
+    
+    return nutrition_per_item, total_nutrition
+
+# Веса моделей при слиянии детекций ансамбля (model_name=all)
+ENSEMBLE_WEIGHTS = parse_weights()
+
+# Кэш результатов по перцептивному хэшу (повторные фото той же тарелки)
+result_cache = AnalyzeResultCache()
+
+# sequential - YOLO, затем Gemini, затем Edamam; speculative - Gemini запускается
+# параллельно с YOLO, и задержка близка к max(инференс, Gemini) + Edamam
+ANALYZE_PIPELINE_MODE = os.getenv("ANALYZE_PIPELINE_MODE", "sequential")
+
+# Максимальное количество фото в одном запросе /analyze/batch
+ANALYZE_BATCH_MAX_FILES = int(os.getenv("ANALYZE_BATCH_MAX_FILES", "16"))
+
+def preprocess_and_hash(image_bytes):
+    """Препроцессинг и перцептивный хэш изображения (выполняется вне event loop)."""
+    preprocessed = preprocess_image(image_bytes)
+    return preprocessed, perceptual_hash(preprocessed.array)
+
+def validate_analyze_params(model_name, conf_threshold):
+    """Возвращает ответ с ошибкой 400 или None, если параметры корректны."""
+    # Проверка порога уверенности
+    if conf_threshold < 0.01 or conf_threshold > 1.0:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Порог уверенности должен быть между 0.01 и 1.0"}
+        )
+    
+    # Проверка, что модель существует (all - ансамбль всех моделей)
+    if model_name not in ["model1", "model2", ENSEMBLE_MODEL_NAME]:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Неизвестная модель: {model_name}. Доступные модели: model1, model2, {ENSEMBLE_MODEL_NAME}"}
+        )
+    return None
+
+def nutrition_to_dict(nutrition):
+    """Преобразует Pydantic модель NutritionInfo в словарь для ответа."""
+    if not nutrition:
+        return None
+    return {
+        "calories": nutrition.calories,
+        "protein": nutrition.protein,
+        "fat": nutrition.fat,
+        "carbs": nutrition.carbs,
+        "serving_weight_grams": nutrition.serving_weight_grams
     }
+
+def rejected_response(error):
+    """Ответ на отказ контроля допуска: 503 или 429 с Retry-After."""
+    return JSONResponse(
+        status_code=error.status_code,
+        content={"error": str(error), "reason": error.reason, "retry_after_sec": error.retry_after},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+async def detect_objects(model_name, images, conf_threshold, deadline=None):
+    """
+    Инференс для одного или нескольких препроцессированных изображений.
+
+    Все изображения ставятся в очередь модели одновременно и проходят
+    одним батчем. Для model_name=all все модели получают те же буферы
+    и выполняются параллельно, а их детекции сливаются (WBF).
+    Возвращает список детекций для каждого изображения.
+    """
+    model_names = list(MODEL_PATHS) if model_name == ENSEMBLE_MODEL_NAME else [model_name]
+    arrays = [image.array for image in images]
+    try:
+        # Ждем все модели, даже если одна упала: буферы нельзя вернуть в пул, пока их читает другая
+        outputs = await asyncio.gather(
+            *(
+                inference_engine.infer_many(name, arrays, [conf_threshold] * len(images), deadline=deadline)
+                for name in model_names
+            ),
+            return_exceptions=True
+        )
+    finally:
+        # При отмене запроса буферы еще могут читаться батчем - в пул их не возвращаем
+        if not asyncio.current_task().cancelling():
+            for image in images:
+                image.release()
     
-    # Ищем подходящую заглушку по ключевым словам в названии продукта
-    product_name_lower = product_name.lower()
+    errors = [output for output in outputs if isinstance(output, BaseException)]
+    if len(errors) == len(outputs):
+        raise errors[0]
+    if model_name == ENSEMBLE_MODEL_NAME:
+        for name, output in zip(model_names, outputs):
+            if isinstance(output, BaseException):
+                print(f"Модель {name} не участвует в ансамбле: {str(output)}")
+        succeeded = [(name, output) for name, output in zip(model_names, outputs) if not isinstance(output, BaseException)]
+        weights = [ENSEMBLE_WEIGHTS.get(name, 1.0) for name, _ in succeeded]
+        results = [
+            fuse_predictions([output[index] for _, output in succeeded], weights, conf_threshold=conf_threshold)
+            for index in range(len(images))
+        ]
+    else:
+        results = outputs[0]
+    
+    detections = []
+    for image, (pred, class_names) in zip(images, results):
+        # Боксы переводим в координаты исходного фото сразу для всего массива
+        pred[:, :4] = image.restore_boxes(pred[:, :4])
+        detections.append(build_detections(pred, class_names))
+    return detections
+
+def start_product_naming(image_bytes, deadline=None):
+    """
+    В режиме speculative запускает Gemini сразу, параллельно с инференсом.
+
+    Боксы детекций в промпт не попадают (их еще нет), поэтому запрос
+    к Gemini не ждет YOLO. Возвращает задачу или None в режиме sequential.
+    """
+    if ANALYZE_PIPELINE_MODE != "speculative":
+        return None
+    return asyncio.create_task(get_product_name_from_gemini(image_bytes, None, deadline))
+
+def cancel_product_naming(tasks):
+    for task in tasks:
+        if task is not None:
+            task.cancel()
+
+async def describe_detections(image_bytes, detections, model_name, start_time, product_name_task=None, deadline=None):
+    """
+    Определяет продукты (таблица классов или Gemini) и питательную ценность и собирает ответ /analyze.
+
+    Детекции группируются по продуктам: пищевая ценность каждого продукта
+    запрашивается один раз (параллельно), итоги считаются по всей тарелке.
+    """
+    # Определяем количество объектов
+    count = len(detections)
     
-    for key, nutrition in sample_nutritions.items():
-        if key in product_name_lower:
-            # Нашли совпадение
-            nutrition_per_item = nutrition
-            
-            # Рассчитываем общую питательную ценность
-            total_nutrition = NutritionInfo(
-                calories=nutrition.calories * count,
-                protein=nutrition.protein * count,
-                fat=nutrition.fat * count,
-                carbs=nutrition.carbs * count,
-                serving_weight_grams=nutrition.serving_weight_grams * count
+    # Детекции делятся по классам; уверенные детекции известных классов
+    # называются по таблице без Gemini
+    plate = class_product_resolver.resolve(detections)
+    if plate is not None:
+        products = dict(plate.products)
+        if products:
+            print(f"Продукты определены по классам детекций: {products}")
+        if product_name_task is not None and not products and len(plate.unresolved) == 1:
+            # Один класс на фото: Gemini уже запущен параллельно с инференсом
+            group_names = [await product_name_task]
+        else:
+            if product_name_task is not None:
+                product_name_task.cancel()
+            # Классы без продукта из таблицы Gemini называет по своим боксам (параллельно)
+            group_names = await asyncio.gather(
+                *(get_product_name_from_gemini(image_bytes, group, deadline) for group in plate.unresolved)
             )
-            
-            return nutrition_per_item, total_nutrition
+        for group, product_name in zip(plate.unresolved, group_names):
+            if product_name == "unknown_food":
+                product_name = group[0]["class_name"]
+            print(f"Gemini определил продукт: {product_name} ({len(group)} шт.)")
+            products[product_name] = products.get(product_name, 0) + len(group)
+        products = dict(sorted(products.items(), key=lambda item: -item[1]))
+    # Детекций нет - Gemini называет все фото
+    else:
+        if product_name_task is not None:
+            # Gemini уже запущен параллельно с инференсом
+            product_name = await product_name_task
+        else:
+            product_name = await get_product_name_from_gemini(image_bytes, detections, deadline)
+        print(f"Gemini определил продукт: {product_name}")
+        products = {product_name: count}
     
-    # Если не нашли совпадений, используем общую заглушку
-    default_nutrition = NutritionInfo(
-        calories=100.0,
-        protein=5.0,
-        fat=3.0,
-        carbs=10.0,
-        serving_weight_grams=100.0
-    )
+    # Пищевая ценность одной порции каждого продукта - параллельно
+    names = list(products)
+    per_item = await asyncio.gather(*(get_nutrition_per_item(name, deadline) for name in names))
     
-    total_nutrition = NutritionInfo(
-        calories=default_nutrition.calories * count,
-        protein=default_nutrition.protein * count,
-        fat=default_nutrition.fat * count,
-        carbs=default_nutrition.carbs * count,
-        serving_weight_grams=default_nutrition.serving_weight_grams * count
-    )
+    # Итоги по продуктам и по тарелке
+    per_item_matrix = np.array([[getattr(n, field) for field in NUTRIENT_FIELDS] for n in per_item], dtype=np.float64)
+    counts = np.array([products[name] for name in names], dtype=np.float64)
+    totals_matrix = per_item_matrix * counts[:, None]
+    overall = NutritionInfo(**dict(zip(NUTRIENT_FIELDS, totals_matrix.sum(axis=0).tolist())))
+    
+    product_results = [
+        {
+            "product_name": name,
+            "count": products[name],
+            "nutrition_per_item": nutrition_to_dict(nutrition),
+            "total_nutrition": dict(zip(NUTRIENT_FIELDS, totals.tolist())),
+        }
+        for name, nutrition, totals in zip(names, per_item, totals_matrix)
+    ]
+    print(f"Пищевая ценность: {len(names)} продукт(ов), всего калорий: {overall.calories}")
     
-    return default_nutrition, total_nutrition
+    return {
+        "message": "Фото обработано успешно!",
+        "model": model_name,
+        "model_type": MODEL_TYPES.get(model_name, "ensemble"),
+        # Для нескольких продуктов - перечень, порция - самого частого продукта
+        "product_name": ", ".join(names),
+        "count": count,
+        "nutrition_per_item": nutrition_to_dict(per_item[0]),
+        "total_nutrition": nutrition_to_dict(overall),
+        "products": product_results,
+        "num_detections": len(detections),
+        "detections": detections,
+        "processing_time_sec": time.time() - start_time
+    }
+
+def get_cached_result(model_name, conf_threshold, image_hash, image_size, start_time):
+    """Результат для почти такого же фото из кэша или None (боксы - в размере image_size)."""
+    if not RESULT_CACHE_ENABLED:
+        return None
+    cached = result_cache.get(model_name, conf_threshold, image_hash, image_size)
+    if cached is not None:
+        cached["cached"] = True
+        cached["processing_time_sec"] = time.time() - start_time
+    return cached
 
 @app.post("/analyze", response_model=Dict[str, Any])
 async def analyze_image(
     file: UploadFile = File(..., description="Загрузите изображение"),
-    model_name: str = Form("model1", description="model1 или model2"),
-    conf_threshold: float = Form(0.1, description="Порог уверенности (0.01-1.0)")
+    model_name: str = Form("model1", description="model1, model2 или all (ансамбль)"),
+    conf_threshold: float = Form(0.1, description="Порог уверенности (0.01-1.0)"),
+    request_timeout_ms: Optional[float] = Header(None, alias="X-Request-Timeout-Ms", description="Сколько клиент готов ждать ответа")
 ):
     try:
-        # Проверка порога уверенности
-        if conf_threshold < 0.01 or conf_threshold > 1.0:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "Порог уверенности должен быть между 0.01 и 1.0"}
-            )
-        
-        # Проверка, что модель существует
-        if model_name not in ["model1", "model2"]:
-            return JSONResponse(
-                status_code=400,
-                content={"error": f"Неизвестная модель: {model_name}. Доступные модели: model1, model2"}
-            )
+        error_response = validate_analyze_params(model_name, conf_threshold)
+        if error_response:
+            return error_response
         
         start_time = time.time()
+        deadline = deadline_from_timeout(request_timeout_ms, start_time)
         
         # Чтение изображения
         image_bytes = await file.read()
-        image_pil = Image.open(io.BytesIO(image_bytes))
-        
-        # Получение модели
-        model = get_model(model_name)
-        
-        # Инференс
-        detections = []
-        if MODEL_TYPES[model_name] == "YOLOv5":
-            # YOLOv5 инференс с пользовательским порогом уверенности
-            # Не передаем conf в вызов, он не поддерживается
-            results = model(image_pil)
-            
-            # Обработка результатов YOLOv5
-            for pred in results.pred[0]:
-                x1, y1, x2, y2, conf, cls = pred.tolist()
-                # Применяем фильтрацию по порогу уверенности здесь
-                if float(conf) >= conf_threshold:
-                    class_name = results.names[int(cls)]
-                    
-                    detections.append({
-                        "bbox": [x1, y1, x2, y2],
-                        "confidence": float(conf),
-                        "class_id": int(cls),
-                        "class_name": class_name
-                    })
-        else:
-            # YOLOv8 инференс с пользовательским порогом уверенности
-            results = model(image_pil, conf=conf_threshold)
-            
-            # Обработка результатов YOLOv8
-            if hasattr(results[0], 'boxes'):
-                for box in results[0].boxes:
-                    # Получаем координаты
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    
-                    # Получаем класс и уверенность
-                    confidence = float(box.conf[0])
-                    class_id = int(box.cls[0])
-                    class_name = results[0].names[class_id]
-                    
-                    detections.append({
-                        "bbox": [x1, y1, x2, y2],
-                        "confidence": confidence,
-                        "class_id": class_id,
-                        "class_name": class_name
-                    })
-        
-        # Определяем количество объектов
-        count = len(detections)
-        
-        # Интегрируем с Gemini для определения названия продукта
-        product_name = get_product_name_from_gemini(image_bytes, detections)
-        print(f"Gemini определил продукт: {product_name}")
-        
-        # Получаем информацию о питательной ценности
-        nutrition_per_item, total_nutrition = get_nutrition_from_edamam(product_name, count)
-        print(f"Edamam вернул данные: калории на 1 шт: {nutrition_per_item.calories}, всего: {total_nutrition.calories}")
-        
-        # Преобразуем Pydantic модели в словари для ответа
-        nutrition_item_dict = None
-        if nutrition_per_item:
-            nutrition_item_dict = {
-                "calories": nutrition_per_item.calories,
-                "protein": nutrition_per_item.protein,
-                "fat": nutrition_per_item.fat,
-                "carbs": nutrition_per_item.carbs,
-                "serving_weight_grams": nutrition_per_item.serving_weight_grams
-            }
-        
-        total_nutrition_dict = None
-        if total_nutrition:
-            total_nutrition_dict = {
-                "calories": total_nutrition.calories,
-                "protein": total_nutrition.protein,
-                "fat": total_nutrition.fat,
-                "carbs": total_nutrition.carbs,
-                "serving_weight_grams": total_nutrition.serving_weight_grams
-            }
+        # Декодирование в уменьшенном разрешении + letterbox (вне event loop)
+        preprocessed, image_hash = await run_in_threadpool(preprocess_and_hash, image_bytes)
         
-        processing_time = time.time() - start_time
+        # Почти такое же фото уже анализировалось - отдаем готовый результат
+        cached = get_cached_result(model_name, conf_threshold, image_hash, preprocessed.original_size, start_time)
+        if cached is not None:
+            preprocessed.release()
+            return cached
         
-        return {
-            "message": "Фото обработано успешно!",
-            "model": model_name,
-            "model_type": MODEL_TYPES[model_name],
-            "product_name": product_name,
-            "count": count,
-            "nutrition_per_item": nutrition_item_dict,
-            "total_nutrition": total_nutrition_dict,
-            "num_detections": len(detections),
-            "detections": detections,
-            "processing_time_sec": processing_time
-        }
+        # Gemini стартует до инференса (в режиме speculative), кэш уже проверен
+        product_name_task = start_product_naming(image_bytes, deadline)
+        try:
+            # Инференс: изображение попадает в общий батч модели
+            detections = (await detect_objects(model_name, [preprocessed], conf_threshold, deadline))[0]
+        except BaseException:
+            cancel_product_naming([product_name_task])
+            raise
+        
+        result = await describe_detections(image_bytes, detections, model_name, start_time, product_name_task, deadline)
+        if RESULT_CACHE_ENABLED:
+            result_cache.put(model_name, conf_threshold, image_hash, preprocessed.original_size, result)
+        return result
+    except InferenceQueueFull as e:
+        return rejected_response(e)
     except Exception as e:
         print(f"Ошибка при обработке изображения: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка при обработке изображения: {str(e)}")
 
+def ndjson_line(data):
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(..., description="Загрузите одно или несколько изображений"),
+    model_name: str = Form("model1", description="model1, model2 или all (ансамбль)"),
+    conf_threshold: float = Form(0.1, description="Порог уверенности (0.01-1.0)"),
+    request_timeout_ms: Optional[float] = Header(None, alias="X-Request-Timeout-Ms", description="Сколько клиент готов ждать ответа")
+):
+    """
+    Анализ нескольких фото в одном запросе.
+
+    Все фото проходят через модель одним батчем, названия продуктов и
+    питательная ценность определяются параллельно. Ответ - NDJSON:
+    по строке на каждое фото в порядке готовности и итоговая строка с "done".
+    """
+    error_response = validate_analyze_params(model_name, conf_threshold)
+    if error_response:
+        return error_response
+    if len(files) > ANALYZE_BATCH_MAX_FILES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Слишком много файлов: {len(files)}. Максимум: {ANALYZE_BATCH_MAX_FILES}"}
+        )
+    
+    start_time = time.time()
+    deadline = deadline_from_timeout(request_timeout_ms, start_time)
+    images = [await file.read() for file in files]
+    prepared = await asyncio.gather(
+        *(run_in_threadpool(preprocess_and_hash, image_bytes) for image_bytes in images),
+        return_exceptions=True
+    )
+    
+    # Сразу готовые строки: ошибки декодирования и попадания в кэш
+    ready_lines = []
+    to_infer = []
+    for index, item in enumerate(prepared):
+        base = {"index": index, "filename": files[index].filename}
+        if isinstance(item, Exception):
+            ready_lines.append({**base, "error": f"Ошибка при чтении изображения: {str(item)}"})
+            continue
+        preprocessed, image_hash = item
+        cached = get_cached_result(model_name, conf_threshold, image_hash, preprocessed.original_size, start_time)
+        if cached is not None:
+            preprocessed.release()
+            ready_lines.append({**base, **cached})
+        else:
+            to_infer.append((index, preprocessed, image_hash))
+    
+    # В режиме speculative Gemini для каждого фото стартует параллельно с батчем
+    product_name_tasks = [start_product_naming(images[index], deadline) for index, _, _ in to_infer]
+    
+    # Один батч на все оставшиеся фото; при отказе контроля допуска отвечаем 503/429 целиком
+    try:
+        detections = await detect_objects(model_name, [item[1] for item in to_infer], conf_threshold, deadline) if to_infer else []
+    except asyncio.CancelledError:
+        cancel_product_naming(product_name_tasks)
+        raise
+    except InferenceQueueFull as e:
+        cancel_product_naming(product_name_tasks)
+        return rejected_response(e)
+    except Exception as e:
+        cancel_product_naming(product_name_tasks)
+        print(f"Ошибка при пакетной обработке изображений: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при обработке изображений: {str(e)}")
+    
+    async def describe(index, image_hash, image_size, image_detections, product_name_task):
+        base = {"index": index, "filename": files[index].filename}
+        try:
+            result = await describe_detections(
+                images[index], image_detections, model_name, start_time, product_name_task, deadline
+            )
+        except Exception as e:
+            print(f"Ошибка при обработке изображения {index}: {str(e)}")
+            return {**base, "error": f"Ошибка при обработке изображения: {str(e)}"}
+        if RESULT_CACHE_ENABLED:
+            result_cache.put(model_name, conf_threshold, image_hash, image_size, result)
+        return {**base, **result}
+    
+    async def stream():
+        for line in ready_lines:
+            yield ndjson_line(line)
+        
+        tasks = [
+            asyncio.create_task(describe(index, image_hash, preprocessed.original_size, image_detections, product_name_task))
+            for (index, preprocessed, image_hash), image_detections, product_name_task
+            in zip(to_infer, detections, product_name_tasks)
+        ]
+        try:
+            # Отдаем результат каждого фото, как только он готов
+            for next_done in asyncio.as_completed(tasks):
+                yield ndjson_line(await next_done)
+        finally:
+            for task in tasks:
+                task.cancel()
+            cancel_product_naming(product_name_tasks)
+        
+        yield ndjson_line({
+            "done": True,
+            "count": len(files),
+            "processing_time_sec": time.time() - start_time
+        })
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.get("/")
 async def root():
     return {"message": "API детекции продуктов с подсчетом питательной ценности. Перейдите на /docs для документации."}
@@ -509,33 +786,48 @@ async def health_check():
         "db_status": "connected" if engine else "disconnected"
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики Prometheus (батчинг, задержки инференса)"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/models")
 async def list_models():
-    # Проверяем наличие файлов моделей
-    status = {}
-    for name, path in MODEL_PATHS.items():
-        status[name] = {
-            "path": path,
-            "exists": os.path.exists(path),
-            "loaded": models[name] is not None,
-            "type": MODEL_TYPES[name]
-        }
-    
+    # Состояние моделей в реестре (загрузка, прогрев, память)
     return {
-        "available_models": status
+        "available_models": model_registry.status(),
+        "memory_budget_mb": MODEL_MEMORY_BUDGET_MB,
+        "ready": model_registry.is_ready(),
+        "scheduler": inference_scheduler.status(),
+        # Память текущего воркера: pss учитывает разделяемые с мастером веса по доле
+        "worker": {"pid": os.getpid(), "memory_bytes": read_memory()}
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Endpoint готовности: 503, пока модели не загружены и не прогреты."""
+    if not model_registry.is_ready():
+        return JSONResponse(
+            status_code=503,
+            content={"status": "loading", "models": model_registry.status()}
+        )
+    missing = model_registry.missing()
+    if missing:
+        # Воркер обслуживает остальные модели, но конфигурацию надо исправить
+        return {"status": "ready", "missing_models": missing}
+    return {"status": "ready"}
+
 # Новые эндпоинты для аутентификации и работы с пользователями
 
 @app.post("/auth/google", response_model=Token)
-async def google_auth(token: GoogleToken, db: Session = Depends(get_db)):
+async def google_auth(token: GoogleToken, db: AsyncSession = Depends(get_async_db)):
     """Аутентификация через Google OAuth"""
     try:
         # Проверяем Google токен
         google_user = await verify_google_token(token.id_token)
         
         # Получаем или создаем пользователя
-        user = get_or_create_user(db, google_user)
+        user = await get_or_create_user_async(db, google_user)
         
         # Создаем JWT токен
         return create_user_token(user)
@@ -546,17 +838,17 @@ async def google_auth(token: GoogleToken, db: Session = Depends(get_db)):
         )
 
 @app.get("/users/me", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: User = Depends(get_current_user_async)):
     """Получение информации о текущем пользователе"""
     return current_user
 
 @app.get("/users/me/profile", response_model=UserProfileResponse)
 async def read_user_profile(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение профиля текущего пользователя"""
-    profile = get_user_profile(db, current_user.id)
+    profile = await get_user_profile_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -567,12 +859,12 @@ async def read_user_profile(
 @app.post("/users/me/profile", response_model=UserProfileResponse)
 async def create_profile(
     profile: UserProfileCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Создание профиля пользователя"""
     # Проверяем, существует ли уже профиль
-    existing_profile = get_user_profile(db, current_user.id)
+    existing_profile = await get_user_profile_async(db, current_user.id)
     if existing_profile:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -580,16 +872,16 @@ async def create_profile(
         )
     
     # Создаем новый профиль
-    return create_user_profile(db, current_user.id, profile)
+    return await create_user_profile_async(db, current_user.id, profile)
 
 @app.put("/users/me/profile", response_model=UserProfileResponse)
 async def update_profile(
     profile: UserProfileUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Обновление профиля пользователя"""
-    updated_profile = update_user_profile(db, current_user.id, profile)
+    updated_profile = await update_user_profile_async(db, current_user.id, profile)
     if not updated_profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -600,74 +892,97 @@ async def update_profile(
 @app.post("/users/me/weight", response_model=WeightHistoryResponse)
 async def add_weight(
     weight: float,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Добавление записи о весе"""
-    profile = get_user_profile(db, current_user.id)
+    profile = await get_user_profile_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found"
         )
-    return add_weight_record(db, profile.id, weight)
+    return await add_weight_record_async(db, profile.id, weight)
 
 @app.get("/users/me/weight/history", response_model=List[WeightHistoryResponse])
 async def get_weight_history_endpoint(
     limit: int = 30,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение истории веса"""
-    profile = get_user_profile(db, current_user.id)
+    profile = await get_user_profile_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found"
         )
-    return get_weight_history(db, profile.id, limit)
+    return await get_weight_history_async(db, profile.id, limit)
 
 @app.post("/users/me/water", response_model=WaterHistoryResponse)
 async def add_water(
     amount: float,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Добавление записи о потреблении воды"""
-    profile = get_user_profile(db, current_user.id)
+    profile = await get_user_profile_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found"
         )
-    return add_water_record(db, profile.id, amount)
+    return await add_water_record_async(db, profile.id, amount)
 
 @app.get("/users/me/water/history", response_model=List[WaterHistoryResponse])
 async def get_water_history_endpoint(
     limit: int = 30,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение истории потребления воды"""
-    profile = get_user_profile(db, current_user.id)
+    profile = await get_user_profile_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found"
         )
-    return get_water_history(db, profile.id, limit)
+    return await get_water_history_async(db, profile.id, limit)
 
 @app.get("/users/me/water/today")
 async def get_today_water(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение количества воды, выпитой сегодня"""
-    profile = get_user_profile(db, current_user.id)
+    profile = await get_user_profile_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found"
         )
-    amount = get_today_water_amount(db, profile.id)
+    amount = await get_today_water_amount_async(db, profile.id)
     return {"amount": amount}
+
+@app.get("/users/me/water/daily", response_model=List[WaterDailyResponse])
+async def get_water_daily_endpoint(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Потребление воды по дням (UTC) за период, по умолчанию - последние 30 дней"""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must not be after end"
+        )
+    profile = await get_user_profile_async(db, current_user.id)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return await get_water_daily_async(db, profile.id, start, end)
@@ -26,7 +26,7 @@ config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL)
 fileConfig(config.config_file_name)
 
 # Import models to register them with the Base metadata
-from models import Base, User, UserProfile, WeightHistory, WaterHistory
+from models import Base, User, UserProfile, WeightHistory, WaterHistory, WaterDaily, NutritionFood
 
 # add your model's MetaData object here
 # for 'autogenerate' support
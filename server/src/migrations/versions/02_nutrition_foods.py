@@ -0,0 +1,39 @@
+"""nutrition foods
+
+Revision ID: 02_nutrition_foods
+Revises: 01_initial
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '02_nutrition_foods'
+down_revision = '01_initial'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('nutrition_foods',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('normalized_name', sa.String(), nullable=True),
+        sa.Column('calories', sa.Float(), nullable=True),
+        sa.Column('protein', sa.Float(), nullable=True),
+        sa.Column('fat', sa.Float(), nullable=True),
+        sa.Column('carbs', sa.Float(), nullable=True),
+        sa.Column('serving_weight_grams', sa.Float(), nullable=True),
+        sa.Column('source', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_nutrition_foods_normalized_name'), 'nutrition_foods', ['normalized_name'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_nutrition_foods_normalized_name'), table_name='nutrition_foods')
+    op.drop_table('nutrition_foods')
@@ -0,0 +1,42 @@
+"""water daily rollup
+
+Revision ID: 03_water_daily
+Revises: 02_nutrition_foods
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '03_water_daily'
+down_revision = '02_nutrition_foods'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('water_daily',
+        sa.Column('profile_id', sa.String(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('total_ml', sa.Float(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['profile_id'], ['user_profiles.id'], ),
+        sa.PrimaryKeyConstraint('profile_id', 'day')
+    )
+
+    # Заполнение по существующей истории; день считается в UTC, как в crud.add_water_record
+    if op.get_bind().dialect.name == 'postgresql':
+        day = "CAST(date AT TIME ZONE 'UTC' AS DATE)"
+    else:
+        day = "DATE(date)"
+    op.execute(
+        "INSERT INTO water_daily (profile_id, day, total_ml, count) "
+        f"SELECT profile_id, {day}, COALESCE(SUM(amount), 0), COUNT(*) FROM water_history "
+        f"WHERE profile_id IS NOT NULL AND date IS NOT NULL GROUP BY profile_id, {day}"
+    )
+
+
+def downgrade():
+    op.drop_table('water_daily')
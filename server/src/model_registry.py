@@ -0,0 +1,310 @@
+"""
+Реестр моделей: предзагрузка при старте, прогрев, LRU-вытеснение.
+
+Загрузка сериализована блокировкой, поэтому одновременные первые запросы
+не вызывают torch.hub.load несколько раз. Если суммарный размер загруженных
+моделей превышает MODEL_MEMORY_BUDGET_MB, дольше всех не использовавшиеся
+модели выгружаются.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+from inference import load_weights, run_batch
+from worker_runtime import share_model_memory
+
+# Настройки реестра
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "true").lower() == "true"
+MODEL_WARMUP_PASSES = int(os.getenv("MODEL_WARMUP_PASSES", "2"))
+MODEL_WARMUP_SIZE = int(os.getenv("MODEL_WARMUP_SIZE", "640"))
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))  # 0 - без ограничения
+MODEL_IDLE_TTL_SEC = float(os.getenv("MODEL_IDLE_TTL_SEC", "0"))  # 0 - не выгружать по простою
+
+# ONNX Runtime создает пулы потоков вместе с сессией, после fork они не работают,
+# поэтому такие модели загружаются уже в воркерах
+FORK_UNSAFE_MODEL_TYPES = ("ONNX",)
+
+MODEL_LOADED = Gauge("model_loaded", "Загружена ли модель (1/0)", ["model"])
+MODEL_MEMORY = Gauge("model_memory_bytes", "Оценка памяти, занятой весами модели", ["model"])
+MODEL_LOAD_SECONDS = Gauge("model_load_seconds", "Длительность последней загрузки модели", ["model"])
+MODEL_EVICTIONS = Counter("model_evictions_total", "Количество выгрузок модели", ["model", "reason"])
+
+# Состояния модели
+STATE_NOT_LOADED = "not_loaded"
+STATE_LOADING = "loading"
+STATE_WARMING_UP = "warming_up"
+STATE_READY = "ready"
+STATE_EVICTED = "evicted"
+STATE_ERROR = "error"
+STATE_MISSING = "missing"  # файла весов нет: ошибка конфигурации, на готовность воркера не влияет
+
+
+def estimate_model_size(model, model_path: str) -> int:
+    """Оценивает объем памяти весов модели в байтах."""
+    # YOLOv5 (AutoShape) - сам nn.Module, у YOLOv8 модуль лежит в .model
+    for module in (model, getattr(model, "model", None)):
+        if module is not None and hasattr(module, "parameters"):
+            try:
+                size = sum(p.numel() * p.element_size() for p in module.parameters())
+                size += sum(b.numel() * b.element_size() for b in module.buffers())
+                return size
+            except Exception:
+                continue
+    # Если параметры недоступны, ориентируемся на размер файла
+    return os.path.getsize(model_path) if os.path.exists(model_path) else 0
+
+
+class _ModelEntry:
+    """Состояние одной модели в реестре."""
+
+    __slots__ = ("name", "model", "state", "error", "size_bytes", "load_time_sec", "warmup_time_sec", "last_used")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.model = None
+        self.state = STATE_NOT_LOADED
+        self.error: Optional[str] = None
+        self.size_bytes = 0
+        self.load_time_sec: Optional[float] = None
+        self.warmup_time_sec: Optional[float] = None
+        self.last_used: Optional[float] = None
+
+
+class ModelRegistry:
+    """
+    Хранит загруженные модели и управляет их жизненным циклом.
+
+    Args:
+        model_paths: Словарь путей к весам (MODEL_PATHS)
+        model_types: Словарь типов моделей (MODEL_TYPES)
+        loader: Функция загрузки весов (model_type, model_path) -> model
+        warmup_passes: Количество прогревочных прямых проходов после загрузки
+        memory_budget_mb: Лимит памяти для всех моделей (0 - без ограничения)
+    """
+
+    def __init__(
+        self,
+        model_paths: Dict[str, str],
+        model_types: Dict[str, str],
+        loader: Callable[[str, str], Any] = load_weights,
+        warmup_passes: int = MODEL_WARMUP_PASSES,
+        memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB,
+    ):
+        self.model_paths = model_paths
+        self.model_types = model_types
+        self.loader = loader
+        self.warmup_passes = warmup_passes
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._entries = {name: _ModelEntry(name) for name in model_paths}
+        # Порядок использования загруженных моделей: первой идет самая давняя
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self.preload_started = False
+        self.preload_finished = False
+
+    def get(self, model_name: str):
+        """Возвращает модель, при необходимости загружая и прогревая ее."""
+        entry = self._entries[model_name]
+        model = entry.model
+        if model is None:
+            with self._load_lock:
+                # Модель могла загрузиться, пока мы ждали блокировку
+                if entry.model is None:
+                    self._load(entry)
+                model = entry.model
+        self._touch(entry)
+        return model
+
+    def _touch(self, entry: _ModelEntry):
+        with self._state_lock:
+            entry.last_used = time.time()
+            if entry.name in self._lru:
+                self._lru.move_to_end(entry.name)
+
+    def _check_file(self, entry: _ModelEntry) -> str:
+        path = self.model_paths[entry.name]
+        if not os.path.exists(path):
+            entry.state = STATE_MISSING
+            entry.error = f"Файл модели не найден: {path}"
+            raise FileNotFoundError(entry.error)
+        return path
+
+    def _load(self, entry: _ModelEntry):
+        path = self._check_file(entry)
+
+        print(f"Загружаем модель {entry.name}...")
+        entry.state = STATE_LOADING
+        entry.error = None
+        started_at = time.perf_counter()
+        try:
+            model = self.loader(self.model_types[entry.name], path)
+            entry.load_time_sec = time.perf_counter() - started_at
+
+            entry.state = STATE_WARMING_UP
+            self._warm_up(entry.name, model)
+        except Exception as e:
+            entry.state = STATE_ERROR
+            entry.error = str(e)
+            print(f"Ошибка при загрузке модели {entry.name}: {str(e)}")
+            raise
+
+        with self._state_lock:
+            entry.model = model
+            entry.size_bytes = estimate_model_size(model, path)
+            entry.state = STATE_READY
+            entry.last_used = time.time()
+            self._lru[entry.name] = None
+            self._lru.move_to_end(entry.name)
+
+        MODEL_LOADED.labels(model=entry.name).set(1)
+        MODEL_MEMORY.labels(model=entry.name).set(entry.size_bytes)
+        MODEL_LOAD_SECONDS.labels(model=entry.name).set(entry.load_time_sec)
+        print(f"Модель {entry.name} успешно загружена! "
+              f"({entry.size_bytes / 1024 / 1024:.1f} МБ, {entry.load_time_sec:.2f} с)")
+
+        self._enforce_budget(keep=entry.name)
+
+    def _warm_up(self, model_name: str, model):
+        """Прогоняет несколько пустых изображений, чтобы первый запрос не платил за инициализацию."""
+        if self.warmup_passes <= 0:
+            return
+        entry = self._entries[model_name]
+        dummy = np.zeros((MODEL_WARMUP_SIZE, MODEL_WARMUP_SIZE, 3), dtype=np.uint8)
+        started_at = time.perf_counter()
+        for _ in range(self.warmup_passes):
+            run_batch(model, self.model_types[model_name], [dummy], [1.0])
+        entry.warmup_time_sec = time.perf_counter() - started_at
+
+    def _total_size(self) -> int:
+        return sum(self._entries[name].size_bytes for name in self._lru)
+
+    def _enforce_budget(self, keep: str):
+        """Выгружает модели в порядке LRU, пока не уложимся в бюджет памяти."""
+        if self.memory_budget <= 0:
+            return
+        while self._total_size() > self.memory_budget:
+            victim = next((name for name in self._lru if name != keep), None)
+            if victim is None:
+                break
+            self._evict(victim, reason="memory_budget")
+
+    def _evict(self, model_name: str, reason: str):
+        entry = self._entries[model_name]
+        with self._state_lock:
+            self._lru.pop(model_name, None)
+            entry.model = None
+            entry.size_bytes = 0
+            entry.state = STATE_EVICTED
+        MODEL_LOADED.labels(model=model_name).set(0)
+        MODEL_MEMORY.labels(model=model_name).set(0)
+        MODEL_EVICTIONS.labels(model=model_name, reason=reason).inc()
+        print(f"Модель {model_name} выгружена ({reason})")
+
+    def evict_idle(self, idle_ttl_sec: float = MODEL_IDLE_TTL_SEC):
+        """Выгружает модели, которые не использовались дольше idle_ttl_sec."""
+        if idle_ttl_sec <= 0:
+            return
+        now = time.time()
+        with self._load_lock:
+            for name in list(self._lru):
+                entry = self._entries[name]
+                if entry.last_used is not None and now - entry.last_used > idle_ttl_sec:
+                    self._evict(name, reason="idle")
+
+    def preload(self):
+        """Загружает и прогревает все модели из MODEL_PATHS (ошибки не прерывают старт)."""
+        self.preload_started = True
+        try:
+            for name in self.model_paths:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Не удалось предзагрузить модель {name}: {str(e)}")
+        finally:
+            self.preload_finished = True
+
+    async def preload_in_processes(self, warm_up: Callable[[str], Awaitable[float]]):
+        """
+        Предзагрузка в режиме пула процессов: веса загружает и прогревает процесс
+        пула (warm_up(model_name) возвращает время прогрева), реестр воркера
+        только отслеживает состояние для /ready и /models.
+        """
+        self.preload_started = True
+        try:
+            for name, entry in self._entries.items():
+                try:
+                    self._check_file(entry)
+                    entry.state = STATE_WARMING_UP
+                    entry.error = None
+                    entry.warmup_time_sec = await warm_up(name)
+                    entry.state = STATE_READY
+                except Exception as e:
+                    if entry.state != STATE_MISSING:
+                        entry.state = STATE_ERROR
+                        entry.error = str(e)
+                    print(f"Не удалось предзагрузить модель {name} в пуле процессов: {str(e)}")
+        finally:
+            self.preload_finished = True
+
+    def preload_before_fork(self):
+        """
+        Загружает модели в мастер-процессе gunicorn до создания воркеров.
+
+        Веса переносятся в разделяемую память, и воркеры после fork
+        используют одну копию вместо загрузки своей.
+        """
+        for name in self.model_paths:
+            if self.model_types[name] in FORK_UNSAFE_MODEL_TYPES:
+                print(f"Модель {name} ({self.model_types[name]}) будет загружена в воркерах")
+                continue
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Не удалось предзагрузить модель {name} в мастере: {str(e)}")
+        share_model_memory(entry.model for entry in self._entries.values() if entry.model is not None)
+
+    def is_loaded(self, model_name: str) -> bool:
+        return self._entries[model_name].model is not None
+
+    def missing(self) -> List[str]:
+        """Модели, для которых нет файла весов."""
+        return [name for name, entry in self._entries.items() if entry.state == STATE_MISSING]
+
+    def is_ready(self) -> bool:
+        """
+        Готов ли воркер принимать трафик: предзагрузка завершена и все модели прогреты.
+
+        Модели без файла весов (ошибка конфигурации) не учитываются: перезапуск
+        их не исправит, а остальные модели могут обслуживать запросы.
+        """
+        if not self.preload_started:
+            return True
+        if not self.preload_finished:
+            return False
+        entries = [entry for entry in self._entries.values() if entry.state != STATE_MISSING]
+        return bool(entries) and all(entry.state in (STATE_READY, STATE_EVICTED) for entry in entries)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние каждой модели для /models."""
+        result = {}
+        for name, entry in self._entries.items():
+            path = self.model_paths[name]
+            result[name] = {
+                "path": path,
+                "exists": os.path.exists(path),
+                "loaded": entry.model is not None,
+                "type": self.model_types[name],
+                "state": entry.state,
+                "error": entry.error,
+                "size_mb": round(entry.size_bytes / 1024 / 1024, 2),
+                "load_time_sec": entry.load_time_sec,
+                "warmup_time_sec": entry.warmup_time_sec,
+                "last_used": entry.last_used,
+            }
+        return result
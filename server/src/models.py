@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, JSON, ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -78,6 +78,15 @@ class WaterHistory(Base):
     # Связь с профилем
     profile = relationship("UserProfile", back_populates="water_history")
 
+class WaterDaily(Base):
+    __tablename__ = "water_daily"
+    
+    # Сумма water_history за день (UTC), обновляется вместе с добавлением записи
+    profile_id = Column(String, ForeignKey("user_profiles.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_ml = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)  # число записей за день
+
 class File(Base):
     __tablename__ = "files"
     
@@ -91,4 +100,22 @@ class File(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Связь с пользователем
-    user = relationship("User", back_populates="files") 
\ No newline at end of file
+    user = relationship("User", back_populates="files")
+
+class NutritionFood(Base):
+    __tablename__ = "nutrition_foods"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String)  # название как в источнике
+    normalized_name = Column(String, unique=True, index=True)  # ключ поиска (nutrition_store.singular_food_name)
+    
+    # Пищевая ценность одной порции
+    calories = Column(Float)
+    protein = Column(Float)  # в граммах
+    fat = Column(Float)  # в граммах
+    carbs = Column(Float)  # в граммах
+    serving_weight_grams = Column(Float)
+    
+    source = Column(String)  # usda, csv, json, edamam
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -0,0 +1,258 @@
+"""
+Двухуровневый кэш пищевой ценности по нормализованному названию продукта.
+
+    local  - LRU в памяти процесса (ограничен по числу записей);
+    shared - файл SQLite, общий для всех воркеров на машине и переживающий
+             перезапуск.
+
+В кэше хранится пищевая ценность одной порции, итог для count считается
+вызывающим. Запись свежая NUTRITION_CACHE_TTL_SEC; после этого еще
+NUTRITION_CACHE_STALE_SEC она отдается сразу, а в фоне загружается новая
+(stale-while-revalidate).
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter, Gauge
+
+# Настройки кэша
+NUTRITION_CACHE_ENABLED = os.getenv("NUTRITION_CACHE_ENABLED", "true").lower() == "true"
+NUTRITION_CACHE_MAX_ENTRIES = int(os.getenv("NUTRITION_CACHE_MAX_ENTRIES", "4096"))
+NUTRITION_CACHE_TTL_SEC = float(os.getenv("NUTRITION_CACHE_TTL_SEC", "86400"))
+NUTRITION_CACHE_STALE_SEC = float(os.getenv("NUTRITION_CACHE_STALE_SEC", "604800"))
+# Пусто - без общего уровня. По умолчанию - том данных /data (docker-compose), а не
+# каталог с кодом; если /data недоступен на запись, общий уровень отключается
+NUTRITION_CACHE_PATH = os.getenv("NUTRITION_CACHE_PATH", "/data/nutrition_cache.sqlite3")
+
+CACHE_LOOKUPS = Counter(
+    "nutrition_cache_lookups_total", "Обращения к кэшу пищевой ценности по уровням", ["tier", "result"]
+)
+CACHE_REFRESHES = Counter("nutrition_cache_refreshes_total", "Фоновые обновления устаревших записей", ["result"])
+CACHE_ENTRIES = Gauge("nutrition_cache_local_entries", "Записей в локальном кэше пищевой ценности")
+
+Entry = Tuple[Dict[str, Any], float]  # значение и время записи (time.time())
+
+
+class LocalNutritionCache:
+    """LRU в памяти процесса; записи старше max_age удаляются при обращении."""
+
+    def __init__(self, max_entries: int = NUTRITION_CACHE_MAX_ENTRIES, max_age: float = None):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        CACHE_ENTRIES.set_function(lambda: len(self._entries))
+
+    def get(self, key: str, now: float) -> Optional[Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.max_age is not None and now - entry[1] > self.max_age:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, value: Dict[str, Any], stored_at: float):
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class SharedNutritionCache:
+    """
+    Общий уровень в SQLite (WAL): читают и пишут все воркеры.
+
+    Соединение открывается отдельно в каждом потоке при первом обращении,
+    поэтому после fork воркеры не делят соединение мастера. Если файл не
+    удалось открыть (нет прав, нет тома), общий уровень отключается до
+    перезапуска и кэш работает только в памяти.
+    """
+
+    def __init__(self, path: str = NUTRITION_CACHE_PATH, max_age: float = None):
+        self.path = path
+        self.max_age = max_age
+        self.enabled = True
+        self._local = threading.local()
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS nutrition_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return connection
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.enabled:
+            return None
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                connection = self._open()
+            except (OSError, sqlite3.Error) as e:
+                self.enabled = False
+                print(f"Общий кэш пищевой ценности отключен, не удалось открыть {self.path}: {str(e)}")
+                return None
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[Entry]:
+        connection = self._connection()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT value, stored_at FROM nutrition_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка чтения общего кэша пищевой ценности: {str(e)}")
+            return None
+        if row is None:
+            return None
+        if self.max_age is not None and time.time() - row[1] > self.max_age:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: str, value: Dict[str, Any], stored_at: float):
+        connection = self._connection()
+        if connection is None:
+            return
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO nutrition_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), stored_at),
+            )
+            if self.max_age is not None:
+                connection.execute("DELETE FROM nutrition_cache WHERE stored_at < ?", (stored_at - self.max_age,))
+        except sqlite3.Error as e:
+            print(f"Ошибка записи в общий кэш пищевой ценности: {str(e)}")
+
+
+class TieredNutritionCache:
+    """
+    Кэш local -> shared -> загрузчик.
+
+    Args:
+        local: LocalNutritionCache
+        shared: SharedNutritionCache или None
+        ttl: Сколько секунд запись свежая
+        stale: Сколько секунд после ttl запись отдается с фоновым обновлением
+        enabled: False - всегда вызывать загрузчик
+    """
+
+    def __init__(
+        self,
+        local: LocalNutritionCache = None,
+        shared: Optional[SharedNutritionCache] = None,
+        ttl: float = NUTRITION_CACHE_TTL_SEC,
+        stale: float = NUTRITION_CACHE_STALE_SEC,
+        enabled: bool = NUTRITION_CACHE_ENABLED,
+    ):
+        self.ttl = ttl
+        self.stale = stale
+        self.local = local or LocalNutritionCache(max_age=ttl + stale)
+        self.shared = shared
+        self.enabled = enabled
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def _store(self, key: str, value: Dict[str, Any]):
+        stored_at = time.time()
+        self.local.put(key, value, stored_at)
+        if self.shared is not None and self.shared.enabled:
+            await run_in_threadpool(self.shared.put, key, value, stored_at)
+
+    async def _refresh(self, key: str, loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]):
+        try:
+            value = await loader()
+        except Exception as e:
+            print(f"Ошибка фонового обновления пищевой ценности {key}: {str(e)}")
+            CACHE_REFRESHES.labels(result="error").inc()
+            return
+        finally:
+            self._refreshing.discard(key)
+        if value is None:
+            CACHE_REFRESHES.labels(result="empty").inc()
+            return
+        await self._store(key, value)
+        CACHE_REFRESHES.labels(result="ok").inc()
+
+    def _schedule_refresh(self, key: str, loader):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._refresh(key, loader))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def get(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+        refresh_loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Значение из кэша или из loader() (None не кэшируется).
+
+        Args:
+            key: Нормализованное название продукта
+            loader: Загрузка при промахе
+            refresh_loader: Загрузка для фонового обновления (по умолчанию loader)
+        """
+        if not self.enabled:
+            return await loader()
+
+        now = time.time()
+        entry = self.local.get(key, now)
+        if entry is not None:
+            CACHE_LOOKUPS.labels(tier="local", result="hit").inc()
+        else:
+            CACHE_LOOKUPS.labels(tier="local", result="miss").inc()
+            if self.shared is not None and self.shared.enabled:
+                entry = await run_in_threadpool(self.shared.get, key)
+                CACHE_LOOKUPS.labels(tier="shared", result="hit" if entry is not None else "miss").inc()
+                if entry is not None:
+                    self.local.put(key, *entry)
+
+        if entry is None:
+            value = await loader()
+            if value is not None:
+                await self._store(key, value)
+            return value
+
+        value, stored_at = entry
+        if now - stored_at > self.ttl:
+            self._schedule_refresh(key, refresh_loader or loader)
+        return value
+
+    async def close(self):
+        """Отменяет фоновые обновления (при остановке приложения)."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+nutrition_cache = TieredNutritionCache(
+    shared=SharedNutritionCache(max_age=NUTRITION_CACHE_TTL_SEC + NUTRITION_CACHE_STALE_SEC)
+    if NUTRITION_CACHE_PATH else None,
+)
@@ -0,0 +1,330 @@
+"""
+Локальная база пищевой ценности (таблица nutrition_foods).
+
+/analyze сначала ищет продукт здесь и идет в Edamam только при промахе;
+ответы Edamam записываются обратно, поэтому доля попаданий растет со
+временем. Ключ - нормализованное название в единственном числе (уникальный
+индекс), так что "Apples" и "apple" - одна запись.
+
+Базу можно заполнить дампом:
+    python nutrition_store.py import foods.csv
+    python nutrition_store.py import FoodData_Central_foundation_food_json.json --format usda
+    python nutrition_store.py lookup "fried chicken"
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from prometheus_client import Counter
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import SessionLocal
+from models import NutritionFood
+
+# Настройки
+NUTRITION_STORE_ENABLED = os.getenv("NUTRITION_STORE_ENABLED", "true").lower() == "true"
+NUTRITION_STORE_WRITE_BACK = os.getenv("NUTRITION_STORE_WRITE_BACK", "true").lower() == "true"
+NUTRITION_IMPORT_BATCH_SIZE = int(os.getenv("NUTRITION_IMPORT_BATCH_SIZE", "1000"))
+
+NUTRIENT_FIELDS = ("calories", "protein", "fat", "carbs", "serving_weight_grams")
+
+STORE_LOOKUPS = Counter("nutrition_store_lookups_total", "Поиск в локальной базе пищевой ценности", ["result"])
+STORE_WRITES = Counter("nutrition_store_writes_total", "Записи в локальную базу пищевой ценности", ["source"])
+
+# Синонимы колонок в CSV/JSON дампах
+FIELD_ALIASES = {
+    "name": ("name", "description", "food", "food_name", "product_name"),
+    "calories": ("calories", "kcal", "energy", "energy_kcal"),
+    "protein": ("protein", "proteins", "protein_g"),
+    "fat": ("fat", "total_fat", "fat_g"),
+    "carbs": ("carbs", "carbohydrates", "carbohydrate", "carbs_g"),
+    "serving_weight_grams": ("serving_weight_grams", "serving_size_g", "weight", "grams"),
+}
+
+# Номера нутриентов USDA FoodData Central (значения на 100 г)
+USDA_NUTRIENTS = {
+    "208": "calories",  # Energy, kcal
+    "957": "calories",  # Energy (Atwater General Factors), kcal
+    "958": "calories",  # Energy (Atwater Specific Factors), kcal
+    "203": "protein",
+    "204": "fat",
+    "205": "carbs",
+}
+USDA_FOOD_LISTS = ("FoundationFoods", "SRLegacyFoods", "SurveyFoods", "BrandedFoods")
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"[\s_]+")
+_SINGULAR_RULES = (
+    (re.compile(r"([^aeiou])ies$"), r"\1y"),  # berries -> berry
+    (re.compile(r"(s|x|z|ch|sh|o)es$"), r"\1"),  # tomatoes -> tomato
+    (re.compile(r"([^su])s$"), r"\1"),  # apples -> apple (но не glass, hummus)
+)
+# Слова, которые правила выше портят: pies -> py, cheeses -> chees
+_SINGULAR_EXCEPTIONS = {
+    "pies": "pie",
+    "cookies": "cookie",
+    "brownies": "brownie",
+    "smoothies": "smoothie",
+    "veggies": "veggie",
+    "hoagies": "hoagie",
+    "movies": "movie",
+    "calories": "calorie",
+    "cheeses": "cheese",
+    "quiches": "quiche",
+    "mousses": "mousse",
+    "leaves": "leaf",
+    "loaves": "loaf",
+}
+
+
+def normalize_food_name(name: str) -> str:
+    """"Fried_Chicken." -> "fried chicken": регистр, знаки и разделители не важны."""
+    name = _NON_WORD.sub(" ", str(name).lower())
+    return _SPACES.sub(" ", name).strip()
+
+
+def singularize(word: str) -> str:
+    if word in _SINGULAR_EXCEPTIONS:
+        return _SINGULAR_EXCEPTIONS[word]
+    if len(word) <= 3:
+        return word
+    for pattern, replacement in _SINGULAR_RULES:
+        singular, replaced = pattern.subn(replacement, word)
+        if replaced:
+            return singular
+    return word
+
+
+def singular_food_name(name: str) -> str:
+    """"Fried Apples" -> "fried apple": нормализованное название, каждое слово в единственном числе."""
+    return " ".join(singularize(word) for word in normalize_food_name(name).split())
+
+
+def name_candidates(name: str) -> List[str]:
+    """Нормализованное название и его форма в единственном числе."""
+    normalized = normalize_food_name(name)
+    singular = singular_food_name(normalized)
+    return [normalized] if singular == normalized else [normalized, singular]
+
+
+def _number(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _pick(record: Dict[str, Any], field: str) -> Any:
+    for alias in FIELD_ALIASES[field]:
+        if alias in record:
+            return record[alias]
+    return None
+
+
+def normalize_record(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Запись дампа -> строка nutrition_foods (None, если нет названия или калорий)."""
+    record = {str(key).strip().lower(): value for key, value in record.items()}
+    name = _pick(record, "name")
+    calories = _number(_pick(record, "calories"))
+    if not name or calories is None:
+        return None
+    row = {"name": str(name).strip(), "normalized_name": singular_food_name(name), "calories": calories}
+    for field in ("protein", "fat", "carbs"):
+        row[field] = _number(_pick(record, field)) or 0.0
+    row["serving_weight_grams"] = _number(_pick(record, "serving_weight_grams")) or 100.0
+    return row if row["normalized_name"] else None
+
+
+def load_csv(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def load_json(path: str) -> Iterator[Dict[str, Any]]:
+    """Список записей или {"foods": [...]}"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("foods", [])
+    yield from data
+
+
+def load_usda(path: str) -> Iterator[Dict[str, Any]]:
+    """JSON-дамп USDA FoodData Central (Foundation, SR Legacy, Survey или Branded)."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    foods = []
+    for key in USDA_FOOD_LISTS:
+        foods.extend(data.get(key, []))
+    for food in foods:
+        record = {"name": food.get("description"), "serving_weight_grams": 100.0}
+        for item in food.get("foodNutrients", []):
+            nutrient = item.get("nutrient", {})
+            field = USDA_NUTRIENTS.get(str(nutrient.get("number", "")))
+            # Энергия бывает в kJ - берем только kcal, первую найденную
+            if field is None or field in record or nutrient.get("unitName", "kcal").lower() == "kj":
+                continue
+            record[field] = item.get("amount")
+        yield record
+
+
+LOADERS = {"csv": load_csv, "json": load_json, "usda": load_usda}
+
+
+def detect_format(path: str) -> str:
+    if path.lower().endswith(".csv"):
+        return "csv"
+    with open(path, encoding="utf-8") as f:
+        head = f.read(4096)
+    return "usda" if any(f'"{key}"' in head for key in USDA_FOOD_LISTS) else "json"
+
+
+class NutritionStore:
+    """
+    Поиск и запись пищевой ценности в таблице nutrition_foods.
+
+    Методы синхронные (обращаются к БД), из async-кода вызываются через run_in_threadpool.
+
+    Args:
+        session_factory: Фабрика сессий SQLAlchemy
+        enabled: Искать ли в базе
+        write_back: Сохранять ли ответы Edamam
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        enabled: bool = NUTRITION_STORE_ENABLED,
+        write_back: bool = NUTRITION_STORE_WRITE_BACK,
+    ):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.write_back = write_back
+
+    def lookup(self, name: str) -> Optional[Dict[str, float]]:
+        """Пищевая ценность одной порции или None, если продукта нет в базе."""
+        if not self.enabled:
+            return None
+        candidates = name_candidates(name)
+        try:
+            with self.session_factory() as db:
+                rows = db.execute(
+                    select(NutritionFood).where(NutritionFood.normalized_name.in_(candidates))
+                ).scalars().all()
+        except Exception as e:
+            print(f"Ошибка поиска в базе пищевой ценности: {str(e)}")
+            STORE_LOOKUPS.labels(result="error").inc()
+            return None
+        if not rows:
+            STORE_LOOKUPS.labels(result="miss").inc()
+            return None
+        # Записи до перехода на ключ в единственном числе хранятся под исходной
+        # формой; точное совпадение важнее формы без окончания
+        row = min(rows, key=lambda r: candidates.index(r.normalized_name))
+        STORE_LOOKUPS.labels(result="hit").inc()
+        return {field: getattr(row, field) for field in NUTRIENT_FIELDS}
+
+    def _upsert(self, db, rows: List[Dict[str, Any]], source: str, overwrite: bool):
+        dialect = {"postgresql": postgresql, "sqlite": sqlite}.get(db.get_bind().dialect.name)
+        if dialect is None:
+            raise RuntimeError(f"Неподдерживаемая БД: {db.get_bind().dialect.name}")
+        stmt = dialect.insert(NutritionFood).values([dict(row, source=source) for row in rows])
+        if overwrite:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[NutritionFood.normalized_name],
+                set_={field: stmt.excluded[field] for field in ("name", "source") + NUTRIENT_FIELDS},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[NutritionFood.normalized_name])
+        return db.execute(stmt).rowcount
+
+    def save(self, name: str, nutrition: Dict[str, float], source: str = "edamam") -> bool:
+        """
+        Запоминает ответ внешнего API. Уже имеющиеся записи (например, из
+        импортированного дампа) не перезаписываются.
+        """
+        if not (self.enabled and self.write_back):
+            return False
+        row = {"name": name, "normalized_name": singular_food_name(name)}
+        row.update({field: nutrition[field] for field in NUTRIENT_FIELDS})
+        try:
+            with self.session_factory() as db:
+                written = self._upsert(db, [row], source, overwrite=False)
+                db.commit()
+        except Exception as e:
+            print(f"Ошибка записи в базу пищевой ценности: {str(e)}")
+            return False
+        if written:
+            STORE_WRITES.labels(source=source).inc()
+        return bool(written)
+
+    def bulk_import(
+        self,
+        records: Iterable[Dict[str, Any]],
+        source: str,
+        batch_size: int = NUTRITION_IMPORT_BATCH_SIZE,
+    ) -> int:
+        """Импортирует записи дампа пачками; существующие продукты обновляются. Возвращает число строк."""
+        imported = 0
+        batch: Dict[str, Dict[str, Any]] = {}
+        with self.session_factory() as db:
+            for record in records:
+                row = normalize_record(record)
+                if row is None:
+                    continue
+                # В одной пачке ключ должен встречаться один раз (ON CONFLICT)
+                batch[row["normalized_name"]] = row
+                if len(batch) >= batch_size:
+                    self._upsert(db, list(batch.values()), source, overwrite=True)
+                    imported += len(batch)
+                    batch.clear()
+            if batch:
+                self._upsert(db, list(batch.values()), source, overwrite=True)
+                imported += len(batch)
+            db.commit()
+        STORE_WRITES.labels(source=source).inc(imported)
+        return imported
+
+
+nutrition_store = NutritionStore()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная база пищевой ценности")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Импорт дампа CSV или JSON (в т.ч. USDA FoodData Central)")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=["auto"] + list(LOADERS), default="auto")
+    import_parser.add_argument("--source", help="Метка источника (по умолчанию - формат)")
+
+    lookup_parser = commands.add_parser("lookup", help="Найти продукт")
+    lookup_parser.add_argument("name")
+
+    args = parser.parse_args(argv)
+
+    from database import Base, engine
+    Base.metadata.create_all(bind=engine, tables=[NutritionFood.__table__])
+
+    if args.command == "import":
+        fmt = detect_format(args.path) if args.format == "auto" else args.format
+        count = nutrition_store.bulk_import(LOADERS[fmt](args.path), source=args.source or fmt)
+        print(f"Импортировано продуктов: {count} ({fmt})")
+    else:
+        nutrition = nutrition_store.lookup(args.name)
+        if nutrition is None:
+            print(f"{args.name}: нет в базе")
+            return 1
+        print(json.dumps(nutrition, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Препроцессинг изображений для /analyze.
+
+Фото с телефона (12 МП) не декодируются целиком: JPEG сразу декодируется
+в уменьшенном разрешении (draft mode), затем применяется EXIF-ориентация
+и изображение вписывается (letterbox) в заранее выделенный numpy-буфер
+размера входа модели. Боксы детекций переводятся обратно в координаты
+исходного изображения.
+"""
+import io
+import os
+import queue
+import time
+from typing import Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+from prometheus_client import Histogram
+
+# Размер входа модели
+INFERENCE_IMAGE_SIZE = int(os.getenv("INFERENCE_IMAGE_SIZE", "640"))
+# Сколько буферов держать в пуле (остальные выделяются по требованию)
+PREPROCESS_BUFFER_POOL_SIZE = int(os.getenv("PREPROCESS_BUFFER_POOL_SIZE", "64"))
+
+# Значение заполнения полей letterbox, как в YOLO
+PAD_VALUE = 114
+
+# EXIF-ориентации, при которых ширина и высота меняются местами
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+DECODE_SECONDS = Histogram(
+    "image_preprocess_seconds",
+    "Время декодирования и letterbox одного изображения",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+class LetterboxBufferPool:
+    """
+    Пул заранее выделенных буферов (size, size, 3) uint8.
+
+    Буфер занят, пока изображение ждет батча и проходит инференс,
+    после чего возвращается в пул через release().
+    """
+
+    def __init__(self, size: int, capacity: int):
+        self.size = size
+        self.capacity = capacity
+        self._free: "queue.SimpleQueue[np.ndarray]" = queue.SimpleQueue()
+        for _ in range(capacity):
+            self._free.put(np.empty((size, size, 3), dtype=np.uint8))
+
+    def acquire(self) -> np.ndarray:
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            # Пул исчерпан - выделяем новый буфер, в пул он вернется только при наличии места
+            return np.empty((self.size, self.size, 3), dtype=np.uint8)
+
+    def release(self, buffer: np.ndarray):
+        if self._free.qsize() < self.capacity:
+            self._free.put(buffer)
+
+
+buffer_pool = LetterboxBufferPool(INFERENCE_IMAGE_SIZE, PREPROCESS_BUFFER_POOL_SIZE)
+
+
+class PreprocessedImage:
+    """
+    Изображение, готовое для модели.
+
+    Attributes:
+        array: HWC RGB uint8 массив размера входа модели (буфер из пула)
+        original_size: (ширина, высота) исходного изображения с учетом EXIF
+        decoded_size: (ширина, высота) после уменьшенного декодирования
+        ratio: Масштаб letterbox относительно decoded_size
+        pad: Отступы letterbox (left, top)
+    """
+
+    __slots__ = ("array", "original_size", "decoded_size", "ratio", "pad", "_pool")
+
+    def __init__(self, array, original_size, decoded_size, ratio, pad, pool=None):
+        self.array = array
+        self.original_size = original_size
+        self.decoded_size = decoded_size
+        self.ratio = ratio
+        self.pad = pad
+        self._pool = pool
+
+    def restore_boxes(self, boxes: np.ndarray) -> np.ndarray:
+        """Переводит боксы (N, 4) xyxy из координат модели в координаты исходного изображения."""
+        if not len(boxes):
+            return boxes
+        scale_x = self.original_size[0] / self.decoded_size[0] / self.ratio
+        scale_y = self.original_size[1] / self.decoded_size[1] / self.ratio
+        boxes = boxes.astype(np.float64, copy=True)
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - self.pad[0]) * scale_x).clip(0, self.original_size[0])
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - self.pad[1]) * scale_y).clip(0, self.original_size[1])
+        return boxes
+
+    def release(self):
+        """Возвращает буфер в пул (после инференса)."""
+        if self._pool is not None and self.array is not None:
+            self._pool.release(self.array)
+            self.array = None
+
+
+def _oriented_size(image: Image.Image) -> Tuple[int, int]:
+    """Размер исходного изображения после применения EXIF-ориентации."""
+    width, height = image.size
+    try:
+        orientation = image.getexif().get(0x0112, 1)
+    except Exception:
+        orientation = 1
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def letterbox_into(image: Image.Image, buffer: np.ndarray) -> Tuple[float, Tuple[int, int]]:
+    """
+    Вписывает изображение в буфер (size, size, 3) с сохранением пропорций.
+
+    Returns:
+        Tuple[ratio, (left, top)]: масштаб и отступы
+    """
+    size = buffer.shape[0]
+    width, height = image.size
+    ratio = min(size / width, size / height)
+    new_w, new_h = max(1, int(round(width * ratio))), max(1, int(round(height * ratio)))
+    if (new_w, new_h) != (width, height):
+        image = image.resize((new_w, new_h), Image.BILINEAR)
+
+    left, top = (size - new_w) // 2, (size - new_h) // 2
+    # Заполняем только поля, центральная часть будет перезаписана
+    buffer[:top] = PAD_VALUE
+    buffer[top + new_h:] = PAD_VALUE
+    buffer[top:top + new_h, :left] = PAD_VALUE
+    buffer[top:top + new_h, left + new_w:] = PAD_VALUE
+    buffer[top:top + new_h, left:left + new_w] = np.asarray(image)
+    return ratio, (left, top)
+
+
+def preprocess_image(image_bytes: bytes, size: int = INFERENCE_IMAGE_SIZE) -> PreprocessedImage:
+    """
+    Декодирует изображение сразу в разрешении, близком ко входу модели.
+
+    Args:
+        image_bytes: Содержимое загруженного файла
+        size: Размер входа модели
+
+    Returns:
+        PreprocessedImage с буфером из пула (нужно вызвать release())
+    """
+    started_at = time.perf_counter()
+    image = Image.open(io.BytesIO(image_bytes))
+    original_size = _oriented_size(image)
+
+    # Для JPEG декодер сам уменьшает изображение в 2/4/8 раз, не опускаясь ниже size
+    if image.format == "JPEG":
+        image.draft("RGB", (size, size))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    decoded_size = image.size
+
+    pool = buffer_pool if size == buffer_pool.size else None
+    buffer = pool.acquire() if pool else np.empty((size, size, 3), dtype=np.uint8)
+    ratio, pad = letterbox_into(image, buffer)
+
+    DECODE_SECONDS.observe(time.perf_counter() - started_at)
+    return PreprocessedImage(buffer, original_size, decoded_size, ratio, pad, pool)
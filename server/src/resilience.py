@@ -0,0 +1,258 @@
+"""
+Устойчивость вызовов внешних API (Gemini, Edamam).
+
+Каждый вызов получает бюджет времени (не больше оставшегося дедлайна
+клиента). Если основной запрос не ответил за p-й перцентиль недавних
+задержек, отправляется дублирующий (hedged) запрос, и берется первый
+успешный ответ. Автомат (circuit breaker) после серии ошибок на время
+отключает сервис, и запросы сразу получают локальный фолбэк.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from prometheus_client import Counter, Gauge, Histogram
+
+T = TypeVar("T")
+
+# Состояния автомата
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+_BREAKER_STATE_VALUES = {BREAKER_CLOSED: 0, BREAKER_HALF_OPEN: 1, BREAKER_OPEN: 2}
+
+# Общие настройки
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_OPEN_SEC = float(os.getenv("BREAKER_OPEN_SEC", "30"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+LATENCY_WINDOW = int(os.getenv("UPSTREAM_LATENCY_WINDOW", "200"))
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_seconds",
+    "Длительность успешных запросов к внешнему API",
+    ["upstream"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+UPSTREAM_CALLS = Counter(
+    "upstream_calls_total",
+    "Вызовы внешнего API по результату (success, error, timeout, short_circuit)",
+    ["upstream", "outcome"],
+)
+HEDGES = Counter("upstream_hedges_total", "Дублирующие запросы: launched - отправлено, won - ответил первым", ["upstream", "result"])
+BREAKER_STATE = Gauge("upstream_breaker_state", "Состояние автомата: 0 - closed, 1 - half_open, 2 - open", ["upstream"])
+
+
+class UpstreamError(Exception):
+    """Внешний API вернул ошибку или некорректный ответ."""
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных запросов для расчета перцентилей."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """
+    Автомат: failure_threshold ошибок подряд -> open на open_sec,
+    затем один пробный запрос (half_open) решает, закрыться или снова открыться.
+
+    Args:
+        clock: Источник времени (подменяется в проверках)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        open_sec: float = BREAKER_OPEN_SEC,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_sec = open_sec
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._set_state(BREAKER_CLOSED)
+
+    def _set_state(self, state: str):
+        self.state = state
+        BREAKER_STATE.labels(upstream=self.name).set(_BREAKER_STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        """Можно ли сейчас обращаться к сервису."""
+        if self.state == BREAKER_OPEN:
+            if self.clock() - self.opened_at < self.open_sec:
+                return False
+            self._set_state(BREAKER_HALF_OPEN)
+        if self.state == BREAKER_HALF_OPEN:
+            # Пропускаем только один пробный запрос
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def release_probe(self):
+        """Пробный запрос отменен, не дав результата."""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self._probe_in_flight = False
+        if self.state != BREAKER_CLOSED:
+            print(f"Автомат {self.name}: сервис восстановился")
+            self._set_state(BREAKER_CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == BREAKER_HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != BREAKER_OPEN:
+                print(f"Автомат {self.name}: сервис отключен на {self.open_sec:.0f} с после {self.failures} ошибок")
+            self.opened_at = self.clock()
+            self._set_state(BREAKER_OPEN)
+
+
+class ResilientUpstream:
+    """
+    Обертка вызовов одного внешнего API: бюджет, hedging, автомат.
+
+    Args:
+        name: Имя сервиса в метриках
+        budget_sec: Бюджет одного вызова (включая дублирующие запросы)
+        hedge: Отправлять ли дублирующий запрос
+        hedge_percentile: Перцентиль задержки, после которого отправляется дубль
+        hedge_min_delay_sec: Минимальная задержка перед дублем (пока нет статистики - она же)
+        breaker: Автомат (по умолчанию создается свой)
+        tracker: Окно задержек (по умолчанию создается свое)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        budget_sec: float,
+        hedge: bool = True,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        hedge_min_delay_sec: float = HEDGE_MIN_DELAY_MS / 1000.0,
+        breaker: Optional[CircuitBreaker] = None,
+        tracker: Optional[LatencyTracker] = None,
+    ):
+        self.name = name
+        self.budget = budget_sec
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay_sec
+        self.breaker = breaker or CircuitBreaker(name)
+        self.tracker = tracker or LatencyTracker()
+
+    def hedge_delay(self) -> float:
+        observed = self.tracker.percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, observed or 0.0)
+
+    def _timeout(self, deadline: Optional[float]) -> float:
+        timeout = self.budget
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        return max(0.0, timeout)
+
+    async def _attempt(self, request: Callable[[], Awaitable[T]]) -> T:
+        started_at = time.perf_counter()
+        result = await request()
+        elapsed = time.perf_counter() - started_at
+        self.tracker.observe(elapsed)
+        UPSTREAM_LATENCY.labels(upstream=self.name).observe(elapsed)
+        return result
+
+    async def call(
+        self,
+        request: Callable[[], Awaitable[T]],
+        fallback: Callable[[], T],
+        deadline: Optional[float] = None,
+    ) -> T:
+        """
+        Выполняет request() с бюджетом и hedging, при ошибке возвращает fallback().
+
+        Args:
+            request: Фабрика корутины запроса (вызывается для каждой попытки);
+                     ошибка сервиса - любое исключение
+            fallback: Локальный ответ, если сервис недоступен
+            deadline: Абсолютный дедлайн клиента (time.time())
+        """
+        timeout = self._timeout(deadline)
+        # Таймаут по дедлайну клиента, а не по бюджету, не считается ошибкой сервиса
+        budget_limited = timeout >= self.budget
+        if timeout <= 0:
+            # Дедлайн клиента уже прошел - сервис тут ни при чем
+            UPSTREAM_CALLS.labels(upstream=self.name, outcome="timeout").inc()
+            return fallback()
+        if not self.breaker.allow():
+            UPSTREAM_CALLS.labels(upstream=self.name, outcome="short_circuit").inc()
+            return fallback()
+
+        loop = asyncio.get_running_loop()
+        finish_at = loop.time() + timeout
+        primary = asyncio.create_task(self._attempt(request))
+        tasks = [primary]
+        last_error: Optional[BaseException] = None
+        try:
+            while tasks:
+                remaining = finish_at - loop.time()
+                if remaining <= 0:
+                    break
+                # Пока дубль не отправлен, ждем не дольше задержки hedging
+                hedge_pending = self.hedge and len(tasks) == 1 and primary in tasks
+                wait = min(remaining, self.hedge_delay()) if hedge_pending else remaining
+                done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if hedge_pending:
+                        HEDGES.labels(upstream=self.name, result="launched").inc()
+                        tasks.append(asyncio.create_task(self._attempt(request)))
+                    continue
+
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            HEDGES.labels(upstream=self.name, result="won").inc()
+                        self.breaker.record_success()
+                        UPSTREAM_CALLS.labels(upstream=self.name, outcome="success").inc()
+                        return task.result()
+                    last_error = task.exception()
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if last_error is not None and not tasks:
+            print(f"Ошибка {self.name}: {str(last_error)}")
+            outcome = "error"
+        else:
+            print(f"{self.name} не ответил за {timeout:.2f} с, используем фолбэк")
+            outcome = "timeout"
+        if outcome == "error" or budget_limited:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_probe()
+        UPSTREAM_CALLS.labels(upstream=self.name, outcome=outcome).inc()
+        return fallback()
+
@@ -0,0 +1,139 @@
+"""
+Кэш результатов /analyze по перцептивному хэшу изображения.
+
+Пользователи часто переснимают или повторно отправляют почти одинаковые
+фото одной тарелки. Для таких фото dHash отличается на несколько бит,
+поэтому результат ищется с допуском по расстоянию Хэмминга, и повторный
+запрос не платит за YOLO, Gemini и Edamam.
+
+dHash не зависит от разрешения, а боксы детекций хранятся в пикселях
+исходного фото, поэтому при попадании они пересчитываются под размер
+нового фото.
+"""
+import copy
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from prometheus_client import Counter, Gauge
+
+# Настройки кэша
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_TTL_SEC = float(os.getenv("RESULT_CACHE_TTL_SEC", "600"))
+RESULT_CACHE_MAX_DISTANCE = int(os.getenv("RESULT_CACHE_MAX_DISTANCE", "4"))  # бит из 64
+
+CACHE_HITS = Counter("analyze_cache_hits_total", "Попадания в кэш результатов /analyze", ["match"])
+CACHE_MISSES = Counter("analyze_cache_misses_total", "Промахи кэша результатов /analyze")
+CACHE_SIZE = Gauge("analyze_cache_entries", "Количество записей в кэше результатов /analyze")
+
+
+def perceptual_hash(array: np.ndarray) -> int:
+    """
+    Разностный хэш (dHash) изображения: 64 бита.
+
+    Изображение сжимается до 9x8 в оттенках серого, каждый бит - сравнение
+    яркости соседних пикселей в строке.
+    """
+    small = Image.fromarray(array).convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+CacheKey = Tuple[str, float, int]
+ImageSize = Tuple[int, int]  # (ширина, высота) исходного фото
+
+
+def rescale_detections(result: Dict[str, Any], from_size: ImageSize, to_size: ImageSize) -> Dict[str, Any]:
+    """Пересчитывает боксы детекций результата из размера from_size в to_size (на месте)."""
+    if tuple(from_size) == tuple(to_size):
+        return result
+    scale_x = to_size[0] / from_size[0]
+    scale_y = to_size[1] / from_size[1]
+    for detection in result.get("detections", []):
+        x1, y1, x2, y2 = detection["bbox"]
+        detection["bbox"] = [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+    return result
+
+
+class AnalyzeResultCache:
+    """
+    LRU-кэш с TTL и поиском ближайшего хэша.
+
+    Args:
+        max_entries: Максимальное количество записей
+        ttl_sec: Время жизни записи
+        max_distance: Допустимое расстояние Хэмминга между хэшами
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl_sec: float = RESULT_CACHE_TTL_SEC,
+        max_distance: int = RESULT_CACHE_MAX_DISTANCE,
+    ):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any], ImageSize]]" = OrderedDict()
+
+    @staticmethod
+    def _key(model_name: str, conf_threshold: float, image_hash: int) -> CacheKey:
+        return model_name, round(conf_threshold, 4), image_hash
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_sec > 0 and now - created_at > self.ttl_sec
+
+    def get(
+        self, model_name: str, conf_threshold: float, image_hash: int, image_size: ImageSize
+    ) -> Optional[Dict[str, Any]]:
+        """Ищет результат для того же или почти того же изображения (боксы - в размере image_size)."""
+        now = time.monotonic()
+        key = self._key(model_name, conf_threshold, image_hash)
+        match = "exact"
+
+        entry = self._entries.get(key)
+        if entry is None and self.max_distance > 0:
+            # Ищем ближайший хэш среди записей той же модели и порога
+            best_distance = self.max_distance + 1
+            for candidate in self._entries:
+                if candidate[:2] != key[:2]:
+                    continue
+                distance = hamming_distance(candidate[2], image_hash)
+                if distance < best_distance:
+                    best_distance, key = distance, candidate
+            entry = self._entries.get(key) if best_distance <= self.max_distance else None
+            match = "near"
+
+        if entry is None or self._expired(entry[0], now):
+            if entry is not None:
+                del self._entries[key]
+                CACHE_SIZE.set(len(self._entries))
+            CACHE_MISSES.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        CACHE_HITS.labels(match=match).inc()
+        return rescale_detections(copy.deepcopy(entry[1]), entry[2], image_size)
+
+    def put(
+        self, model_name: str, conf_threshold: float, image_hash: int, image_size: ImageSize, result: Dict[str, Any]
+    ):
+        key = self._key(model_name, conf_threshold, image_hash)
+        self._entries[key] = (time.monotonic(), copy.deepcopy(result), tuple(image_size))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        CACHE_SIZE.set(0)
@@ -0,0 +1,69 @@
+"""
+Планировщик инференса с учетом ядер CPU воркера.
+
+Каждому воркеру достается свой набор ядер (cores). Планировщик один раз делит
+их между параллельными прямыми проходами: concurrency проходов по cores //
+concurrency потоков torch. Число потоков torch - настройка всего процесса, а не
+потока пула, поэтому менять его перед каждым проходом нельзя: параллельный
+проход другой модели получил бы чужое значение. Потоки задаются один раз на
+воркер (после fork и привязки к ядрам), а в режиме пула процессов - в каждом
+процессе пула при его запуске.
+
+Батчи одной модели идут по очереди, поэтому параллельно выполняются проходы
+разных моделей (например, ансамбля).
+"""
+from prometheus_client import Gauge
+
+from worker_runtime import configure_torch_threads, worker_cores
+
+SCHEDULER_CONCURRENCY = Gauge("inference_scheduler_concurrency", "Лимит параллельных прямых проходов")
+SCHEDULER_THREADS = Gauge("inference_scheduler_threads", "Потоков torch на один прямой проход")
+SCHEDULER_CORES = Gauge("inference_scheduler_cores", "Ядер CPU, выделенных воркеру")
+CORES_IN_USE = Gauge("inference_cores_in_use", "Ядер, занятых выполняющимися прямыми проходами")
+
+
+class InferenceScheduler:
+    """
+    Делит ядра воркера между параллельными проходами InferenceExecutor.
+
+    Args:
+        executor: InferenceExecutor, чей лимит параллелизма задается
+        cores: Ядер CPU у воркера (по умолчанию - worker_cores())
+        concurrency: Параллельных проходов (по умолчанию и не больше - размер пула)
+    """
+
+    def __init__(self, executor, cores: int = None, concurrency: int = None):
+        self.executor = executor
+        self._cores = cores
+        self.concurrency = max(1, min(concurrency or executor.max_concurrency, executor.max_concurrency))
+        self.cores = 1
+        self.threads = 1
+        CORES_IN_USE.set_function(lambda: min(self.cores, self.executor.active * self.threads))
+        self.configure()
+
+    def configure(self):
+        """
+        Задает лимит параллелизма и потоки torch для текущего процесса.
+
+        Вызывается при создании и повторно в каждом воркере gunicorn после fork
+        и привязки к ядрам (post_fork), когда набор ядер воркера уже известен.
+        """
+        self.cores = max(1, self._cores or worker_cores())
+        self.threads = max(1, self.cores // self.concurrency)
+        self.executor.set_concurrency(self.concurrency)
+        if not self.executor.uses_processes:
+            # Процессы пула выставляют свои потоки сами при запуске
+            configure_torch_threads(self.threads)
+        SCHEDULER_CORES.set(self.cores)
+        SCHEDULER_CONCURRENCY.set(self.concurrency)
+        SCHEDULER_THREADS.set(self.threads)
+        print(f"Планировщик инференса: {self.concurrency} x {self.threads} потоков на {self.cores} ядрах")
+
+    def status(self):
+        return {
+            "executor": self.executor.kind,
+            "cores": self.cores,
+            "concurrency": self.concurrency,
+            "threads_per_inference": self.threads,
+            "active": self.executor.active,
+        }
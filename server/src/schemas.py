@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, validator
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 import uuid
 
 # Базовые схемы
@@ -65,6 +65,14 @@ class WaterHistoryResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class WaterDailyResponse(BaseModel):
+    day: date
+    total_ml: float
+    count: int
+
+    class Config:
+        orm_mode = True
+
 # Схемы для обновления
 class UserUpdate(BaseModel):
     name: Optional[str] = None
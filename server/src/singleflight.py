@@ -0,0 +1,76 @@
+"""
+Single-flight: объединение одинаковых одновременных запросов к внешним API.
+
+В пиковые часы многие пользователи сканируют одни и те же популярные
+продукты, и каждый запрос отдельно вызывает Edamam с тем же названием.
+SingleFlight пропускает к сервису только первый вызов с данным ключом,
+остальные ждут его результат. Вызов выполняется отдельной задачей: отмена
+одного из ожидающих не отменяет его для остальных, он отменяется только
+когда ушли все.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from prometheus_client import Counter, Gauge
+
+T = TypeVar("T")
+
+SINGLEFLIGHT_CALLS = Counter("singleflight_calls_total", "Вызовы внешнего сервиса после объединения", ["name"])
+SINGLEFLIGHT_COALESCED = Counter(
+    "singleflight_coalesced_total", "Запросы, получившие результат уже выполняющегося вызова", ["name"]
+)
+SINGLEFLIGHT_INFLIGHT = Gauge("singleflight_inflight", "Выполняющиеся вызовы по уникальным ключам", ["name"])
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Группа объединяемых вызовов одного сервиса.
+
+    Args:
+        name: Имя группы (метка метрик)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        SINGLEFLIGHT_INFLIGHT.labels(name=name).set_function(lambda: len(self._calls))
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        Выполняет factory() или присоединяется к уже выполняющемуся вызову с тем же ключом.
+
+        Исключение вызова получают все ожидающие.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+            SINGLEFLIGHT_CALLS.labels(name=self.name).inc()
+        else:
+            SINGLEFLIGHT_COALESCED.labels(name=self.name).inc()
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # Последний ожидающий ушел - результат больше никому не нужен
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def __len__(self) -> int:
+        return len(self._calls)
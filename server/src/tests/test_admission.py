@@ -0,0 +1,17 @@
+from admission import AdmissionController
+from inference_executor import InferenceExecutor
+
+
+def test_thread_pool_serializes_batches_of_one_model():
+    admission = AdmissionController(InferenceExecutor("thread", max_concurrency=4))
+    admission.observe("model1", batch_size=2, duration=1.0)
+
+    # 8 изображений по 2 в батче, батчи модели по очереди: 4 батча по секунде
+    assert admission.estimated_wait("model1", pending=7, images=1) == 4.0
+
+
+def test_process_pool_runs_batches_of_one_model_in_parallel():
+    admission = AdmissionController(InferenceExecutor("process", max_concurrency=4))
+    admission.observe("model1", batch_size=2, duration=1.0)
+
+    assert admission.estimated_wait("model1", pending=7, images=1) == 1.0
@@ -0,0 +1,35 @@
+from class_products import ClassProduct, ClassProductResolver
+
+
+def detection(class_name, confidence=0.9):
+    return {"class_name": class_name, "confidence": confidence, "bbox": [0, 0, 10, 10]}
+
+
+PLATE = [detection("chicken"), detection("french_fries"), detection("french_fries")]
+MAPPING = {"chicken": ClassProduct("chicken", 0.6), "french_fries": ClassProduct("french fries", 0.6)}
+
+
+def test_disabled_fast_path_still_splits_plate_by_class():
+    plate = ClassProductResolver(MAPPING, enabled=False).resolve(PLATE)
+
+    assert plate.products == {}
+    assert sorted(len(group) for group in plate.unresolved) == [1, 2]
+
+
+def test_only_uncertain_classes_go_to_gemini():
+    detections = [detection("chicken"), detection("french_fries", 0.3), detection("french_fries")]
+    plate = ClassProductResolver(MAPPING).resolve(detections)
+
+    assert plate.products == {"chicken": 1}
+    assert [[d["class_name"] for d in group] for group in plate.unresolved] == [["french_fries", "french_fries"]]
+
+
+def test_confident_plate_needs_no_gemini():
+    plate = ClassProductResolver(MAPPING).resolve(PLATE)
+
+    assert plate.products == {"french fries": 2, "chicken": 1}
+    assert plate.unresolved == []
+
+
+def test_no_detections_leave_naming_to_gemini():
+    assert ClassProductResolver(MAPPING).resolve([]) is None
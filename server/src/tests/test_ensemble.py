@@ -0,0 +1,41 @@
+import numpy as np
+
+from ensemble import fuse_predictions
+
+NAMES = {0: "fries", 1: "burger"}
+
+
+def predictions(*rows):
+    return np.array(rows, dtype=np.float32).reshape(-1, 6)
+
+
+def test_box_found_by_one_model_is_dropped_below_threshold():
+    # WBF делит уверенность бокса одной модели на вес всех моделей: 0.4 -> 0.2
+    results = [
+        (predictions([10, 10, 50, 50, 0.4, 0]), NAMES),
+        (predictions(), NAMES),
+    ]
+    fused, names = fuse_predictions(results, [1.0, 1.0], conf_threshold=0.35)
+    assert len(fused) == 0
+
+
+def test_box_found_by_all_models_is_kept():
+    results = [
+        (predictions([10, 10, 50, 50, 0.8, 1], [100, 100, 140, 140, 0.4, 0]), NAMES),
+        (predictions([12, 10, 50, 52, 0.6, 1]), NAMES),
+    ]
+    fused, names = fuse_predictions(results, [1.0, 1.0], conf_threshold=0.35)
+    assert len(fused) == 1
+    assert names[int(fused[0, 5])] == "burger"
+    assert fused[0, 4] >= 0.35
+    np.testing.assert_allclose(fused[0, 4], 0.7, atol=1e-6)
+
+
+def test_without_threshold_all_fused_boxes_are_returned():
+    results = [
+        (predictions([10, 10, 50, 50, 0.4, 0]), NAMES),
+        (predictions(), NAMES),
+    ]
+    fused, _ = fuse_predictions(results, [1.0, 1.0])
+    assert len(fused) == 1
+    np.testing.assert_allclose(fused[0, 4], 0.2, atol=1e-6)
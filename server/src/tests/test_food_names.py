@@ -0,0 +1,64 @@
+from food_matcher import FoodMatcher, tokenize
+from nutrition_store import name_candidates, singular_food_name
+
+
+def test_store_and_matcher_share_singular_form():
+    for name in ("Apples", "Blueberries", "Tomatoes", "Fried_Chickens", "hummus", "glass noodles"):
+        assert name_candidates(name)[-1] == " ".join(tokenize(name)) == singular_food_name(name)
+
+
+def test_name_candidates_keep_exact_name_first():
+    assert name_candidates("Tomatoes") == ["tomatoes", "tomato"]
+    assert name_candidates("fried chicken") == ["fried chicken"]
+
+
+def test_matcher_finds_plural_query():
+    nutrition = {"calories": 52, "protein": 0.3, "fat": 0.2, "carbs": 14, "serving_weight_grams": 100}
+    matcher = FoodMatcher([dict(nutrition, name="blueberry")])
+    match = matcher.match("Blueberries")
+    assert match is not None and match.exact and match.name == "blueberry"
+
+
+def sqlite_store(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from models import NutritionFood
+    from nutrition_store import NutritionStore
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'foods.db'}")
+    NutritionFood.__table__.create(bind=engine)
+    return NutritionStore(session_factory=sessionmaker(bind=engine), enabled=True, write_back=True)
+
+
+def test_store_finds_saved_plural_by_singular_and_back(tmp_path):
+    store = sqlite_store(tmp_path)
+    nutrition = {"calories": 52, "protein": 0.3, "fat": 0.2, "carbs": 14, "serving_weight_grams": 100}
+    assert store.save("Apples", nutrition)
+    store.bulk_import([{"name": "French Fries", "calories": 312}], source="csv")
+
+    assert store.lookup("apple")["calories"] == 52
+    assert store.lookup("APPLES")["calories"] == 52
+    assert store.lookup("french fry")["calories"] == 312
+    # Та же запись под другой формой не дублируется
+    assert not store.save("apple", nutrition)
+
+
+def test_singular_exceptions():
+    assert singular_food_name("Apple Pies") == "apple pie"
+    assert singular_food_name("pies") == "pie"
+    assert singular_food_name("Cookies") == "cookie"
+    assert singular_food_name("cheeses") == "cheese"
+    assert singular_food_name("french fries") == "french fry"
+    assert name_candidates("cookies") == ["cookies", "cookie"]
+
+
+def test_matcher_and_store_agree_on_pies(tmp_path):
+    nutrition = {"calories": 237, "protein": 2, "fat": 11, "carbs": 34, "serving_weight_grams": 100}
+    matcher = FoodMatcher([dict(nutrition, name="apple pie")])
+    match = matcher.match("Apple Pies")
+    assert match is not None and match.exact and match.name == "apple pie"
+
+    store = sqlite_store(tmp_path)
+    store.save("apple pie", nutrition)
+    assert store.lookup("apple pies")["calories"] == 237
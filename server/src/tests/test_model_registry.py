@@ -0,0 +1,52 @@
+import asyncio
+
+from model_registry import STATE_ERROR, STATE_MISSING, STATE_READY, ModelRegistry
+
+
+def registry(tmp_path, loader=lambda model_type, path: object()):
+    present = tmp_path / "present.pt"
+    present.write_bytes(b"weights")
+    return ModelRegistry(
+        {"present": str(present), "absent": str(tmp_path / "absent.pt")},
+        {"present": "YOLOv5", "absent": "YOLOv5"},
+        loader=loader,
+        warmup_passes=0,
+    )
+
+
+def test_missing_weights_do_not_block_readiness(tmp_path):
+    models = registry(tmp_path)
+    models.preload()
+
+    assert models.status()["absent"]["state"] == STATE_MISSING
+    assert models.status()["present"]["state"] == STATE_READY
+    assert models.missing() == ["absent"]
+    assert models.is_ready()
+
+
+def test_load_failure_keeps_worker_not_ready(tmp_path):
+    def broken(model_type, path):
+        raise RuntimeError("corrupt weights")
+
+    models = registry(tmp_path, loader=broken)
+    models.preload()
+
+    assert models.status()["present"]["state"] == STATE_ERROR
+    assert not models.is_ready()
+
+
+def test_process_pool_preload_is_tracked(tmp_path):
+    models = registry(tmp_path)
+    warmed = []
+
+    async def warm_up(name):
+        assert not models.is_ready()
+        warmed.append(name)
+        return 0.01
+
+    asyncio.run(models.preload_in_processes(warm_up))
+
+    assert warmed == ["present"]
+    assert models.status()["present"]["state"] == STATE_READY
+    assert models.status()["present"]["warmup_time_sec"] == 0.01
+    assert models.is_ready()
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from prometheus_client import REGISTRY
+
+from resilience import BREAKER_OPEN, CircuitBreaker, ResilientUpstream, UpstreamError
+
+
+class FakeUpstream:
+    """Локальный фейковый сервис: задержка и ошибка задаются на каждый вызов."""
+
+    def __init__(self, latencies=(0.0,), fail=False):
+        self.latencies = list(latencies)
+        self.fail = fail
+        self.calls = 0
+
+    async def request(self):
+        latency = self.latencies[min(self.calls, len(self.latencies) - 1)]
+        self.calls += 1
+        attempt = self.calls
+        await asyncio.sleep(latency)
+        if self.fail:
+            raise UpstreamError("HTTP 500")
+        return f"upstream-{attempt}"
+
+
+def fallback():
+    return "fallback"
+
+
+def hedges(upstream, result):
+    return REGISTRY.get_sample_value("upstream_hedges_total", {"upstream": upstream, "result": result}) or 0.0
+
+
+def test_hedge_wins_when_primary_is_slow():
+    fake = FakeUpstream(latencies=[1.0, 0.01])
+    upstream = ResilientUpstream("test_hedge", budget_sec=2.0, hedge_min_delay_sec=0.02)
+    won_before = hedges("test_hedge", "won")
+
+    started_at = time.perf_counter()
+    result = asyncio.run(upstream.call(fake.request, fallback))
+    elapsed = time.perf_counter() - started_at
+
+    assert result == "upstream-2"
+    assert fake.calls == 2
+    assert elapsed < 0.5
+    assert hedges("test_hedge", "won") == won_before + 1
+
+
+def test_no_hedge_when_primary_is_fast():
+    fake = FakeUpstream(latencies=[0.0])
+    upstream = ResilientUpstream("test_fast", budget_sec=1.0, hedge_min_delay_sec=0.2)
+
+    assert asyncio.run(upstream.call(fake.request, fallback)) == "upstream-1"
+    assert fake.calls == 1
+
+
+def test_breaker_opens_after_failures_and_skips_upstream():
+    fake = FakeUpstream(fail=True)
+    breaker = CircuitBreaker("test_breaker", failure_threshold=3, open_sec=60)
+    upstream = ResilientUpstream("test_breaker", budget_sec=1.0, hedge=False, breaker=breaker)
+
+    async def run():
+        return [await upstream.call(fake.request, fallback) for _ in range(5)]
+
+    assert asyncio.run(run()) == ["fallback"] * 5
+    assert breaker.state == BREAKER_OPEN
+    # После третьей ошибки сервис больше не вызывается
+    assert fake.calls == 3
+
+
+def test_breaker_half_open_probe_closes_on_success():
+    now = [0.0]
+    fake = FakeUpstream(fail=True)
+    breaker = CircuitBreaker("test_probe", failure_threshold=1, open_sec=10, clock=lambda: now[0])
+    upstream = ResilientUpstream("test_probe", budget_sec=1.0, hedge=False, breaker=breaker)
+
+    assert asyncio.run(upstream.call(fake.request, fallback)) == "fallback"
+    assert breaker.state == BREAKER_OPEN
+    now[0] = 11.0
+    fake.fail = False
+    assert asyncio.run(upstream.call(fake.request, fallback)) == "upstream-2"
+    assert breaker.state == "closed"
+
+
+def test_expired_deadline_returns_fallback_without_calling_upstream():
+    fake = FakeUpstream(latencies=[1.0])
+    upstream = ResilientUpstream("test_deadline", budget_sec=1.0)
+
+    started_at = time.perf_counter()
+    result = asyncio.run(upstream.call(fake.request, fallback, deadline=time.time() - 1))
+
+    assert result == "fallback"
+    assert fake.calls == 0
+    assert time.perf_counter() - started_at < 0.05
+    # Дедлайн клиента - не ошибка сервиса
+    assert upstream.breaker.failures == 0
+
+
+def test_slow_upstream_returns_fallback_when_budget_runs_out():
+    fake = FakeUpstream(latencies=[5.0])
+    upstream = ResilientUpstream("test_budget", budget_sec=0.1, hedge=False)
+
+    started_at = time.perf_counter()
+    result = asyncio.run(upstream.call(fake.request, fallback))
+
+    assert result == "fallback"
+    assert time.perf_counter() - started_at < 0.5
+    assert upstream.breaker.failures == 1
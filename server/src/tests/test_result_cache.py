@@ -0,0 +1,24 @@
+import numpy as np
+
+from result_cache import AnalyzeResultCache, perceptual_hash
+
+
+def result(bbox):
+    return {"product_name": "apple", "detections": [{"bbox": bbox, "confidence": 0.9, "class_name": "apple"}]}
+
+
+def test_hit_for_resized_photo_rescales_boxes():
+    cache = AnalyzeResultCache(max_distance=0)
+    cache.put("model1", 0.25, 42, (1200, 900), result([120.0, 90.0, 600.0, 450.0]))
+
+    cached = cache.get("model1", 0.25, 42, (600, 450))
+
+    assert cached["detections"][0]["bbox"] == [60.0, 45.0, 300.0, 225.0]
+    # Запись в кэше не меняется
+    assert cache.get("model1", 0.25, 42, (1200, 900))["detections"][0]["bbox"] == [120.0, 90.0, 600.0, 450.0]
+
+
+def test_hash_ignores_resolution():
+    gradient = np.tile(np.linspace(0, 255, 1200, dtype=np.uint8), (900, 1))
+    image = np.stack([gradient] * 3, axis=-1)
+    assert perceptual_hash(image) == perceptual_hash(np.ascontiguousarray(image[::2, ::2]))
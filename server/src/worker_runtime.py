@@ -0,0 +1,199 @@
+"""
+Настройка процессов-воркеров для продакшн-запуска через gunicorn.
+
+Модели загружаются один раз в мастер-процессе (preload_app), после чего
+воркеры создаются через fork и разделяют страницы с весами copy-on-write.
+Здесь же - настройка потоков torch в каждом воркере и статистика памяти
+(RSS/PSS/USS), по которой видно, сколько памяти действительно занимает воркер.
+
+Пример:
+    python worker_runtime.py <pid мастера gunicorn>
+"""
+import gc
+import os
+import sys
+from typing import Dict, Iterable, List
+
+from prometheus_client import Gauge
+
+# Модели загружаются в мастере до fork (выставляется в gunicorn.conf.py)
+MODEL_PRELOAD_IN_MASTER = os.getenv("MODEL_PRELOAD_IN_MASTER", "false").lower() == "true"
+# Количество воркеров gunicorn на узле (для uvicorn без gunicorn - 1)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Ядер CPU на воркер (0 - поровну разделить доступные ядра между воркерами)
+TORCH_THREADS_PER_WORKER = int(os.getenv("TORCH_THREADS_PER_WORKER", "0"))
+# Привязка воркеров к ядрам: пусто - без привязки, auto - разделить ядра
+# между воркерами по номеру, либо явный список ядер ("0-3,8") для каждого воркера
+INFERENCE_CPU_AFFINITY = os.getenv("INFERENCE_CPU_AFFINITY", "")
+
+# Воркер привязан к своему набору ядер (после pin_worker)
+_pinned = False
+
+# Поля /proc/<pid>/smaps_rollup, из которых считаются RSS, PSS и USS
+_SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+WORKER_MEMORY = Gauge("worker_memory_bytes", "Память процесса воркера", ["kind"])
+
+
+def cpu_count() -> int:
+    """Количество ядер, доступных процессу (с учетом cgroup/affinity)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_cores(workers: int = WEB_CONCURRENCY) -> int:
+    """Сколько ядер приходится на этот воркер."""
+    if TORCH_THREADS_PER_WORKER > 0:
+        return TORCH_THREADS_PER_WORKER
+    if _pinned:
+        # После привязки воркеру доступны только его ядра
+        return cpu_count()
+    return max(1, cpu_count() // max(1, workers))
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Разбирает список ядер в формате "0-3,8"."""
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def pin_worker(worker_index: int, workers: int = WEB_CONCURRENCY) -> List[int]:
+    """
+    Привязывает текущий процесс к набору ядер по INFERENCE_CPU_AFFINITY.
+
+    Returns:
+        Список ядер процесса (пустой, если привязка выключена или недоступна)
+    """
+    global _pinned
+    if not INFERENCE_CPU_AFFINITY or not hasattr(os, "sched_setaffinity"):
+        return []
+    if INFERENCE_CPU_AFFINITY == "auto":
+        available = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(available) // max(1, workers))
+        start = (worker_index % max(1, workers)) * per_worker
+        cpus = available[start:start + per_worker] or available
+    else:
+        cpus = parse_cpu_list(INFERENCE_CPU_AFFINITY)
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        print(f"Не удалось привязать воркер к ядрам {cpus}: {str(e)}")
+        return []
+    _pinned = True
+    return cpus
+
+
+def configure_torch_threads(num_threads: int):
+    """Задает число потоков torch для текущего процесса."""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # interop-пул уже создан (например, в мастере до fork) - оставляем как есть
+        pass
+
+
+def share_model_memory(models: Iterable):
+    """
+    Переносит веса torch-моделей в разделяемую память перед fork.
+
+    После этого воркеры читают одни и те же страницы, даже если torch
+    что-то запишет в заголовки тензоров.
+    """
+    for model in models:
+        for module in (model, getattr(model, "model", None)):
+            if module is not None and hasattr(module, "share_memory"):
+                try:
+                    module.share_memory()
+                except Exception as e:
+                    print(f"Не удалось перенести веса в разделяемую память: {str(e)}")
+                break
+
+
+def freeze_before_fork():
+    """
+    Замораживает объекты, созданные до fork.
+
+    Сборщик мусора не будет обходить их в воркерах, а значит не будет
+    трогать их заголовки и копировать страницы.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def read_memory(pid="self") -> Dict[str, int]:
+    """
+    Статистика памяти процесса в байтах из /proc/<pid>/smaps_rollup.
+
+    Returns:
+        rss, pss (доля разделяемых страниц), uss (только собственные страницы), shared
+    """
+    values = {field: 0 for field in _SMAPS_FIELDS}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if parts and parts[0].rstrip(":") in values:
+                    values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"],
+        "shared": values["Shared_Clean"] + values["Shared_Dirty"],
+    }
+
+
+def register_memory_metrics():
+    """Память воркера обновляется при каждом сборе /metrics."""
+    for kind in ("rss", "pss", "uss", "shared"):
+        WORKER_MEMORY.labels(kind=kind).set_function(lambda kind=kind: read_memory().get(kind, 0))
+
+
+def child_pids(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Использование: python worker_runtime.py <pid мастера gunicorn>")
+        sys.exit(1)
+
+    master = int(sys.argv[1])
+    mb = 1024 * 1024
+    print(f"{'pid':>8} {'role':>7} {'RSS, МБ':>10} {'PSS, МБ':>10} {'USS, МБ':>10}")
+    totals = {"rss": 0, "pss": 0, "uss": 0}
+    for pid in [master] + child_pids(master):
+        stats = read_memory(pid)
+        if not stats:
+            continue
+        for key in totals:
+            totals[key] += stats[key]
+        role = "master" if pid == master else "worker"
+        print(f"{pid:>8} {role:>7} {stats['rss'] / mb:>10.1f} {stats['pss'] / mb:>10.1f} {stats['uss'] / mb:>10.1f}")
+    # Сумма RSS считает разделяемые веса в каждом воркере, сумма PSS - реальная память
+    print(f"{'total':>16} {totals['rss'] / mb:>10.1f} {totals['pss'] / mb:>10.1f} {totals['uss'] / mb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()